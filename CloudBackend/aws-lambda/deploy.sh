@@ -23,6 +23,12 @@ READ_HANDLER="lambda_read_metrics.lambda_handler"
 ROLE_NAME="HealthMonitorLambdaRole"
 TABLE_NAME="HealthMetrics"
 PUSH_TOKEN_TABLE="HealthPushTokens"
+# Per-user alert coalescing windows shared by ingestion and consumer
+ALERT_STATE_TABLE="HealthAlertState"
+# Hourly/daily per-user rollups written at ingestion, read by /health-data/summary
+ROLLUP_TABLE="HealthMetricRollups"
+# Per-user dataVersion bumped at ingestion; read API ETags / 304s
+USER_STATE_TABLE="HealthUserState"
 REGION="ap-south-2"
 MODEL_BUCKET="health-ml-models"
 
@@ -32,6 +38,26 @@ MODEL_KEY="gradientboosting/model.pkl"
 SCALER_KEY="gradientboosting/scaler.pkl"
 MODEL_LOCAL_PATH="../../MLPipeline/models/saved_models/best_anomaly_gradientboosting.pkl"
 SCALER_LOCAL_PATH="../../MLPipeline/models/saved_models/best_anomaly_scaler.pkl"
+# Pickle-free bundle (src/models/export_model_bundle.py); used when present
+MODEL_BUNDLE_KEY="gradientboosting/model_bundle.npz"
+MODEL_BUNDLE_LOCAL_PATH="../../MLPipeline/models/lambda_export/model_bundle.npz"
+MODEL_MANIFEST_KEY="gradientboosting/manifest.json"
+MODEL_REFRESH_SECONDS="60"
+MODEL_ENGINE="sklearn"
+# "inline" scores readings inside HealthDataIngestion (bundle/lut engine only,
+# numpy shipped as a layer); "remote" invokes HealthAnomalyInference
+INFERENCE_MODE="remote"
+# "async" acknowledges readings once stored and scores them from an SQS queue
+# consumed by HealthAnomalyConsumer; "sync" scores before responding
+ANOMALY_PIPELINE_MODE="sync"
+CONSUMER_FUNCTION_NAME="HealthAnomalyConsumer"
+CONSUMER_HANDLER="lambda_function.anomaly_queue_handler"
+ANOMALY_QUEUE_NAME="health-anomaly-scoring"
+# Delayed messages that publish coalesced alerts still pending when a
+# user's alert window closes, consumed by HealthAlertFlush
+ALERT_FLUSH_FUNCTION_NAME="HealthAlertFlush"
+ALERT_FLUSH_HANDLER="lambda_function.alert_flush_handler"
+ALERT_FLUSH_QUEUE_NAME="health-alert-flush"
 
 # Fallback anomaly models
 LEGACY_MODEL_LOCAL_PATH="../../MLPipeline/models/saved_models/isolation_forest.pkl"
@@ -70,20 +96,41 @@ echo "📋 Region: $REGION"
 # ──────────────────────────────────────────────────────────────
 echo ""
 echo "📊 Step 1: Creating DynamoDB tables..."
+# UserModifiedAtIndex (userId, modifiedAt) serves delta sync (/health-data/changes)
+SYNC_INDEX_SPEC='{"IndexName":"UserModifiedAtIndex","KeySchema":[{"AttributeName":"userId","KeyType":"HASH"},{"AttributeName":"modifiedAt","KeyType":"RANGE"}],"Projection":{"ProjectionType":"ALL"}}'
+
 aws dynamodb create-table \
     --table-name $TABLE_NAME \
     --attribute-definitions \
         AttributeName=userId,AttributeType=S \
         AttributeName=timestamp,AttributeType=N \
+        AttributeName=modifiedAt,AttributeType=N \
     --key-schema \
         AttributeName=userId,KeyType=HASH \
         AttributeName=timestamp,KeyType=RANGE \
+    --global-secondary-indexes "[$SYNC_INDEX_SPEC]" \
     --billing-mode PAY_PER_REQUEST \
     --region $REGION \
     2>/dev/null || echo "  ✓ Table $TABLE_NAME already exists"
 
 aws dynamodb wait table-exists --table-name $TABLE_NAME --region $REGION
 
+# Tables created before the index existed get it added (backfills in the background)
+aws dynamodb update-table \
+    --table-name $TABLE_NAME \
+    --attribute-definitions AttributeName=userId,AttributeType=S AttributeName=modifiedAt,AttributeType=N \
+    --global-secondary-index-updates "[{\"Create\":$SYNC_INDEX_SPEC}]" \
+    --region $REGION \
+    >/dev/null 2>&1 && echo "  ✓ Adding UserModifiedAtIndex to $TABLE_NAME" || true
+
+# The receivedAt index it replaces is dropped (DynamoDB changes one index at
+# a time, so this succeeds on a later run if the new index is still building)
+aws dynamodb update-table \
+    --table-name $TABLE_NAME \
+    --global-secondary-index-updates '[{"Delete":{"IndexName":"UserReceivedAtIndex"}}]' \
+    --region $REGION \
+    >/dev/null 2>&1 && echo "  ✓ Dropping UserReceivedAtIndex from $TABLE_NAME" || true
+
 aws dynamodb create-table \
     --table-name $PUSH_TOKEN_TABLE \
     --attribute-definitions \
@@ -98,6 +145,48 @@ aws dynamodb create-table \
 
 aws dynamodb wait table-exists --table-name $PUSH_TOKEN_TABLE --region $REGION
 
+aws dynamodb create-table \
+    --table-name $ALERT_STATE_TABLE \
+    --attribute-definitions \
+        AttributeName=userId,AttributeType=S \
+    --key-schema \
+        AttributeName=userId,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    2>/dev/null || echo "  ✓ Table $ALERT_STATE_TABLE already exists"
+
+aws dynamodb wait table-exists --table-name $ALERT_STATE_TABLE --region $REGION
+
+aws dynamodb create-table \
+    --table-name $ROLLUP_TABLE \
+    --attribute-definitions \
+        AttributeName=rollupKey,AttributeType=S \
+        AttributeName=bucketStart,AttributeType=N \
+    --key-schema \
+        AttributeName=rollupKey,KeyType=HASH \
+        AttributeName=bucketStart,KeyType=RANGE \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    2>/dev/null || echo "  ✓ Table $ROLLUP_TABLE already exists"
+
+aws dynamodb wait table-exists --table-name $ROLLUP_TABLE --region $REGION
+
+aws dynamodb create-table \
+    --table-name $USER_STATE_TABLE \
+    --attribute-definitions \
+        AttributeName=userId,AttributeType=S \
+    --key-schema \
+        AttributeName=userId,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    2>/dev/null || echo "  ✓ Table $USER_STATE_TABLE already exists"
+
+aws dynamodb wait table-exists --table-name $USER_STATE_TABLE --region $REGION
+aws dynamodb update-time-to-live \
+    --table-name $ALERT_STATE_TABLE \
+    --time-to-live-specification "Enabled=true,AttributeName=expiresAt" \
+    --region $REGION > /dev/null 2>&1 || true
+
 # ──────────────────────────────────────────────────────────────
 # Step 2: IAM Role
 # ──────────────────────────────────────────────────────────────
@@ -114,6 +203,7 @@ POLICIES=(
     "arn:aws:iam::aws:policy/AmazonDynamoDBFullAccess"
     "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
     "arn:aws:iam::aws:policy/AmazonSNSFullAccess"
+    "arn:aws:iam::aws:policy/AmazonSQSFullAccess"
 )
 for policy in "${POLICIES[@]}"; do
     aws iam attach-role-policy --role-name $ROLE_NAME --policy-arn "$policy" 2>/dev/null || true
@@ -178,6 +268,25 @@ else
     echo "    ⚠️  GradientBoosting model not found. Run: cd ../../MLPipeline && python src/tests/comprehensive_ml_test.py"
 fi
 
+if [[ -f "$MODEL_BUNDLE_LOCAL_PATH" ]]; then
+    echo "    Uploading GradientBoosting bundle (pickle-free, fast cold start)..."
+    aws s3 cp "$MODEL_BUNDLE_LOCAL_PATH" "s3://$MODEL_BUCKET/$MODEL_BUNDLE_KEY" --region "$REGION" || true
+    MODEL_ENGINE="bundle"
+    if python3 -c "import sys, numpy as np; sys.exit(0 if 'lut_values' in np.load(sys.argv[1]) else 1)" "$MODEL_BUNDLE_LOCAL_PATH" 2>/dev/null; then
+        echo "    Bundle includes a score lookup table (MODEL_ENGINE=lut)"
+        MODEL_ENGINE="lut"
+    fi
+
+    # Versioned copy + manifest: running inference Lambdas hot-swap to it
+    # within MODEL_REFRESH_SECONDS, no redeploy needed
+    MODEL_VERSION=$(python3 -c "import json, sys, numpy as np; print(json.loads(np.load(sys.argv[1])['metadata'].tobytes())['model_version'])" "$MODEL_BUNDLE_LOCAL_PATH" 2>/dev/null || date +%Y%m%d-%H%M%S)
+    MODEL_VERSION_KEY="gradientboosting/versions/$MODEL_VERSION/model_bundle.npz"
+    aws s3 cp "$MODEL_BUNDLE_LOCAL_PATH" "s3://$MODEL_BUCKET/$MODEL_VERSION_KEY" --region "$REGION" || true
+    echo "{\"version\":\"$MODEL_VERSION\",\"key\":\"$MODEL_VERSION_KEY\"}" | \
+        aws s3 cp - "s3://$MODEL_BUCKET/$MODEL_MANIFEST_KEY" --content-type application/json --region "$REGION" || true
+    echo "    ✓ Model version $MODEL_VERSION published via s3://$MODEL_BUCKET/$MODEL_MANIFEST_KEY"
+fi
+
 # RandomForest (F1=0.983)
 if [[ -f "$RF_MODEL_LOCAL" ]]; then
     echo "    Uploading RandomForest (F1=0.983)..."
@@ -225,8 +334,61 @@ echo ""
 echo "☁️  Step 6: Deploying Lambda functions..."
 ROLE_ARN="arn:aws:iam::${ACCOUNT_ID}:role/${ROLE_NAME}"
 
+# numpy layer shared by inline inference and the read API's aggregation;
+# built and published at most once per deploy
+LAYER_ARN=""
+publish_numpy_layer() {
+    if [[ -n "$LAYER_ARN" ]]; then
+        return
+    fi
+    rm -rf "$LAYER_DIR" "$LAYER_ZIP"
+    pip install -q numpy --platform manylinux2014_x86_64 --only-binary=:all: \
+        --python-version 3.9 --target "$LAYER_DIR/python"
+    (cd "$LAYER_DIR" && zip -qr "../$LAYER_ZIP" python)
+    LAYER_ARN=$(aws lambda publish-layer-version \
+        --layer-name $LAYER_NAME \
+        --zip-file fileb://$LAYER_ZIP \
+        --compatible-runtimes $RUNTIME \
+        --region $REGION \
+        --query 'LayerVersionArn' --output text)
+}
+
 # 6a: Data Ingestion Lambda
 echo "  📤 HealthDataIngestion..."
+INGESTION_MODEL_ENV=""
+INGESTION_LAYER_ARN=""
+if [[ "$INFERENCE_MODE" == "inline" ]]; then
+    if [[ "$MODEL_ENGINE" == "bundle" || "$MODEL_ENGINE" == "lut" ]]; then
+        echo "    Inline inference: bundling detector code + numpy layer..."
+        zip -j function.zip lambda_inference_sklearn.py > /dev/null
+        publish_numpy_layer
+        INGESTION_LAYER_ARN="$LAYER_ARN"
+        INGESTION_MODEL_ENV=",\"INFERENCE_MODE\":\"inline\",\"MODEL_BUCKET\":\"$MODEL_BUCKET\",\"MODEL_ENGINE\":\"$MODEL_ENGINE\",\"MODEL_BUNDLE_KEY\":\"$MODEL_BUNDLE_KEY\",\"MODEL_MANIFEST_KEY\":\"$MODEL_MANIFEST_KEY\",\"MODEL_REFRESH_SECONDS\":\"$MODEL_REFRESH_SECONDS\""
+    else
+        echo "    ⚠️  INFERENCE_MODE=inline needs the model bundle; keeping remote inference"
+    fi
+fi
+ALERT_FLUSH_QUEUE_URL=$(aws sqs create-queue --queue-name "$ALERT_FLUSH_QUEUE_NAME" \
+    --attributes '{"VisibilityTimeout":"60"}' \
+    --region $REGION --query 'QueueUrl' --output text)
+ALERT_FLUSH_QUEUE_ARN=$(aws sqs get-queue-attributes --queue-url "$ALERT_FLUSH_QUEUE_URL" --attribute-names QueueArn \
+    --region $REGION --query 'Attributes.QueueArn' --output text)
+ALERT_FLUSH_ENV=",\"ALERT_FLUSH_QUEUE_URL\":\"$ALERT_FLUSH_QUEUE_URL\""
+echo "    ✓ Alert flush queue: $ALERT_FLUSH_QUEUE_URL"
+INGESTION_PIPELINE_ENV=""
+if [[ "$ANOMALY_PIPELINE_MODE" == "async" ]]; then
+    DLQ_URL=$(aws sqs create-queue --queue-name "${ANOMALY_QUEUE_NAME}-dlq" \
+        --region $REGION --query 'QueueUrl' --output text)
+    DLQ_ARN=$(aws sqs get-queue-attributes --queue-url "$DLQ_URL" --attribute-names QueueArn \
+        --region $REGION --query 'Attributes.QueueArn' --output text)
+    ANOMALY_QUEUE_URL=$(aws sqs create-queue --queue-name "$ANOMALY_QUEUE_NAME" \
+        --attributes "{\"VisibilityTimeout\":\"180\",\"RedrivePolicy\":\"{\\\"deadLetterTargetArn\\\":\\\"$DLQ_ARN\\\",\\\"maxReceiveCount\\\":\\\"5\\\"}\"}" \
+        --region $REGION --query 'QueueUrl' --output text)
+    ANOMALY_QUEUE_ARN=$(aws sqs get-queue-attributes --queue-url "$ANOMALY_QUEUE_URL" --attribute-names QueueArn \
+        --region $REGION --query 'Attributes.QueueArn' --output text)
+    INGESTION_PIPELINE_ENV=",\"ANOMALY_PIPELINE_MODE\":\"async\",\"ANOMALY_QUEUE_URL\":\"$ANOMALY_QUEUE_URL\""
+    echo "    ✓ Anomaly queue: $ANOMALY_QUEUE_URL"
+fi
 if aws lambda get-function --function-name $FUNCTION_NAME --region $REGION &>/dev/null; then
     aws lambda update-function-code \
         --function-name $FUNCTION_NAME \
@@ -241,10 +403,53 @@ else
         --zip-file fileb://function.zip \
         --timeout 30 \
         --memory-size 512 \
-        --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"PUSH_TOKEN_TABLE\":\"$PUSH_TOKEN_TABLE\",\"REGION\":\"$REGION\",\"CLOUD_INFERENCE_FUNCTION\":\"$INFERENCE_FUNCTION_NAME\"}}" \
+        --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"PUSH_TOKEN_TABLE\":\"$PUSH_TOKEN_TABLE\",\"ALERT_STATE_TABLE\":\"$ALERT_STATE_TABLE\",\"ROLLUP_TABLE\":\"$ROLLUP_TABLE\",\"USER_STATE_TABLE\":\"$USER_STATE_TABLE\",\"REGION\":\"$REGION\",\"CLOUD_INFERENCE_FUNCTION\":\"$INFERENCE_FUNCTION_NAME\"$INGESTION_MODEL_ENV$INGESTION_PIPELINE_ENV$ALERT_FLUSH_ENV}}" \
+        --region $REGION > /dev/null
+fi
+if [[ -n "$INGESTION_LAYER_ARN" ]]; then
+    aws lambda wait function-updated --function-name $FUNCTION_NAME --region $REGION
+    aws lambda update-function-configuration \
+        --function-name $FUNCTION_NAME \
+        --layers "$INGESTION_LAYER_ARN" \
         --region $REGION > /dev/null
 fi
 
+# 6a-2: Anomaly queue consumer (async pipeline only; same package as ingestion)
+if [[ "$ANOMALY_PIPELINE_MODE" == "async" ]]; then
+    echo "  📤 $CONSUMER_FUNCTION_NAME (anomaly queue consumer)..."
+    if aws lambda get-function --function-name $CONSUMER_FUNCTION_NAME --region $REGION &>/dev/null; then
+        aws lambda update-function-code \
+            --function-name $CONSUMER_FUNCTION_NAME \
+            --zip-file fileb://function.zip \
+            --region $REGION > /dev/null
+    else
+        aws lambda create-function \
+            --function-name $CONSUMER_FUNCTION_NAME \
+            --runtime $RUNTIME \
+            --role $ROLE_ARN \
+            --handler $CONSUMER_HANDLER \
+            --zip-file fileb://function.zip \
+            --timeout 30 \
+            --memory-size 512 \
+            --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"PUSH_TOKEN_TABLE\":\"$PUSH_TOKEN_TABLE\",\"ALERT_STATE_TABLE\":\"$ALERT_STATE_TABLE\",\"ROLLUP_TABLE\":\"$ROLLUP_TABLE\",\"USER_STATE_TABLE\":\"$USER_STATE_TABLE\",\"REGION\":\"$REGION\",\"CLOUD_INFERENCE_FUNCTION\":\"$INFERENCE_FUNCTION_NAME\"$INGESTION_MODEL_ENV$ALERT_FLUSH_ENV}}" \
+            --region $REGION > /dev/null
+    fi
+    if [[ -n "$INGESTION_LAYER_ARN" ]]; then
+        aws lambda wait function-updated --function-name $CONSUMER_FUNCTION_NAME --region $REGION
+        aws lambda update-function-configuration \
+            --function-name $CONSUMER_FUNCTION_NAME \
+            --layers "$INGESTION_LAYER_ARN" \
+            --region $REGION > /dev/null
+    fi
+    aws lambda create-event-source-mapping \
+        --function-name $CONSUMER_FUNCTION_NAME \
+        --event-source-arn "$ANOMALY_QUEUE_ARN" \
+        --batch-size 100 \
+        --maximum-batching-window-in-seconds 1 \
+        --function-response-types ReportBatchItemFailures \
+        --region $REGION > /dev/null 2>&1 || echo "    ✓ Queue trigger already exists"
+fi
+
 # 6b: Anomaly Inference Lambda (Container Image)
 echo "  📤 HealthAnomalyInference (container)..."
 if aws lambda get-function --function-name $INFERENCE_FUNCTION_NAME --region $REGION &>/dev/null; then
@@ -269,7 +474,7 @@ else
         --role $ROLE_ARN \
         --timeout 30 \
         --memory-size 1024 \
-        --environment "{\"Variables\":{\"MODEL_BUCKET\":\"$MODEL_BUCKET\",\"MODEL_KEY\":\"$MODEL_KEY\",\"SCALER_KEY\":\"$SCALER_KEY\"}}" \
+        --environment "{\"Variables\":{\"MODEL_BUCKET\":\"$MODEL_BUCKET\",\"MODEL_KEY\":\"$MODEL_KEY\",\"SCALER_KEY\":\"$SCALER_KEY\",\"MODEL_ENGINE\":\"$MODEL_ENGINE\",\"MODEL_BUNDLE_KEY\":\"$MODEL_BUNDLE_KEY\",\"MODEL_MANIFEST_KEY\":\"$MODEL_MANIFEST_KEY\",\"MODEL_REFRESH_SECONDS\":\"$MODEL_REFRESH_SECONDS\"}}" \
         --region $REGION > /dev/null
 fi
 
@@ -309,9 +514,17 @@ else
         --zip-file fileb://read.zip \
         --timeout 30 \
         --memory-size 256 \
-        --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"REGION\":\"$REGION\"}}" \
+        --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"ROLLUP_TABLE\":\"$ROLLUP_TABLE\",\"USER_STATE_TABLE\":\"$USER_STATE_TABLE\",\"REGION\":\"$REGION\"}}" \
         --region $REGION > /dev/null
 fi
+# /health-data/aggregate computes bucket statistics with numpy
+echo "    Attaching numpy layer for aggregation..."
+publish_numpy_layer
+aws lambda wait function-updated --function-name $READ_FUNCTION_NAME --region $REGION
+aws lambda update-function-configuration \
+    --function-name $READ_FUNCTION_NAME \
+    --layers "$LAYER_ARN" \
+    --region $REGION > /dev/null
 
 # ──────────────────────────────────────────────────────────────
 # Step 7: API Gateway (reuse existing or create new)
@@ -339,6 +552,12 @@ fi
 
 echo "  📝 API Gateway ID: $API_ID"
 
+# gzip responses over 1 KB for clients sending Accept-Encoding: gzip
+aws apigateway update-rest-api \
+    --rest-api-id $API_ID \
+    --patch-operations op=replace,path=/minimumCompressionSize,value=1024 \
+    --region $REGION > /dev/null
+
 # Clean up any duplicate API Gateways (keep only the latest)
 DUPLICATE_API_IDS=$(aws apigateway get-rest-apis \
     --query "items[?name=='${API_NAME}'] | sort_by(@, &createdDate) | [:-1].id" \
@@ -388,8 +607,13 @@ HEALTH_DATA_ID=$(create_or_get_resource "$ROOT_ID" "health-data" "/health-data")
 INGEST_ID=$(create_or_get_resource "$HEALTH_DATA_ID" "ingest" "/health-data/ingest")
 SYNC_ID=$(create_or_get_resource "$HEALTH_DATA_ID" "sync" "/health-data/sync")
 HISTORY_ID=$(create_or_get_resource "$HEALTH_DATA_ID" "history" "/health-data/history")
+CHANGES_ID=$(create_or_get_resource "$HEALTH_DATA_ID" "changes" "/health-data/changes")
+AGGREGATE_ID=$(create_or_get_resource "$HEALTH_DATA_ID" "aggregate" "/health-data/aggregate")
+SUMMARY_ID=$(create_or_get_resource "$HEALTH_DATA_ID" "summary" "/health-data/summary")
 HEALTH_ID=$(create_or_get_resource "$ROOT_ID" "health" "/health")
 METRICS_ID=$(create_or_get_resource "$HEALTH_ID" "metrics" "/health/metrics")
+BULK_ID=$(create_or_get_resource "$METRICS_ID" "bulk" "/health/metrics/bulk")
+CURRENT_ID=$(create_or_get_resource "$HEALTH_ID" "current" "/health/current")
 NOTIFY_PARENT_ID=$(create_or_get_resource "$ROOT_ID" "notifications" "/notifications")
 REGISTER_ID=$(create_or_get_resource "$NOTIFY_PARENT_ID" "register" "/notifications/register")
 
@@ -454,7 +678,7 @@ setup_cors_options() {
         --resource-id $resource_id \
         --http-method OPTIONS \
         --status-code 200 \
-        --response-parameters '{"method.response.header.Access-Control-Allow-Headers":"'\''Content-Type,X-API-Key'\''","method.response.header.Access-Control-Allow-Methods":"'\''GET,POST,OPTIONS'\''","method.response.header.Access-Control-Allow-Origin":"'\''*'\''"}' \
+        --response-parameters '{"method.response.header.Access-Control-Allow-Headers":"'\''Content-Type,X-API-Key,If-None-Match'\''","method.response.header.Access-Control-Allow-Methods":"'\''GET,POST,OPTIONS'\''","method.response.header.Access-Control-Allow-Origin":"'\''*'\''"}' \
         --region $REGION \
         2>/dev/null || true
 }
@@ -465,13 +689,18 @@ setup_method "$INGEST_ID" "POST" "$FUNCTION_NAME"
 setup_method "$SYNC_ID" "POST" "$FUNCTION_NAME"
 setup_method "$SYNC_ID" "GET" "$READ_FUNCTION_NAME"
 setup_method "$HISTORY_ID" "GET" "$READ_FUNCTION_NAME"
+setup_method "$CHANGES_ID" "GET" "$READ_FUNCTION_NAME"
+setup_method "$AGGREGATE_ID" "GET" "$READ_FUNCTION_NAME"
+setup_method "$SUMMARY_ID" "GET" "$READ_FUNCTION_NAME"
 setup_method "$HEALTH_ID" "GET" "$READ_FUNCTION_NAME"
 setup_method "$METRICS_ID" "GET" "$READ_FUNCTION_NAME"
+setup_method "$BULK_ID" "GET" "$READ_FUNCTION_NAME"
+setup_method "$CURRENT_ID" "GET" "$READ_FUNCTION_NAME"
 setup_method "$REGISTER_ID" "POST" "$FUNCTION_NAME"
 
 # Enable CORS preflight (OPTIONS) on all routes
 echo "  Setting up CORS OPTIONS..."
-for rid in "$INGEST_ID" "$SYNC_ID" "$HISTORY_ID" "$HEALTH_ID" "$METRICS_ID" "$REGISTER_ID"; do
+for rid in "$INGEST_ID" "$SYNC_ID" "$HISTORY_ID" "$CHANGES_ID" "$AGGREGATE_ID" "$SUMMARY_ID" "$HEALTH_ID" "$METRICS_ID" "$BULK_ID" "$CURRENT_ID" "$REGISTER_ID"; do
     setup_cors_options "$rid"
 done
 
@@ -576,19 +805,58 @@ sleep 5
 
 aws lambda update-function-configuration \
     --function-name $FUNCTION_NAME \
-    --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"PUSH_TOKEN_TABLE\":\"$PUSH_TOKEN_TABLE\",\"REGION\":\"$REGION\",\"API_KEY\":\"$API_KEY_VALUE\",\"SNS_TOPIC_ARN\":\"$SNS_TOPIC_ARN\",\"CLOUD_INFERENCE_FUNCTION\":\"$INFERENCE_FUNCTION_NAME\"}}" \
+    --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"PUSH_TOKEN_TABLE\":\"$PUSH_TOKEN_TABLE\",\"ALERT_STATE_TABLE\":\"$ALERT_STATE_TABLE\",\"ROLLUP_TABLE\":\"$ROLLUP_TABLE\",\"USER_STATE_TABLE\":\"$USER_STATE_TABLE\",\"REGION\":\"$REGION\",\"API_KEY\":\"$API_KEY_VALUE\",\"SNS_TOPIC_ARN\":\"$SNS_TOPIC_ARN\",\"CLOUD_INFERENCE_FUNCTION\":\"$INFERENCE_FUNCTION_NAME\"$INGESTION_MODEL_ENV$INGESTION_PIPELINE_ENV$ALERT_FLUSH_ENV}}" \
     --region $REGION > /dev/null
 
+if [[ "$ANOMALY_PIPELINE_MODE" == "async" ]]; then
+    aws lambda update-function-configuration \
+        --function-name $CONSUMER_FUNCTION_NAME \
+        --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"PUSH_TOKEN_TABLE\":\"$PUSH_TOKEN_TABLE\",\"ALERT_STATE_TABLE\":\"$ALERT_STATE_TABLE\",\"ROLLUP_TABLE\":\"$ROLLUP_TABLE\",\"USER_STATE_TABLE\":\"$USER_STATE_TABLE\",\"REGION\":\"$REGION\",\"SNS_TOPIC_ARN\":\"$SNS_TOPIC_ARN\",\"CLOUD_INFERENCE_FUNCTION\":\"$INFERENCE_FUNCTION_NAME\"$INGESTION_MODEL_ENV$ALERT_FLUSH_ENV}}" \
+        --region $REGION > /dev/null
+fi
+
+# Alert flush consumer (same package as ingestion; needs the SNS topic)
+echo "  📤 $ALERT_FLUSH_FUNCTION_NAME (alert flush consumer)..."
+ALERT_FLUSH_VARIABLES="{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"PUSH_TOKEN_TABLE\":\"$PUSH_TOKEN_TABLE\",\"ALERT_STATE_TABLE\":\"$ALERT_STATE_TABLE\",\"REGION\":\"$REGION\",\"SNS_TOPIC_ARN\":\"$SNS_TOPIC_ARN\"}}"
+if aws lambda get-function --function-name $ALERT_FLUSH_FUNCTION_NAME --region $REGION &>/dev/null; then
+    aws lambda update-function-code \
+        --function-name $ALERT_FLUSH_FUNCTION_NAME \
+        --zip-file fileb://function.zip \
+        --region $REGION > /dev/null
+    aws lambda wait function-updated --function-name $ALERT_FLUSH_FUNCTION_NAME --region $REGION
+    aws lambda update-function-configuration \
+        --function-name $ALERT_FLUSH_FUNCTION_NAME \
+        --environment "$ALERT_FLUSH_VARIABLES" \
+        --region $REGION > /dev/null
+else
+    aws lambda create-function \
+        --function-name $ALERT_FLUSH_FUNCTION_NAME \
+        --runtime $RUNTIME \
+        --role $ROLE_ARN \
+        --handler $ALERT_FLUSH_HANDLER \
+        --zip-file fileb://function.zip \
+        --timeout 30 \
+        --memory-size 256 \
+        --environment "$ALERT_FLUSH_VARIABLES" \
+        --region $REGION > /dev/null
+fi
+aws lambda create-event-source-mapping \
+    --function-name $ALERT_FLUSH_FUNCTION_NAME \
+    --event-source-arn "$ALERT_FLUSH_QUEUE_ARN" \
+    --batch-size 10 \
+    --function-response-types ReportBatchItemFailures \
+    --region $REGION > /dev/null 2>&1 || echo "    ✓ Alert flush trigger already exists"
+
 aws lambda update-function-configuration \
     --function-name $READ_FUNCTION_NAME \
-    --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"REGION\":\"$REGION\",\"API_KEY\":\"$API_KEY_VALUE\"}}" \
+    --environment "{\"Variables\":{\"TABLE_NAME\":\"$TABLE_NAME\",\"ROLLUP_TABLE\":\"$ROLLUP_TABLE\",\"USER_STATE_TABLE\":\"$USER_STATE_TABLE\",\"REGION\":\"$REGION\",\"API_KEY\":\"$API_KEY_VALUE\"}}" \
     --region $REGION > /dev/null
 
 # Update inference Lambda to use Gradient Boosting model
 sleep 5
 aws lambda update-function-configuration \
     --function-name $INFERENCE_FUNCTION_NAME \
-    --environment "{\"Variables\":{\"MODEL_BUCKET\":\"$MODEL_BUCKET\",\"MODEL_KEY\":\"$MODEL_KEY\",\"SCALER_KEY\":\"$SCALER_KEY\"}}" \
+    --environment "{\"Variables\":{\"MODEL_BUCKET\":\"$MODEL_BUCKET\",\"MODEL_KEY\":\"$MODEL_KEY\",\"SCALER_KEY\":\"$SCALER_KEY\",\"MODEL_ENGINE\":\"$MODEL_ENGINE\",\"MODEL_BUNDLE_KEY\":\"$MODEL_BUNDLE_KEY\",\"MODEL_MANIFEST_KEY\":\"$MODEL_MANIFEST_KEY\",\"MODEL_REFRESH_SECONDS\":\"$MODEL_REFRESH_SECONDS\"}}" \
     --region $REGION > /dev/null
 
 # Add API Gateway invoke permissions
@@ -624,7 +892,12 @@ echo "   POST ${API_BASE}/health-data/ingest"
 echo "   POST ${API_BASE}/health-data/sync"
 echo "   GET  ${API_BASE}/health-data/sync"
 echo "   GET  ${API_BASE}/health-data/history"
+echo "   GET  ${API_BASE}/health-data/changes"
+echo "   GET  ${API_BASE}/health-data/aggregate"
+echo "   GET  ${API_BASE}/health-data/summary"
 echo "   GET  ${API_BASE}/health/metrics"
+echo "   GET  ${API_BASE}/health/metrics/bulk"
+echo "   GET  ${API_BASE}/health/current"
 echo "   GET  ${API_BASE}/health"
 echo "   POST ${API_BASE}/notifications/register"
 echo ""
@@ -635,6 +908,7 @@ echo "   $FUNCTION_NAME (Zip, 512MB)"
 echo "   $INFERENCE_FUNCTION_NAME (Container, 1024MB)"
 echo "   $NOTIFY_FUNCTION_NAME (Zip, 256MB)"
 echo "   $READ_FUNCTION_NAME (Zip, 256MB)"
+echo "   $ALERT_FLUSH_FUNCTION_NAME (Zip, 256MB)"
 echo ""
 echo "🧠 ML Models:"
 echo "   Anomaly:  GradientBoosting (F1=0.995) → s3://$MODEL_BUCKET/gradientboosting/"
@@ -644,7 +918,7 @@ echo ""
 echo "📝 Features:"
 echo "   Anomaly Explainability: anomalyReasons + featureContributions in responses"
 echo ""
-echo "📊 DynamoDB: $TABLE_NAME, $PUSH_TOKEN_TABLE"
+echo "📊 DynamoDB: $TABLE_NAME, $PUSH_TOKEN_TABLE, $ALERT_STATE_TABLE, $ROLLUP_TABLE, $USER_STATE_TABLE"
 echo "📣 SNS: $SNS_TOPIC_ARN"
 echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
 echo ""
@@ -661,4 +935,4 @@ echo "     -d @test-payload.json"
 echo ""
 
 # Cleanup
-rm -rf package function.zip notify.zip read.zip
+rm -rf package function.zip notify.zip read.zip "$LAYER_DIR" "$LAYER_ZIP"
@@ -17,9 +17,16 @@ FUNCTION_NAME="HealthDataIngestion"
 INFERENCE_FUNCTION_NAME="HealthAnomalyInference"
 NOTIFY_FUNCTION_NAME="HealthSnsToExpo"
 READ_FUNCTION_NAME="HealthReadMetrics"
+CONSUMER_FUNCTION_NAME="HealthAnomalyConsumer"
+ANOMALY_QUEUE_NAME="health-anomaly-scoring"
+ALERT_FLUSH_FUNCTION_NAME="HealthAlertFlush"
+ALERT_FLUSH_QUEUE_NAME="health-alert-flush"
 ROLE_NAME="HealthMonitorLambdaRole"
 TABLE_NAME="HealthMetrics"
 PUSH_TOKEN_TABLE="HealthPushTokens"
+ALERT_STATE_TABLE="HealthAlertState"
+ROLLUP_TABLE="HealthMetricRollups"
+USER_STATE_TABLE="HealthUserState"
 REGION="ap-south-2"
 MODEL_BUCKET="health-ml-models"
 SNS_TOPIC_NAME="health-alerts"
@@ -120,12 +127,28 @@ aws lambda remove-permission \
     --statement-id apigateway-invoke-read \
     --region $REGION 2>/dev/null || true
 
+# Event source mappings keep polling their queues until removed
+for fn in "$CONSUMER_FUNCTION_NAME" "$ALERT_FLUSH_FUNCTION_NAME"; do
+    MAPPING_UUIDS=$(aws lambda list-event-source-mappings \
+        --function-name "$fn" \
+        --query 'EventSourceMappings[*].UUID' \
+        --output text \
+        --region $REGION 2>/dev/null || true)
+
+    if [[ -n "$MAPPING_UUIDS" && "$MAPPING_UUIDS" != "None" ]]; then
+        for uuid in $MAPPING_UUIDS; do
+            echo "  Deleting event source mapping: $uuid"
+            aws lambda delete-event-source-mapping --uuid "$uuid" --region $REGION > /dev/null 2>&1 || true
+        done
+    fi
+done
+
 # ──────────────────────────────────────────────────────────────
 # Step 4: Delete Lambda Functions
 # ──────────────────────────────────────────────────────────────
 echo ""
 echo "🗑️  Step 4: Deleting Lambda functions..."
-for fn in "$FUNCTION_NAME" "$INFERENCE_FUNCTION_NAME" "$NOTIFY_FUNCTION_NAME" "$READ_FUNCTION_NAME"; do
+for fn in "$FUNCTION_NAME" "$INFERENCE_FUNCTION_NAME" "$NOTIFY_FUNCTION_NAME" "$READ_FUNCTION_NAME" "$CONSUMER_FUNCTION_NAME" "$ALERT_FLUSH_FUNCTION_NAME"; do
     if aws lambda get-function --function-name "$fn" --region $REGION &>/dev/null; then
         echo "  Deleting: $fn"
         aws lambda delete-function --function-name "$fn" --region $REGION || true
@@ -139,7 +162,7 @@ done
 # ──────────────────────────────────────────────────────────────
 echo ""
 echo "🗑️  Step 5: Deleting CloudWatch log groups..."
-for lg in "/aws/lambda/$FUNCTION_NAME" "/aws/lambda/$INFERENCE_FUNCTION_NAME" "/aws/lambda/$NOTIFY_FUNCTION_NAME" "/aws/lambda/$READ_FUNCTION_NAME"; do
+for lg in "/aws/lambda/$FUNCTION_NAME" "/aws/lambda/$INFERENCE_FUNCTION_NAME" "/aws/lambda/$NOTIFY_FUNCTION_NAME" "/aws/lambda/$READ_FUNCTION_NAME" "/aws/lambda/$CONSUMER_FUNCTION_NAME" "/aws/lambda/$ALERT_FLUSH_FUNCTION_NAME"; do
     aws logs delete-log-group --log-group-name "$lg" --region $REGION 2>/dev/null || true
     echo "  Deleted: $lg"
 done
@@ -214,12 +237,31 @@ else
     echo "  No SNS topic found"
 fi
 
+# ──────────────────────────────────────────────────────────────
+# Step 8b: Delete SQS Queues (anomaly scoring + DLQ, alert flush)
+# ──────────────────────────────────────────────────────────────
+echo ""
+echo "🗑️  Step 8b: Deleting SQS queues..."
+for queue in "$ANOMALY_QUEUE_NAME" "${ANOMALY_QUEUE_NAME}-dlq" "$ALERT_FLUSH_QUEUE_NAME"; do
+    QUEUE_URL=$(aws sqs get-queue-url \
+        --queue-name "$queue" \
+        --query QueueUrl \
+        --output text \
+        --region $REGION 2>/dev/null || true)
+    if [[ -n "$QUEUE_URL" && "$QUEUE_URL" != "None" ]]; then
+        echo "  Deleting: $queue"
+        aws sqs delete-queue --queue-url "$QUEUE_URL" --region $REGION || true
+    else
+        echo "  Not found: $queue"
+    fi
+done
+
 # ──────────────────────────────────────────────────────────────
 # Step 9: Delete DynamoDB Tables
 # ──────────────────────────────────────────────────────────────
 echo ""
 echo "🗑️  Step 9: Deleting DynamoDB tables..."
-for table in "$TABLE_NAME" "$PUSH_TOKEN_TABLE"; do
+for table in "$TABLE_NAME" "$PUSH_TOKEN_TABLE" "$ALERT_STATE_TABLE" "$ROLLUP_TABLE" "$USER_STATE_TABLE"; do
     if aws dynamodb describe-table --table-name "$table" --region $REGION &>/dev/null; then
         echo "  Deleting: $table"
         aws dynamodb delete-table --table-name "$table" --region $REGION > /dev/null || true
@@ -270,11 +312,12 @@ echo ""
 echo "✅ Destroy complete!"
 echo ""
 echo "Resources removed:"
-echo "  • Lambda: $FUNCTION_NAME, $INFERENCE_FUNCTION_NAME, $NOTIFY_FUNCTION_NAME, $READ_FUNCTION_NAME"
-echo "  • DynamoDB: $TABLE_NAME, $PUSH_TOKEN_TABLE"
+echo "  • Lambda: $FUNCTION_NAME, $INFERENCE_FUNCTION_NAME, $NOTIFY_FUNCTION_NAME, $READ_FUNCTION_NAME, $CONSUMER_FUNCTION_NAME, $ALERT_FLUSH_FUNCTION_NAME"
+echo "  • DynamoDB: $TABLE_NAME, $PUSH_TOKEN_TABLE, $ALERT_STATE_TABLE, $ROLLUP_TABLE, $USER_STATE_TABLE"
 echo "  • API Gateway: $API_NAME (all instances)"
 echo "  • S3: $MODEL_BUCKET (gradientboosting/, randomforest/, xgboost/, extratrees/, isolation_forest/, activity/)"
 echo "  • SNS: $SNS_TOPIC_NAME"
+echo "  • SQS: $ANOMALY_QUEUE_NAME, ${ANOMALY_QUEUE_NAME}-dlq, $ALERT_FLUSH_QUEUE_NAME"
 echo "  • ECR: $ECR_REPO_NAME"
 echo "  • IAM Role: $ROLE_NAME"
 echo "  • CloudWatch Logs: all Lambda log groups"
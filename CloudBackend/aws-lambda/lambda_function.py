@@ -1,9 +1,17 @@
 import json
 import boto3
 import logging
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
+import operator
 import os
+import threading
+import time
 
 # Configure logging
 logger = logging.getLogger()
@@ -11,16 +19,97 @@ logger.setLevel(logging.INFO)
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
-lambda_client = boto3.client('lambda')
+# Bound the synchronous inference call so a slow or cold inference function
+# cannot hold up ingestion; on timeout we fall back to threshold detection.
+CLOUD_INFERENCE_TIMEOUT = float(os.environ.get('CLOUD_INFERENCE_TIMEOUT', '5'))
+lambda_client = boto3.client(
+    'lambda',
+    config=Config(
+        connect_timeout=2,
+        read_timeout=CLOUD_INFERENCE_TIMEOUT,
+        retries={'max_attempts': 0}
+    )
+)
 sns_client = boto3.client('sns')
+sqs_client = boto3.client('sqs')
 table_name = os.environ.get('TABLE_NAME', 'HealthMetrics')
 table = dynamodb.Table(table_name)
 push_table_name = os.environ.get('PUSH_TOKEN_TABLE', 'HealthPushTokens')
 push_table = dynamodb.Table(push_table_name)
+# Per-user item listing every token, read by sns_to_expo with BatchGetItem
+PUSH_TOKEN_SUMMARY_DEVICE = '#tokens'
+PUSH_TOKEN_SUMMARY_RETRIES = 3
 cloud_inference_function = os.environ.get('CLOUD_INFERENCE_FUNCTION', '').strip()
 sns_topic_arn = os.environ.get('SNS_TOPIC_ARN', '').strip()
 expected_api_key = os.environ.get('API_KEY', '').strip()
 
+# Maximum metrics sent to the inference Lambda in one invocation
+CLOUD_INFERENCE_BATCH_SIZE = int(os.environ.get('CLOUD_INFERENCE_BATCH_SIZE', '500'))
+
+# 'remote' invokes CLOUD_INFERENCE_FUNCTION; 'inline' loads the detector from
+# lambda_inference_sklearn.py into this process (falling back to remote if it
+# cannot be loaded). A failed load is retried after INLINE_MODEL_RETRY_SECONDS.
+INFERENCE_MODE = os.environ.get('INFERENCE_MODE', 'remote').strip().lower()
+INLINE_MODEL_RETRY_SECONDS = float(os.environ.get('INLINE_MODEL_RETRY_SECONDS', '300'))
+_inline_inference = None
+_inline_failed_at = None
+
+# 'sync' scores readings before responding; 'async' persists and acknowledges
+# them first and leaves scoring/notification to anomaly_queue_handler, fed
+# through ANOMALY_QUEUE_URL (SQS SendMessageBatch takes at most 10 entries)
+ANOMALY_PIPELINE_MODE = os.environ.get('ANOMALY_PIPELINE_MODE', 'sync').strip().lower()
+anomaly_queue_url = os.environ.get('ANOMALY_QUEUE_URL', '').strip()
+QUEUE_SEND_BATCH_SIZE = 10
+
+# BatchWriteItem accepts at most 25 put requests per call, BatchGetItem
+# at most 100 keys
+BATCH_WRITE_CHUNK_SIZE = 25
+BATCH_GET_MAX_KEYS = 100
+BATCH_WRITE_MAX_RETRIES = int(os.environ.get('BATCH_WRITE_MAX_RETRIES', '5'))
+BATCH_WRITE_BASE_DELAY = 0.05
+
+# Upper bound on concurrent AWS calls (BatchWriteItem chunks, inference
+# invocations, queue sends, notifications) made while handling one batch.
+# 1 issues them one after another.
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+
+# Anomaly alerts are coalesced per user: the first anomaly in a window of
+# ALERT_COALESCE_SECONDS is published, later ones are counted and folded
+# into the user's next published alert (0 publishes every anomaly).
+# ALERT_STATE_TABLE shares the windows across containers; without it each
+# container keeps its own. With ALERT_FLUSH_QUEUE_URL set, the first
+# suppressed anomaly of a window also sends a message delayed until the
+# window closes, and alert_flush_handler publishes whatever is still
+# pending then (SQS caps DelaySeconds at 900).
+ALERT_COALESCE_SECONDS = float(os.environ.get('ALERT_COALESCE_SECONDS', '300'))
+ALERT_TOP_REASONS = 3
+alert_state_table_name = os.environ.get('ALERT_STATE_TABLE', '').strip()
+alert_flush_queue_url = os.environ.get('ALERT_FLUSH_QUEUE_URL', '').strip()
+ALERT_FLUSH_MAX_DELAY = 900
+_alert_coalescer = None
+
+# Hourly and daily per-user rollups (ROLLUP_TABLE, keyed by
+# "<userId>#<granularity>" + bucketStart in epoch seconds) are updated with
+# atomic ADDs once a reading and its verdict are stored, one update per
+# bucket per batch. Unset disables rollups.
+rollup_table_name = os.environ.get('ROLLUP_TABLE', '').strip()
+ROLLUP_GRANULARITIES = {'1h': 3600, '1d': 86400}
+
+# Per-user state (USER_STATE_TABLE, keyed by userId). Every write of a
+# user's readings ADDs to its dataVersion, which the read API turns into
+# ETags for conditional GETs, and refreshes the current state served by
+# /health/current: the newest reading, the newest anomaly and the activity
+# state with the timestamp it started at. Unset disables it.
+user_state_table_name = os.environ.get('USER_STATE_TABLE', '').strip()
+# Item attributes copied into lastReading / lastAnomaly
+CURRENT_STATE_ATTRIBUTES = ('timestamp', 'deviceId', 'metrics', 'receivedAt', 'anomalyDetected', 'anomalyStatus',
+                            'anomalySource', 'anomalyReasons', 'cloudAnomalyScore', 'edgeAnomalyScore',
+                            'activityState')
+
+# Metrics the detectors compare numerically; ingestion rejects readings
+# where they are present but not numbers
+NUMERIC_METRICS = ('heartRate', 'heart_rate', 'steps', 'calories', 'distance')
+
 # CORS headers
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -55,13 +144,20 @@ def lambda_handler(event, context):
         # Route notification token registration
         path = event.get('path', '')
         if event.get('httpMethod') == 'POST' and path.endswith('/notifications/register'):
-            return success_response(handle_push_token_registration(body))
+            try:
+                return success_response(handle_push_token_registration(body))
+            except ValueError as e:
+                return error_response(400, str(e))
 
         # Determine if single or batch ingestion
         if isinstance(body, list):
             result = handle_batch_ingestion(body)
         else:
-            result = handle_single_ingestion(body)
+            try:
+                result = handle_single_ingestion(body)
+            except ValueError as e:
+                # The reading failed validation (see build_metric_item)
+                return error_response(400, str(e))
         
         return success_response(result)
     
@@ -72,14 +168,285 @@ def lambda_handler(event, context):
 
 def handle_single_ingestion(data):
     """
-    Handle single health metric ingestion
+    Handle single health metric ingestion.
+
+    The anomaly verdict is computed before anything is persisted so the
+    reading and every anomaly attribute land in a single put_item. In async
+    mode the reading is stored and acknowledged first and scored later.
+    """
+    item = build_metric_item(data)
+
+    if async_pipeline_enabled():
+        return handle_async_ingestion([(data, item)], single=True)
+
+    # Check for anomalies (edge score first, then optional cloud inference, then thresholds)
+    anomaly_result = score_reading(data)
+    apply_anomaly_result(item, anomaly_result)
+
+    # Store in DynamoDB
+    response = table.put_item(Item=item, ReturnValues='ALL_OLD')
+    logger.info(f"Stored metric for user {data['userId']} at {data['timestamp']}")
+    update_rollups([item], {(item['userId'], item['timestamp']): response.get('Attributes')})
+    update_user_state([item])
+
+    anomaly_detected = anomaly_result['anomalyDetected']
+    anomaly_reasons = anomaly_result.get('anomalyReasons', [])
+
+    if anomaly_detected:
+        # Trigger notification (if needed)
+        notify_anomalies([_notification_message(data, item, anomaly_result)])
+    
+    return {
+        'success': True,
+        'message': 'Data ingested successfully',
+        'anomalyDetected': anomaly_detected,
+        'anomalySource': anomaly_result.get('source', 'none'),
+        'cloudScore': anomaly_result.get('cloudScore'),
+        'anomalyReasons': anomaly_reasons
+    }
+
+
+def handle_batch_ingestion(data_list):
+    """
+    Handle batch ingestion of multiple health metrics.
+
+    Items are validated, scored and fully built in memory first, then
+    persisted with BatchWriteItem in chunks of 25 so the number of DynamoDB
+    round trips grows with the number of chunks rather than the number of
+    records. Chunks, inference invocations and notifications are issued up
+    to BATCH_CONCURRENCY at a time. Failures are reported per item.
+    """
+    failures = []
+    pending = []
+
+    for index, data in enumerate(data_list):
+        try:
+            pending.append((index, data, build_metric_item(data)))
+        except Exception as e:
+            logger.error(f"Error preparing item {index}: {str(e)}")
+            failures.append(_batch_failure(index, data, e))
+
+    if async_pipeline_enabled():
+        result = handle_async_ingestion([(data, item) for _, data, item in pending])
+        failures.extend(
+            _batch_failure(index, data, error)
+            for (index, data, _), error in zip(pending, result.pop('errors'))
+            if error is not None
+        )
+        failures.sort(key=lambda f: f['index'])
+        result['errorCount'] = len(failures)
+        result['failures'] = failures
+        return result
+
+    outcomes = score_and_persist([(data, item) for _, data, item in pending])
+
+    success_count = 0
+    anomalies_detected = 0
+    for (index, data, item), (anomaly_result, error) in zip(pending, outcomes):
+        if error is not None:
+            failures.append(_batch_failure(index, data, error))
+            continue
+
+        success_count += 1
+        if anomaly_result['anomalyDetected']:
+            anomalies_detected += 1
+
+    failures.sort(key=lambda f: f['index'])
+    logger.info(f"Batch ingestion: {success_count} stored, {len(failures)} failed")
+
+    return {
+        'success': True,
+        'message': f'Batch ingestion completed',
+        'successCount': success_count,
+        'errorCount': len(failures),
+        'anomaliesDetected': anomalies_detected,
+        'failures': failures
+    }
+
+
+def score_and_persist(entries):
+    """
+    Score validated (data, item) pairs, write every item together with its
+    verdict via BatchWriteItem and notify for stored anomalies.
+    Returns [(anomaly_result, error)] aligned with entries; error is None
+    when the item was stored.
+    """
+    anomaly_results = score_readings([data for data, _ in entries])
+    items = [apply_anomaly_result(item, result) for (_, item), result in zip(entries, anomaly_results)]
+
+    # Rollups must know which rows the writes replace, which BatchWriteItem
+    # cannot report; read them first
+    replaced = fetch_existing_rows(items) if rollup_table_name else {}
+    failed_keys = {}
+    for item, error in batch_write_items(items):
+        failed_keys[(item['userId'], item['timestamp'])] = error
+
+    unique = {(item['userId'], item['timestamp']): item for item in items}
+    stored = [item for key, item in unique.items() if key not in failed_keys]
+    update_rollups(stored, replaced)
+    update_user_state(stored)
+
+    outcomes = []
+    notifications = {}
+    for (data, item), anomaly_result in zip(entries, anomaly_results):
+        error = failed_keys.get((item['userId'], item['timestamp']))
+        if error is None and anomaly_result['anomalyDetected']:
+            message = _notification_message(data, item, anomaly_result)
+            notifications.setdefault(item['userId'], []).append(message)
+        outcomes.append((anomaly_result, error))
+
+    # Users are notified concurrently; each user's alerts go out in batch order
+    run_concurrently(notify_anomalies, list(notifications.values()))
+    return outcomes
+
+
+def _notification_message(data, item, anomaly_result):
+    return {
+        'userId': item['userId'],
+        'timestamp': item['timestamp'],
+        'metrics': data['metrics'],
+        'anomalySource': anomaly_result.get('source', 'none'),
+        'anomalyReasons': anomaly_result.get('anomalyReasons', [])
+    }
+
+
+def async_pipeline_enabled():
+    """True when readings are acknowledged before they are scored."""
+    return ANOMALY_PIPELINE_MODE == 'async' and bool(anomaly_queue_url)
+
+
+def handle_async_ingestion(entries, single=False):
+    """
+    Persist validated (data, item) pairs with anomalyStatus 'pending' and
+    queue them for anomaly_queue_handler, so the response only waits for
+    the storage write. Readings that cannot be queued are scored inline
+    instead, so no reading is left without a verdict.
+    """
+    for _, item in entries:
+        item['anomalyStatus'] = 'pending'
+
+    if single:
+        table.put_item(Item=entries[0][1])
+        errors = [None]
+    else:
+        failed_keys = {}
+        for item, error in batch_write_items([item for _, item in entries]):
+            failed_keys[(item['userId'], item['timestamp'])] = error
+        errors = [failed_keys.get((item['userId'], item['timestamp'])) for _, item in entries]
+
+    stored = [entry for entry, error in zip(entries, errors) if error is None]
+    update_user_state([item for _, item in stored])
+    not_queued = enqueue_for_scoring(stored)
+
+    anomalies_detected = 0
+    if not_queued:
+        logger.warning(f"Scoring {len(not_queued)} readings inline, queue unavailable")
+        modified_at = int(datetime.now().timestamp() * 1000)
+        for (data, item) in not_queued:
+            item['anomalyStatus'] = 'scored'
+            item['modifiedAt'] = modified_at
+        for anomaly_result, _ in score_and_persist(not_queued):
+            anomalies_detected += int(anomaly_result['anomalyDetected'])
+
+    if single:
+        return {
+            'success': True,
+            'message': 'Data ingested successfully, anomaly scoring queued',
+            'anomalyDetected': bool(entries[0][1]['anomalyDetected']),
+            'anomalySource': 'pending' if not not_queued else entries[0][1].get('anomalySource', 'none'),
+            'anomalyStatus': 'pending' if not not_queued else 'scored',
+        }
+
+    return {
+        'success': True,
+        'message': 'Batch ingestion completed, anomaly scoring queued',
+        'successCount': len(stored),
+        'queuedCount': len(stored) - len(not_queued),
+        'anomaliesDetected': anomalies_detected,
+        'errors': errors,
+    }
+
+
+def enqueue_for_scoring(entries):
+    """
+    Send stored readings to the anomaly queue in SendMessageBatch calls.
+    Returns the (data, item) pairs that could not be queued.
+    """
+    chunks = [entries[start:start + QUEUE_SEND_BATCH_SIZE]
+              for start in range(0, len(entries), QUEUE_SEND_BATCH_SIZE)]
+    return [entry for not_queued in run_concurrently(_enqueue_chunk, chunks) for entry in not_queued]
+
+
+def _enqueue_chunk(chunk):
+    """One SendMessageBatch call; returns the entries that were not queued."""
+    try:
+        response = sqs_client.send_message_batch(
+            QueueUrl=anomaly_queue_url,
+            Entries=[
+                {
+                    'Id': str(position),
+                    'MessageBody': json.dumps({'reading': data, 'receivedAt': item['receivedAt']}),
+                }
+                for position, (data, item) in enumerate(chunk)
+            ]
+        )
+        return [chunk[int(failed['Id'])] for failed in response.get('Failed', [])]
+    except Exception as e:
+        logger.error(f"Failed to queue {len(chunk)} readings for scoring: {str(e)}")
+        return list(chunk)
+
+
+def anomaly_queue_handler(event, context):
+    """
+    SQS consumer for async mode: scores queued readings in one batch,
+    writes each verdict back onto its stored item and sends notifications.
+    Uses partial batch responses so only failed writes are redelivered.
+    """
+    entries = []
+    for record in event.get('Records', []):
+        try:
+            message = json.loads(record['body'])
+            data = message['reading']
+            item = build_metric_item(data)
+        except Exception as e:
+            # Malformed messages will never succeed; drop instead of redelivering
+            logger.error(f"Dropping malformed anomaly queue message {record.get('messageId')}: {str(e)}")
+            continue
+        item['receivedAt'] = message.get('receivedAt', item['receivedAt'])
+        item['anomalyStatus'] = 'scored'
+        entries.append((record['messageId'], data, item))
+
+    outcomes = score_and_persist([(data, item) for _, data, item in entries])
+    failures = [
+        {'itemIdentifier': message_id}
+        for (message_id, _, _), (_, error) in zip(entries, outcomes)
+        if error is not None
+    ]
+
+    anomalies = sum(1 for anomaly_result, _ in outcomes if anomaly_result['anomalyDetected'])
+    logger.info(f"Anomaly queue: scored {len(entries)} readings, {anomalies} anomalies, "
+                f"{len(failures)} to retry")
+    return {'batchItemFailures': failures}
+
+
+def build_metric_item(data):
+    """
+    Validate a single reading and build its DynamoDB item (without the
+    cloud/threshold anomaly verdict, see apply_anomaly_result).
     """
     # Validate required fields
     required_fields = ['userId', 'timestamp', 'metrics', 'deviceId']
     for field in required_fields:
         if field not in data:
             raise ValueError(f"Missing required field: {field}")
-    
+    metrics = data['metrics']
+    if not isinstance(metrics, dict):
+        raise ValueError("metrics must be an object")
+    for name in NUMERIC_METRICS:
+        value = metrics.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"metrics.{name} must be a number")
+
     # Optional edge-ML fields
     is_anomalous_edge = data.get('isAnomalous', False)
     local_score = data.get('localAnomalyScore')
@@ -87,13 +454,15 @@ def handle_single_ingestion(data):
     activity_state = data.get('activityState')
     model_version = data.get('modelVersion')
 
-    # Prepare item for DynamoDB
+    now = int(datetime.now().timestamp() * 1000)
     item = {
         'userId': data['userId'],
         'timestamp': int(data['timestamp']),
         'deviceId': data['deviceId'],
         'metrics': convert_floats_to_decimal(data['metrics']),
-        'receivedAt': int(datetime.now().timestamp() * 1000),
+        'receivedAt': now,
+        # Bumped by every write of the reading; delta sync is indexed on it
+        'modifiedAt': now,
         'anomalyDetected': bool(is_anomalous_edge) or False
     }
 
@@ -105,94 +474,375 @@ def handle_single_ingestion(data):
         item['activityState'] = activity_state
     if model_version is not None:
         item['modelVersion'] = model_version
-    
-    # Store in DynamoDB
-    table.put_item(Item=item)
-    logger.info(f"Stored metric for user {data['userId']} at {data['timestamp']}")
-    
-    # Check for anomalies (edge score first, then optional cloud inference, then thresholds)
-    anomaly_result = check_for_anomalies(
-        data['metrics'],
-        edge_score=edge_score,
-        user_id=data['userId'],
-        timestamp=data['timestamp']
-    )
-    anomaly_detected = anomaly_result['anomalyDetected']
-    anomaly_reasons = anomaly_result.get('anomalyReasons', [])
+
+    return item
+
+
+def score_reading(data):
+    """
+    Run check_for_anomalies for a validated reading.
+
+    Detection must never cost us the raw reading: if scoring fails for any
+    reason the threshold fallback is used and the item is flagged so it can
+    be rescored later.
+    """
+    try:
+        return check_for_anomalies(
+            data['metrics'],
+            edge_score=data.get('edgeAnomalyScore'),
+            user_id=data['userId'],
+            timestamp=data['timestamp']
+        )
+    except Exception as e:
+        logger.error(f"Anomaly detection failed, using threshold fallback: {str(e)}")
+        return _fallback_check(data['metrics'])
+
+
+def score_readings(data_list):
+    """
+    Batch variant of score_reading: one cloud inference round trip per
+    chunk instead of per reading, with the same threshold fallback.
+    """
+    try:
+        return check_for_anomalies_batch(data_list)
+    except Exception as e:
+        logger.error(f"Batch anomaly detection failed, using threshold fallback: {str(e)}")
+        return [_fallback_check(data['metrics']) for data in data_list]
+
+
+def _fallback_check(metrics):
+    """
+    Threshold verdict for a reading whose scoring failed, flagged for
+    rescoring. Never raises: one reading the thresholds cannot handle
+    must not cost the batch its other readings.
+    """
+    try:
+        result = _threshold_check(metrics)
+    except Exception as e:
+        logger.error(f"Threshold fallback failed, storing without a verdict: {str(e)}")
+        result = {
+            'anomalyDetected': False,
+            'source': 'none',
+            'cloudScore': None,
+            'cloudDetected': None,
+            'anomalyReasons': []
+        }
+    result['cloudUnavailable'] = True
+    return result
+
+
+def apply_anomaly_result(item, anomaly_result):
+    """
+    Copy the anomaly verdict from check_for_anomalies onto a DynamoDB item
+    so it can be persisted in the same write as the reading.
+    """
     if anomaly_result.get('cloudScore') is not None:
         item['cloudAnomalyScore'] = convert_floats_to_decimal(anomaly_result['cloudScore'])
-        item['cloudAnomalyDetected'] = bool(anomaly_result.get('cloudDetected', False))
-    
-    if anomaly_detected:
-        # Update item with anomaly flag
-        update_expression = ['anomalyDetected = :val']
-        expression_values = {':val': True}
-
-        if anomaly_result.get('cloudScore') is not None:
-            update_expression.append('cloudAnomalyScore = :cloudScore')
-            expression_values[':cloudScore'] = convert_floats_to_decimal(anomaly_result['cloudScore'])
-        if anomaly_result.get('cloudDetected') is not None:
-            update_expression.append('cloudAnomalyDetected = :cloudDetected')
-            expression_values[':cloudDetected'] = bool(anomaly_result['cloudDetected'])
-        if anomaly_reasons:
-            update_expression.append('anomalyReasons = :reasons')
-            expression_values[':reasons'] = anomaly_reasons
+    if anomaly_result.get('cloudDetected') is not None:
+        item['cloudAnomalyDetected'] = bool(anomaly_result['cloudDetected'])
+    if anomaly_result.get('cloudUnavailable'):
+        # Cloud scoring timed out or failed; the verdict came from thresholds
+        item['cloudInferenceStatus'] = 'unavailable'
+
+    if anomaly_result['anomalyDetected']:
+        item['anomalyDetected'] = True
+        if anomaly_result.get('anomalyReasons'):
+            item['anomalyReasons'] = anomaly_result['anomalyReasons']
         # Always store the anomaly source (edge / cloud / threshold)
-        update_expression.append('anomalySource = :source')
-        expression_values[':source'] = anomaly_result.get('source', 'none')
-
-        table.update_item(
-            Key={
-                'userId': data['userId'],
-                'timestamp': int(data['timestamp'])
-            },
-            UpdateExpression='SET ' + ', '.join(update_expression),
-            ExpressionAttributeValues=expression_values
-        )
-        
-        # Trigger notification (if needed)
-        send_anomaly_notification({
-            'userId': data['userId'],
-            'timestamp': int(data['timestamp']),
-            'metrics': data['metrics'],
-            'anomalySource': anomaly_result.get('source', 'none'),
-            'anomalyReasons': anomaly_reasons
-        })
-    
-    return {
-        'success': True,
-        'message': 'Data ingested successfully',
-        'anomalyDetected': anomaly_detected,
-        'anomalySource': anomaly_result.get('source', 'none'),
-        'cloudScore': anomaly_result.get('cloudScore'),
-        'anomalyReasons': anomaly_reasons
+        item['anomalySource'] = anomaly_result.get('source', 'none')
+
+    return item
+
+
+def batch_write_items(items):
+    """
+    Persist items with BatchWriteItem in chunks of BATCH_WRITE_CHUNK_SIZE.
+    UnprocessedItems are retried with exponential backoff.
+    Returns a list of (item, error_message) for items that could not be written.
+    """
+    # BatchWriteItem rejects duplicate keys within a request; keep the last
+    # reading per key, matching the overwrite semantics of put_item.
+    unique = {}
+    for item in items:
+        unique[(item['userId'], item['timestamp'])] = item
+    items = list(unique.values())
+
+    # Keys are unique after the dedupe above, so chunks can be written in
+    # any order without one reading overwriting a newer one.
+    chunks = [items[start:start + BATCH_WRITE_CHUNK_SIZE]
+              for start in range(0, len(items), BATCH_WRITE_CHUNK_SIZE)]
+    return [failure for failures in run_concurrently(_write_chunk, chunks) for failure in failures]
+
+
+def _write_chunk(chunk):
+    """One BatchWriteItem chunk with retries; returns [(item, error_message)]."""
+    requests = [{'PutRequest': {'Item': item}} for item in chunk]
+
+    try:
+        for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(min(BATCH_WRITE_BASE_DELAY * (2 ** (attempt - 1)), 1.0))
+            response = dynamodb.batch_write_item(RequestItems={table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not requests:
+                break
+    except Exception as e:
+        logger.error(f"BatchWriteItem failed for chunk of {len(chunk)}: {str(e)}")
+        return [(item, str(e)) for item in chunk]
+
+    return [(request['PutRequest']['Item'], 'Unprocessed after retries') for request in requests]
+
+
+def fetch_existing_rows(items):
+    """
+    The stored rows that writing items would replace, as
+    {(userId, timestamp): row}, read with consistent BatchGetItem calls of
+    BATCH_GET_MAX_KEYS keys (only the attributes rollups use). Keys
+    without a row are absent. On failure the rows are treated as new.
+    """
+    keys = list(dict.fromkeys((item['userId'], item['timestamp']) for item in items))
+    chunks = [keys[start:start + BATCH_GET_MAX_KEYS] for start in range(0, len(keys), BATCH_GET_MAX_KEYS)]
+    rows = {}
+    for chunk_rows in run_concurrently(_fetch_rows_chunk, chunks):
+        for row in chunk_rows:
+            rows[(row['userId'], row['timestamp'])] = row
+    return rows
+
+
+def _fetch_rows_chunk(keys):
+    """One chunk of fetch_existing_rows, retrying UnprocessedKeys."""
+    request = {
+        table_name: {
+            'Keys': [{'userId': user_id, 'timestamp': timestamp} for user_id, timestamp in keys],
+            'ProjectionExpression': 'userId, #ts, metrics, anomalyDetected, anomalyStatus',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'},
+            'ConsistentRead': True,
+        }
     }
+    rows = []
+    try:
+        for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(min(BATCH_WRITE_BASE_DELAY * (2 ** (attempt - 1)), 1.0))
+            response = dynamodb.batch_get_item(RequestItems=request)
+            rows.extend(response.get('Responses', {}).get(table_name, []))
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                return rows
+        raise RuntimeError(f"{len(request[table_name]['Keys'])} keys unprocessed after retries")
+    except Exception as e:
+        logger.error(f"Reading {len(keys)} existing rows for rollups failed: {str(e)}")
+        return rows
 
 
-def handle_batch_ingestion(data_list):
+def run_concurrently(fn, tasks):
     """
-    Handle batch ingestion of multiple health metrics
+    Apply fn to every task with at most BATCH_CONCURRENCY calls in flight.
+    Returns the results in task order, so callers see the same output as a
+    plain loop. fn is expected to handle its own errors.
     """
-    success_count = 0
-    error_count = 0
-    anomalies_detected = 0
-    
-    for data in data_list:
-        try:
-            result = handle_single_ingestion(data)
-            success_count += 1
-            if result.get('anomalyDetected'):
-                anomalies_detected += 1
-        except Exception as e:
-            logger.error(f"Error ingesting item: {str(e)}")
-            error_count += 1
-    
+    workers = min(BATCH_CONCURRENCY, len(tasks))
+    if workers <= 1:
+        return [fn(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, tasks))
+
+
+def update_rollups(items, replaced=None):
+    """
+    Fold stored items into their users' hourly and daily rollups. Items
+    are summed per bucket first, so a batch costs one ADD per touched
+    bucket (plus a conditional write when it sets a new heart rate
+    min/max). replaced maps (userId, timestamp) to the row an item
+    overwrote; a row that was already rolled up (any but an async
+    'pending' one) is subtracted, so uploading a reading again leaves its
+    buckets unchanged. A replaced reading's min/max is not retracted, and
+    two requests writing the same new reading at once can both count it.
+    Rollups are derived data: failures are logged, never raised.
+    """
+    if not rollup_table_name or not items:
+        return
+
+    replaced = replaced or {}
+    buckets = {}
+    for item in items:
+        _add_to_buckets(buckets, item, 1)
+        previous = replaced.get((item['userId'], item['timestamp']))
+        if previous and previous.get('anomalyStatus') != 'pending':
+            _add_to_buckets(buckets, previous, -1)
+
+    # Buckets whose counters cancel out only saw readings they already hold
+    buckets = {key: bucket for key, bucket in buckets.items()
+               if any(value for name, value in bucket.items() if name not in ('heartRateMin', 'heartRateMax'))}
+    rollup_table = dynamodb.Table(rollup_table_name)
+    run_concurrently(lambda entry: _apply_rollup(rollup_table, *entry), list(buckets.items()))
+
+
+def _add_to_buckets(buckets, item, sign):
+    """Add (sign 1) or subtract (sign -1) one reading's rollup contribution."""
+    seconds = int(item['timestamp'])
+    if seconds > 1e12:  # milliseconds
+        seconds //= 1000
+    metrics = item.get('metrics') or {}
+    heart_rate = metrics.get('heartRate') or metrics.get('heart_rate')
+    for granularity, width in ROLLUP_GRANULARITIES.items():
+        key = (f"{item['userId']}#{granularity}", seconds // width * width)
+        bucket = buckets.setdefault(key, {
+            'readingCount': 0, 'heartRateCount': 0, 'heartRateSum': Decimal(0), 'heartRateSumSq': Decimal(0),
+            'stepsSum': Decimal(0), 'caloriesSum': Decimal(0), 'distanceSum': Decimal(0), 'anomalyCount': 0,
+            'heartRateMin': None, 'heartRateMax': None,
+        })
+        bucket['readingCount'] += sign
+        bucket['anomalyCount'] += sign * int(bool(item.get('anomalyDetected')))
+        for name in ('steps', 'calories', 'distance'):
+            bucket[f'{name}Sum'] += sign * Decimal(str(metrics.get(name) or 0))
+        if heart_rate:
+            heart_rate = Decimal(str(heart_rate))
+            bucket['heartRateCount'] += sign
+            bucket['heartRateSum'] += sign * heart_rate
+            bucket['heartRateSumSq'] += sign * heart_rate * heart_rate
+            if sign > 0:
+                bucket['heartRateMin'] = min(heart_rate, bucket['heartRateMin'] or heart_rate)
+                bucket['heartRateMax'] = max(heart_rate, bucket['heartRateMax'] or heart_rate)
+
+
+def _apply_rollup(rollup_table, key, bucket):
+    rollup_key, bucket_start = key
+    counters = {name: value for name, value in bucket.items() if name not in ('heartRateMin', 'heartRateMax')}
+    try:
+        response = rollup_table.update_item(
+            Key={'rollupKey': rollup_key, 'bucketStart': bucket_start},
+            UpdateExpression='ADD ' + ', '.join(f'{name} :{name}' for name in counters),
+            ExpressionAttributeValues={f':{name}': value for name, value in counters.items()},
+            ReturnValues='ALL_NEW'
+        )
+        current = response.get('Attributes', {})
+        # Min/max cannot be ADDed; only write them when this batch beats the
+        # stored value, conditionally so a concurrent writer cannot regress it
+        for name, op, beaten in (('heartRateMin', '>', operator.gt), ('heartRateMax', '<', operator.lt)):
+            value = bucket[name]
+            if value is None or (name in current and not beaten(current[name], value)):
+                continue
+            try:
+                rollup_table.update_item(
+                    Key={'rollupKey': rollup_key, 'bucketStart': bucket_start},
+                    UpdateExpression=f'SET {name} = :value',
+                    ConditionExpression=f'attribute_not_exists({name}) OR {name} {op} :value',
+                    ExpressionAttributeValues={':value': value}
+                )
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+    except Exception as e:
+        logger.error(f"Failed to update rollup {rollup_key} at {bucket_start}: {str(e)}")
+
+
+def update_user_state(items):
+    """
+    Refresh each user's current state from their stored items and ADD
+    their number of written items to dataVersion: one conditional update
+    per user for the newest reading (and activity state) that carries the
+    version bump, plus one when the batch holds an anomaly. Conditions
+    compare timestamps, so an older batch never replaces a newer reading,
+    while a rewrite of the same reading (the async verdict) does land; when
+    no reading update lands, the version is bumped on its own. Called after
+    the readings are stored, so a reader that sees a new version also sees
+    the data. Failures are logged, never raised.
+    """
+    if not user_state_table_name or not items:
+        return
+
+    by_user = {}
+    for item in items:
+        by_user.setdefault(item['userId'], []).append(item)
+    state_table = dynamodb.Table(user_state_table_name)
+    updated_at = int(datetime.now().timestamp() * 1000)
+    run_concurrently(lambda user_items: _update_user_state(state_table, user_items, updated_at),
+                     list(by_user.values()))
+
+
+def _update_user_state(state_table, items, updated_at):
+    items = sorted(items, key=lambda item: int(item['timestamp']))
+    latest = items[-1]
+    key = {'userId': latest['userId']}
+    newer = 'attribute_not_exists(lastReadingAt) OR lastReadingAt <= :ts'
+    update = 'SET lastReading = :reading, lastReadingAt = :ts, dataUpdatedAt = :now'
+    bump = ' ADD dataVersion :count'
+    values = {':ts': latest['timestamp'], ':reading': _state_snapshot(latest), ':now': updated_at,
+              ':count': len(items)}
+    bumped = False
+    try:
+        state = latest.get('activityState')
+        if state is None:
+            bumped = _conditional_update(state_table, key, update + bump, newer, values)
+        else:
+            values[':state'] = state
+            run_start = len(items) - 1
+            while run_start > 0 and items[run_start - 1].get('activityState') == state:
+                run_start -= 1
+            # When the whole batch continues the stored state, keep its start;
+            # otherwise the state started with this batch's run
+            bumped = run_start == 0 and _conditional_update(state_table, key, update + bump,
+                                                            f'({newer}) AND activityState = :state', values)
+            if not bumped:
+                values[':since'] = items[run_start]['timestamp']
+                bumped = _conditional_update(
+                    state_table, key, update + ', activityState = :state, activityStateSince = :since' + bump,
+                    newer, values)
+
+        anomalies = [item for item in items if item.get('anomalyDetected')]
+        if anomalies:
+            _conditional_update(
+                state_table, key, 'SET lastAnomaly = :anomaly, lastAnomalyAt = :ts',
+                'attribute_not_exists(lastAnomalyAt) OR lastAnomalyAt <= :ts',
+                {':anomaly': _state_snapshot(anomalies[-1]), ':ts': anomalies[-1]['timestamp']}
+            )
+    except Exception as e:
+        logger.error(f"Failed to update current state for user {key['userId']}: {str(e)}")
+
+    if not bumped:
+        _bump_data_version(state_table, key['userId'], len(items), updated_at)
+
+
+def _state_snapshot(item):
+    return {name: item[name] for name in CURRENT_STATE_ATTRIBUTES if name in item}
+
+
+def _conditional_update(state_table, key, update_expression, condition, values):
+    """update_item; False when the condition did not hold."""
+    try:
+        state_table.update_item(
+            Key=key,
+            UpdateExpression=update_expression,
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values
+        )
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+def _bump_data_version(state_table, user_id, count, updated_at):
+    try:
+        state_table.update_item(
+            Key={'userId': user_id},
+            UpdateExpression='ADD dataVersion :count SET dataUpdatedAt = :now',
+            ExpressionAttributeValues={':count': count, ':now': updated_at}
+        )
+    except Exception as e:
+        logger.error(f"Failed to bump data version for user {user_id}: {str(e)}")
+
+
+def _batch_failure(index, data, error):
+    """Describe a failed batch record for the ingestion response."""
+    data = data if isinstance(data, dict) else {}
     return {
-        'success': True,
-        'message': f'Batch ingestion completed',
-        'successCount': success_count,
-        'errorCount': error_count,
-        'anomaliesDetected': anomalies_detected
+        'index': index,
+        'userId': data.get('userId'),
+        'timestamp': data.get('timestamp'),
+        'error': str(error)
     }
 
 
@@ -202,50 +852,118 @@ def check_for_anomalies(metrics, edge_score=None, user_id=None, timestamp=None):
     Returns a dict with anomaly status, optional cloud score, and human-readable reasons.
     """
     # If edge model provided a score, use it (>=0.5 anomalous)
-    if edge_score is not None:
-        try:
-            score_f = float(edge_score)
-            if score_f >= 0.5:
-                logger.warning(f"Anomaly detected via edge score: {score_f}")
-                reasons = _generate_threshold_reasons(metrics)
-                if not reasons:
-                    reasons = [f"Edge ML model flagged anomaly (score: {score_f:.2f})"]
-                return {
-                    'anomalyDetected': True,
-                    'source': 'edge',
-                    'cloudScore': None,
-                    'cloudDetected': None,
-                    'anomalyReasons': reasons
-                }
-        except Exception:
-            pass
+    edge_result = _edge_check(metrics, edge_score)
+    if edge_result is not None:
+        return edge_result
 
     # Optional cloud inference
-    if cloud_inference_function:
+    cloud_result = None
+    if cloud_inference_enabled():
         cloud_result = invoke_cloud_inference(metrics, user_id, timestamp)
-        if cloud_result is not None:
-            reasons = cloud_result.get('anomaly_reasons', [])
-            if cloud_result.get('is_anomaly'):
-                logger.warning("Anomaly detected via cloud inference")
-                if not reasons:
-                    reasons = _generate_threshold_reasons(metrics)
-                return {
-                    'anomalyDetected': True,
-                    'source': 'cloud',
-                    'cloudScore': cloud_result.get('cloud_score'),
-                    'cloudDetected': True,
-                    'anomalyReasons': reasons,
-                    'featureContributions': cloud_result.get('feature_contributions', {})
-                }
+
+    return _cloud_or_threshold_result(metrics, cloud_result)
+
+
+def check_for_anomalies_batch(data_list):
+    """
+    Batch variant of check_for_anomalies for validated readings.
+
+    Readings already flagged by the edge score are short-circuited; all the
+    others are scored with one (or a few chunked) cloud inference invocations
+    and the results are mapped back by metric_id.
+    Returns a list of anomaly results aligned with data_list.
+    """
+    results = [None] * len(data_list)
+    needs_cloud = []
+
+    for index, data in enumerate(data_list):
+        edge_result = _edge_check(data['metrics'], data.get('edgeAnomalyScore'))
+        if edge_result is not None:
+            results[index] = edge_result
+        else:
+            needs_cloud.append(index)
+
+    cloud_results = {}
+    if cloud_inference_enabled() and needs_cloud:
+        cloud_results = invoke_cloud_inference_batch([
+            _inference_entry(data_list[i]['metrics'], data_list[i]['userId'], data_list[i]['timestamp'])
+            for i in needs_cloud
+        ])
+
+    for index in needs_cloud:
+        data = data_list[index]
+        cloud_result = cloud_results.get(_metric_id(data['userId'], data['timestamp']))
+        results[index] = _cloud_or_threshold_result(data['metrics'], cloud_result)
+
+    return results
+
+
+def _edge_check(metrics, edge_score):
+    """
+    Return an anomaly result when the edge model score is >= 0.5, otherwise
+    None so the caller continues with cloud / threshold detection.
+    """
+    if edge_score is None:
+        return None
+    try:
+        score_f = float(edge_score)
+    except Exception:
+        return None
+    if score_f < 0.5:
+        return None
+
+    logger.warning(f"Anomaly detected via edge score: {score_f}")
+    reasons = _generate_threshold_reasons(metrics)
+    if not reasons:
+        reasons = [f"Edge ML model flagged anomaly (score: {score_f:.2f})"]
+    return {
+        'anomalyDetected': True,
+        'source': 'edge',
+        'cloudScore': None,
+        'cloudDetected': None,
+        'anomalyReasons': reasons
+    }
+
+
+def _cloud_or_threshold_result(metrics, cloud_result):
+    """
+    Turn a cloud inference result into an anomaly result, falling back to
+    thresholds when no cloud result is available.
+    """
+    if cloud_result is not None:
+        reasons = cloud_result.get('anomaly_reasons', [])
+        if cloud_result.get('is_anomaly'):
+            logger.warning("Anomaly detected via cloud inference")
+            if not reasons:
+                reasons = _generate_threshold_reasons(metrics)
             return {
-                'anomalyDetected': False,
+                'anomalyDetected': True,
                 'source': 'cloud',
                 'cloudScore': cloud_result.get('cloud_score'),
-                'cloudDetected': False,
-                'anomalyReasons': []
+                'cloudDetected': True,
+                'anomalyReasons': reasons,
+                'featureContributions': cloud_result.get('feature_contributions', {})
             }
+        return {
+            'anomalyDetected': False,
+            'source': 'cloud',
+            'cloudScore': cloud_result.get('cloud_score'),
+            'cloudDetected': False,
+            'anomalyReasons': []
+        }
 
     # Fallback: Simple threshold-based detection
+    result = _threshold_check(metrics)
+    if cloud_inference_enabled():
+        result['cloudUnavailable'] = True
+    return result
+
+
+def _threshold_check(metrics):
+    """
+    Simple threshold-based detection, used when neither the edge score nor
+    cloud inference produced a verdict.
+    """
     heart_rate = metrics.get('heartRate') or metrics.get('heart_rate')
     if heart_rate is not None:
         if heart_rate > 150 or heart_rate < 40:
@@ -319,6 +1037,315 @@ def send_anomaly_notification(message):
         logger.error(f"Failed to publish SNS notification: {str(e)}")
 
 
+def notify_anomalies(messages):
+    """
+    Publish one user's anomaly messages (in reading order) through the
+    alert coalescer: at most one alert per user per window, carrying the
+    number of anomalies, their time range and the most frequent reasons.
+    """
+    if ALERT_COALESCE_SECONDS <= 0:
+        for message in messages:
+            send_anomaly_notification(message)
+        return
+
+    try:
+        alert = get_alert_coalescer().coalesce(messages)
+    except Exception as e:
+        # Losing the coalescing state must not cost the user the alert
+        logger.error(f"Alert coalescing failed, publishing uncoalesced: {str(e)}")
+        alert = AlertCoalescer.merge(messages, None)
+    if alert is not None:
+        send_anomaly_notification(alert)
+
+
+def get_alert_coalescer():
+    global _alert_coalescer
+    if _alert_coalescer is None:
+        if alert_state_table_name:
+            store = DynamoDBAlertStore(dynamodb.Table(alert_state_table_name))
+        else:
+            store = InMemoryAlertStore()
+        _alert_coalescer = AlertCoalescer(store, ALERT_COALESCE_SECONDS,
+                                          schedule_flush=schedule_alert_flush if alert_flush_queue_url else None)
+    return _alert_coalescer
+
+
+def schedule_alert_flush(user_id, window_start, due):
+    """Queue a flush of user_id's window, delivered once the window has closed."""
+    delay = min(ALERT_FLUSH_MAX_DELAY, max(0, int(due - time.time()) + 1))
+    try:
+        sqs_client.send_message(
+            QueueUrl=alert_flush_queue_url,
+            MessageBody=json.dumps({'userId': user_id, 'windowStart': window_start}),
+            DelaySeconds=delay
+        )
+    except Exception as e:
+        # The pending anomalies still go out with the user's next alert
+        logger.error(f"Failed to schedule alert flush for {user_id}: {str(e)}")
+
+
+def alert_flush_handler(event, context):
+    """
+    SQS consumer for ALERT_FLUSH_QUEUE_URL: publishes the anomalies still
+    pending in each closed window as one summary alert. Messages delivered
+    before their window has closed (DelaySeconds is capped) are reported
+    as failures so SQS redelivers them.
+    """
+    coalescer = get_alert_coalescer()
+    failures = []
+    flushed = 0
+    for record in event.get('Records', []):
+        try:
+            message = json.loads(record['body'])
+            user_id = message['userId']
+            window_start = float(message['windowStart'])
+        except Exception as e:
+            logger.error(f"Dropping malformed alert flush message {record.get('messageId')}: {str(e)}")
+            continue
+
+        if coalescer.clock() < window_start + coalescer.window_seconds:
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
+        try:
+            alert = coalescer.flush(user_id, window_start)
+        except Exception as e:
+            logger.error(f"Alert flush failed for {user_id}: {str(e)}")
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
+        if alert is not None:
+            send_anomaly_notification(alert)
+            flushed += 1
+
+    logger.info(f"Alert flush: {flushed} summaries published, {len(failures)} to retry")
+    return {'batchItemFailures': failures}
+
+
+class AlertCoalescer:
+    """
+    Per-user alert windows on top of an alert store. The first anomaly of
+    a window is published immediately; anomalies arriving while the window
+    is open are recorded in the store and summarised in the first alert of
+    the user's next window, or by flush() once the window has closed if
+    that comes first. schedule_flush(user_id, window_start, due) is called
+    when a window gets its first suppressed anomaly.
+    """
+
+    def __init__(self, store, window_seconds, clock=time.time, schedule_flush=None):
+        self.store = store
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.schedule_flush = schedule_flush
+        self.stats = {'published': 0, 'suppressed': 0, 'flushed': 0}
+
+    def coalesce(self, messages):
+        """Returns the alert to publish for messages (one user), or None."""
+        summary = self.summarize(messages)
+        opened, pending = self.store.open_window(messages[0]['userId'], self.clock(), self.window_seconds)
+        if not opened:
+            window_start = self.store.add_pending(messages[0]['userId'], summary)
+            self.stats['suppressed'] += len(messages)
+            if window_start is not None and self.schedule_flush is not None:
+                self.schedule_flush(messages[0]['userId'], window_start, window_start + self.window_seconds)
+            return None
+        self.stats['published'] += 1
+        self.stats['suppressed'] += len(messages) - 1
+        return self.merge(messages, pending)
+
+    def flush(self, user_id, window_start):
+        """
+        Summary alert for the anomalies still pending in user_id's window
+        opened at window_start, or None when there are none or the user's
+        next alert already carried them.
+        """
+        pending = self.store.take_pending(user_id, window_start)
+        if not pending:
+            return None
+        self.stats['flushed'] += 1
+        alert = {
+            'userId': user_id,
+            'timestamp': pending['lastTimestamp'],
+            'anomalyCount': pending['count'],
+            'firstTimestamp': pending['firstTimestamp'],
+            'lastTimestamp': pending['lastTimestamp'],
+        }
+        if pending['reasons']:
+            alert['anomalyReasons'] = [reason for reason, _ in
+                                       Counter(pending['reasons']).most_common(ALERT_TOP_REASONS)]
+        return alert
+
+    @staticmethod
+    def summarize(messages):
+        reasons = Counter()
+        for message in messages:
+            reasons.update(message.get('anomalyReasons') or [])
+        return {
+            'count': len(messages),
+            'firstTimestamp': messages[0]['timestamp'],
+            'lastTimestamp': messages[-1]['timestamp'],
+            'reasons': dict(reasons),
+        }
+
+    @staticmethod
+    def merge(messages, pending):
+        """Latest message annotated with the count, time range and top reasons."""
+        summary = AlertCoalescer.summarize(messages)
+        reasons = Counter(summary['reasons'])
+        if pending and pending.get('count'):
+            summary['count'] += pending['count']
+            summary['firstTimestamp'] = min(summary['firstTimestamp'], pending['firstTimestamp'])
+            reasons.update(pending['reasons'])
+
+        alert = dict(messages[-1])
+        alert['anomalyCount'] = summary['count']
+        alert['firstTimestamp'] = summary['firstTimestamp']
+        alert['lastTimestamp'] = summary['lastTimestamp']
+        if reasons:
+            alert['anomalyReasons'] = [reason for reason, _ in reasons.most_common(ALERT_TOP_REASONS)]
+        return alert
+
+
+class InMemoryAlertStore:
+    """Alert windows held in this container (ALERT_STATE_TABLE unset, tests)."""
+
+    def __init__(self):
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def open_window(self, user_id, now, window_seconds):
+        """
+        Start a new window for user_id unless one is still open.
+        Returns (opened, pending summary of the previous window or None).
+        """
+        with self.lock:
+            window = self.windows.get(user_id)
+            if window is not None and now - window['windowStart'] < window_seconds:
+                return False, None
+            self.windows[user_id] = {'windowStart': now, 'pending': None}
+            return True, window['pending'] if window else None
+
+    def add_pending(self, user_id, summary):
+        """
+        Fold summary into the open window's pending anomalies. Returns the
+        window start when these are the window's first, otherwise None.
+        """
+        with self.lock:
+            window = self.windows[user_id]
+            pending = window['pending']
+            if pending is None:
+                window['pending'] = dict(summary, reasons=dict(summary['reasons']))
+                return window['windowStart']
+            pending['count'] += summary['count']
+            pending['firstTimestamp'] = min(pending['firstTimestamp'], summary['firstTimestamp'])
+            pending['lastTimestamp'] = max(pending['lastTimestamp'], summary['lastTimestamp'])
+            for reason, count in summary['reasons'].items():
+                pending['reasons'][reason] = pending['reasons'].get(reason, 0) + count
+            return None
+
+    def take_pending(self, user_id, window_start):
+        """Remove and return the pending summary of the window opened at window_start."""
+        with self.lock:
+            window = self.windows.get(user_id)
+            if window is None or window['windowStart'] != window_start:
+                return None
+            pending, window['pending'] = window['pending'], None
+            return pending
+
+
+class DynamoDBAlertStore:
+    """
+    Alert windows in a DynamoDB table keyed by userId, shared by every
+    ingestion/consumer container. Opening a window is a conditional put
+    that returns the previous window; suppressed anomalies are added with
+    atomic counters. Items expire through the table's expiresAt TTL.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def open_window(self, user_id, now, window_seconds):
+        try:
+            response = self.table.put_item(
+                Item={
+                    'userId': user_id,
+                    'windowStart': Decimal(str(now)),
+                    'pendingCount': 0,
+                    'pendingReasons': {},
+                    'expiresAt': int(now + 2 * window_seconds + 86400),
+                },
+                ConditionExpression='attribute_not_exists(userId) OR windowStart <= :cutoff',
+                ExpressionAttributeValues={':cutoff': Decimal(str(now - window_seconds))},
+                ReturnValues='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False, None
+            raise
+
+        previous = response.get('Attributes') or {}
+        if not previous.get('pendingCount'):
+            return True, None
+        return True, {
+            'count': int(previous['pendingCount']),
+            'firstTimestamp': int(previous['firstTimestamp']),
+            'lastTimestamp': int(previous['lastTimestamp']),
+            'reasons': {reason: int(count) for reason, count in previous.get('pendingReasons', {}).items()},
+        }
+
+    def add_pending(self, user_id, summary):
+        names = {}
+        values = {
+            ':count': summary['count'],
+            ':first': summary['firstTimestamp'],
+            ':last': summary['lastTimestamp'],
+            ':zero': 0,
+        }
+        assignments = [
+            'firstTimestamp = if_not_exists(firstTimestamp, :first)',
+            'lastTimestamp = :last',
+        ]
+        for position, (reason, count) in enumerate(summary['reasons'].items()):
+            names[f'#r{position}'] = reason
+            values[f':r{position}'] = count
+            assignments.append(f'pendingReasons.#r{position} = '
+                               f'if_not_exists(pendingReasons.#r{position}, :zero) + :r{position}')
+
+        kwargs = {'ExpressionAttributeNames': names} if names else {}
+        response = self.table.update_item(
+            Key={'userId': user_id},
+            UpdateExpression='SET ' + ', '.join(assignments) + ' ADD pendingCount :count',
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_OLD',
+            **kwargs
+        )
+        previous = response.get('Attributes') or {}
+        if previous.get('pendingCount') or 'windowStart' not in previous:
+            return None
+        return float(previous['windowStart'])
+
+    def take_pending(self, user_id, window_start):
+        try:
+            response = self.table.update_item(
+                Key={'userId': user_id},
+                UpdateExpression='SET pendingCount = :zero, pendingReasons = :none '
+                                 'REMOVE firstTimestamp, lastTimestamp',
+                ConditionExpression='windowStart = :start AND pendingCount > :zero',
+                ExpressionAttributeValues={':start': Decimal(str(window_start)), ':zero': 0, ':none': {}},
+                ReturnValues='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return None
+            raise
+
+        previous = response['Attributes']
+        return {
+            'count': int(previous['pendingCount']),
+            'firstTimestamp': int(previous['firstTimestamp']),
+            'lastTimestamp': int(previous['lastTimestamp']),
+            'reasons': {reason: int(count) for reason, count in previous.get('pendingReasons', {}).items()},
+        }
+
+
 def handle_push_token_registration(data):
     """
     Register Expo push token for a user.
@@ -333,6 +1360,9 @@ def handle_push_token_registration(data):
     device_id = data.get('deviceId', 'mobile')
     expo_push_token = data['expoPushToken']
     platform = data.get('platform', 'unknown')
+    if device_id == PUSH_TOKEN_SUMMARY_DEVICE:
+        # Would overwrite the summary item sns_to_expo reads tokens from
+        raise ValueError(f"Invalid deviceId: {device_id}")
 
     push_table.put_item(
         Item={
@@ -343,6 +1373,7 @@ def handle_push_token_registration(data):
             'updatedAt': int(datetime.now().timestamp() * 1000)
         }
     )
+    update_push_token_summary(user_id)
 
     return {
         'success': True,
@@ -352,6 +1383,51 @@ def handle_push_token_registration(data):
     }
 
 
+def update_push_token_summary(user_id):
+    """
+    Rebuild the user's token summary item from their device items and bump
+    its tokenVersion, which tells sns_to_expo's token cache the entry has
+    changed. The version is also the optimistic lock between concurrent
+    registrations for the same user.
+    """
+    for attempt in range(PUSH_TOKEN_SUMMARY_RETRIES):
+        response = push_table.query(KeyConditionExpression=Key('userId').eq(user_id), ConsistentRead=True)
+        items = response.get('Items', [])
+        summary = next((item for item in items if item['deviceId'] == PUSH_TOKEN_SUMMARY_DEVICE), None)
+        tokens = sorted({item['expoPushToken'] for item in items
+                         if item['deviceId'] != PUSH_TOKEN_SUMMARY_DEVICE and item.get('expoPushToken')})
+
+        if summary is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(userId)'}
+            version = 1
+        else:
+            condition = {
+                'ConditionExpression': 'tokenVersion = :version',
+                'ExpressionAttributeValues': {':version': summary['tokenVersion']},
+            }
+            version = int(summary['tokenVersion']) + 1
+
+        try:
+            push_table.put_item(
+                Item={
+                    'userId': user_id,
+                    'deviceId': PUSH_TOKEN_SUMMARY_DEVICE,
+                    'expoPushTokens': tokens,
+                    'tokenVersion': version,
+                    'updatedAt': int(datetime.now().timestamp() * 1000)
+                },
+                **condition
+            )
+            return version
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            logger.info(f"Push token summary for {user_id} changed concurrently, retrying")
+
+    raise RuntimeError(f"Push token summary for {user_id} kept changing, gave up after "
+                       f"{PUSH_TOKEN_SUMMARY_RETRIES} attempts")
+
+
 def validate_api_key(api_key):
     """
     Validate API key
@@ -367,33 +1443,100 @@ def validate_api_key(api_key):
     return len(api_key) > 0
 
 
+def cloud_inference_enabled():
+    """True when readings are scored by the model, inline or remote."""
+    return INFERENCE_MODE == 'inline' or bool(cloud_inference_function)
+
+
 def invoke_cloud_inference(metrics, user_id, timestamp):
     """
-    Invoke the cloud anomaly inference Lambda if configured.
+    Score one reading with the cloud anomaly model (inline or remote).
     Returns {'is_anomaly': bool, 'cloud_score': float} or None on error.
     """
-    try:
-        heart_rate = metrics.get('heartRate') or metrics.get('heart_rate') or 0
-        steps = metrics.get('steps') or 0
-        calories = metrics.get('calories') or 0
-        distance = metrics.get('distance') or 0
+    entry = _inference_entry(metrics, user_id, timestamp)
+    return invoke_cloud_inference_batch([entry]).get(entry['metric_id'])
 
-        payload = {
-            'metrics': [
-                {
-                    'metric_id': f"{user_id}:{timestamp}",
-                    'heart_rate': heart_rate,
-                    'steps': steps,
-                    'calories': calories,
-                    'distance': distance
-                }
-            ]
+
+def invoke_cloud_inference_batch(entries):
+    """
+    Score many readings with the cloud anomaly model. Inline mode scores
+    them in this process; otherwise (or if the inline model is unavailable)
+    the inference Lambda is invoked with at most CLOUD_INFERENCE_BATCH_SIZE
+    metrics per invocation, up to BATCH_CONCURRENCY invocations at a time.
+    Returns {metric_id: result}; readings from failed chunks are missing.
+    """
+    if INFERENCE_MODE == 'inline':
+        inline_results = _score_inline(entries)
+        if inline_results is not None:
+            return _results_by_metric_id(inline_results)
+        if not cloud_inference_function:
+            return {}
+
+    chunks = [entries[start:start + CLOUD_INFERENCE_BATCH_SIZE]
+              for start in range(0, len(entries), CLOUD_INFERENCE_BATCH_SIZE)]
+    results = []
+    for chunk_results in run_concurrently(_invoke_inference, chunks):
+        results.extend(chunk_results or [])
+    return _results_by_metric_id(results)
+
+
+def _results_by_metric_id(results):
+    return {
+        result.get('metric_id', ''): {
+            'is_anomaly': bool(result.get('is_anomaly')),
+            'cloud_score': result.get('cloud_score'),
+            'anomaly_reasons': result.get('anomaly_reasons', []),
+            'feature_contributions': result.get('feature_contributions', {})
         }
+        for result in results
+    }
+
+
+def _load_inline_detector():
+    """
+    Lazily import lambda_inference_sklearn and load its detector into this
+    process. Returns None (and backs off) if the model cannot be loaded.
+    """
+    global _inline_inference, _inline_failed_at
+
+    if _inline_failed_at is not None and time.time() - _inline_failed_at < INLINE_MODEL_RETRY_SECONDS:
+        return None
 
+    try:
+        if _inline_inference is None:
+            import lambda_inference_sklearn
+            _inline_inference = lambda_inference_sklearn
+        detector = _inline_inference.load_model()
+        _inline_failed_at = None
+        return detector
+    except Exception as e:
+        _inline_failed_at = time.time()
+        logger.error(f"Inline model unavailable, using remote inference: {str(e)}")
+        return None
+
+
+def _score_inline(entries):
+    """Score entries with the in-process detector; None if it is unavailable."""
+    detector = _load_inline_detector()
+    if detector is None:
+        return None
+    try:
+        return detector.predict(entries)
+    except Exception as e:
+        logger.error(f"Inline inference failed, using remote inference: {str(e)}")
+        return None
+
+
+def _invoke_inference(entries):
+    """
+    Send one RequestResponse invocation to the inference Lambda.
+    Returns its list of per-metric results, or None on error.
+    """
+    try:
         response = lambda_client.invoke(
             FunctionName=cloud_inference_function,
             InvocationType='RequestResponse',
-            Payload=json.dumps(payload).encode('utf-8')
+            Payload=json.dumps({'metrics': entries}).encode('utf-8')
         )
 
         raw_body = response.get('Payload')
@@ -406,23 +1549,28 @@ def invoke_cloud_inference(metrics, user_id, timestamp):
             return None
 
         body = json.loads(response_payload.get('body', '{}'))
-        results = body.get('results', [])
-        if not results:
-            return None
-
-        first = results[0]
-        return {
-            'is_anomaly': bool(first.get('is_anomaly')),
-            'cloud_score': first.get('cloud_score'),
-            'anomaly_reasons': first.get('anomaly_reasons', []),
-            'feature_contributions': first.get('feature_contributions', {})
-        }
+        return body.get('results', [])
 
     except Exception as e:
         logger.error(f"Cloud inference invocation failed: {str(e)}")
         return None
 
 
+def _inference_entry(metrics, user_id, timestamp):
+    """Build one element of the inference Lambda's "metrics" list."""
+    return {
+        'metric_id': _metric_id(user_id, timestamp),
+        'heart_rate': metrics.get('heartRate') or metrics.get('heart_rate') or 0,
+        'steps': metrics.get('steps') or 0,
+        'calories': metrics.get('calories') or 0,
+        'distance': metrics.get('distance') or 0
+    }
+
+
+def _metric_id(user_id, timestamp):
+    return f"{user_id}:{timestamp}"
+
+
 def convert_floats_to_decimal(obj):
     """
     Convert float values to Decimal for DynamoDB compatibility
@@ -9,12 +9,17 @@ Model: GradientBoostingClassifier (F1=0.995, AUC-ROC=1.00)
 
 Previous model: Random Forest (F1=0.983) — replaced Mar 2026
 """
+import io
+import itertools
 import json
 import boto3
 import logging
-import joblib
 import numpy as np
 import os
+import threading
+import time
+from botocore.exceptions import ClientError
+from collections import OrderedDict
 from datetime import datetime
 
 logger = logging.getLogger()
@@ -25,6 +30,7 @@ s3_client = boto3.client('s3')
 
 # Global model cache
 _detector = None
+_registry = None
 _model = None
 _scaler = None
 
@@ -35,6 +41,32 @@ SCALER_KEY = os.environ.get('SCALER_KEY', 'gradientboosting/scaler.pkl')
 LOCAL_MODEL_PATH = '/tmp/model.pkl'
 LOCAL_SCALER_PATH = '/tmp/scaler.pkl'
 
+# Inference engine: 'sklearn' (pickled estimator), 'compiled' (pickles compiled
+# to NumPy tree arrays at load time), 'bundle' (pre-compiled .npz bundle) or
+# 'lut' (bundle's precomputed score grid, exact trees outside of it)
+MODEL_ENGINE = os.environ.get('MODEL_ENGINE', 'sklearn').strip().lower()
+MODEL_BUNDLE_KEY = os.environ.get('MODEL_BUNDLE_KEY', 'gradientboosting/model_bundle.npz')
+BUNDLE_FORMAT_VERSION = 1
+
+# Model registry (bundle engine): the version pointer is either a JSON
+# manifest {"version": ..., "key": ...} or, when no manifest is configured,
+# the ETag of MODEL_BUNDLE_KEY itself. Pinned versions resolve through
+# MODEL_VERSION_KEY_TEMPLATE unless the manifest names their key.
+MODEL_MANIFEST_KEY = os.environ.get('MODEL_MANIFEST_KEY', '')
+MODEL_VERSION_KEY_TEMPLATE = os.environ.get(
+    'MODEL_VERSION_KEY_TEMPLATE', 'gradientboosting/versions/{version}/model_bundle.npz'
+)
+MODEL_REFRESH_SECONDS = float(os.environ.get('MODEL_REFRESH_SECONDS', '60'))
+MODEL_CACHE_SIZE = int(os.environ.get('MODEL_CACHE_SIZE', '3'))
+
+# Prediction cache (disabled when PREDICTION_CACHE_SIZE is 0): repeated
+# readings are keyed on their feature vector quantized to these step sizes
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', '0'))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', '300'))
+PREDICTION_CACHE_RESOLUTION = os.environ.get(
+    'PREDICTION_CACHE_RESOLUTION', 'heartRate=1,steps=5,calories=1,distance=0.01'
+)
+
 # CORS headers
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -69,7 +101,9 @@ class AnomalyDetector:
     def __init__(self, model, scaler):
         self.model = model
         self.scaler = scaler
-        self.model_type = type(model).__name__
+        self.model_type = getattr(model, 'model_type', type(model).__name__)
+        self.model_version = None
+        self.cache = build_prediction_cache(self.FEATURE_NAMES)
         
         # Determine threshold based on model type
         if hasattr(model, 'offset_'):
@@ -92,6 +126,12 @@ class AnomalyDetector:
     def predict(self, metrics_list):
         """
         Score a batch of health metrics for anomalies, with human-readable explanations.
+
+        Valid rows are scored together (one scaler.transform and one model
+        call for the whole batch); rows that fail validation get an error
+        result without affecting the others. With a prediction cache, rows
+        whose quantized feature vector was scored recently reuse that result
+        and only the misses reach the model.
         
         Args:
             metrics_list: List of dicts with keys: heart_rate, steps, calories, distance
@@ -105,69 +145,157 @@ class AnomalyDetector:
                 "feature_contributions": {"heartRate": 0.72, "steps": 0.15, ...}
             }, ...]
         """
-        results = []
-        
-        for metric in metrics_list:
+        results = [None] * len(metrics_list)
+
+        # Validation pass: rows that cannot form a finite feature vector get
+        # an error result and are left out of the vectorized batch.
+        valid_idx = []
+        rows = []
+        for i, metric in enumerate(metrics_list):
             try:
-                raw_values = {
-                    'heartRate': metric.get('heart_rate', 0),
-                    'steps':     metric.get('steps', 0),
-                    'calories':  metric.get('calories', 0),
-                    'distance':  metric.get('distance', 0),
-                }
-
-                # Extract features in order: [heart_rate, steps, calories, distance]
-                features = np.array([[
-                    raw_values['heartRate'],
-                    raw_values['steps'],
-                    raw_values['calories'],
-                    raw_values['distance'],
-                ]])
-                
-                # Normalize using fitted scaler
-                features_scaled = self.scaler.transform(features)
-                
-                if self.is_supervised:
-                    # Supervised model (Random Forest, Gradient Boosting, etc.)
-                    prediction = int(self.model.predict(features_scaled)[0])
-                    probabilities = self.model.predict_proba(features_scaled)[0]
-                    anomaly_probability = float(probabilities[1])  # P(anomaly)
-                    is_anomaly = prediction == 1
-                    normalized_score = anomaly_probability
-                else:
-                    # Unsupervised model (Isolation Forest) — legacy support
-                    score = float(self.model.score_samples(features_scaled)[0])
-                    normalized_score = float(1.0 / (1.0 + np.exp(-score)))
-                    is_anomaly = score < self.threshold
-
-                # Generate explanations
-                reasons, contributions = self._explain_anomaly(
-                    raw_values, features_scaled, is_anomaly, normalized_score
-                )
-                
-                results.append({
-                    'metric_id': metric.get('metric_id', ''),
-                    'is_anomaly': bool(is_anomaly),
-                    'cloud_score': float(normalized_score),
-                    'model_type': self.model_type,
-                    'anomaly_reasons': reasons,
-                    'feature_contributions': contributions,
-                })
-                
+                rows.append(self._feature_row(metric))
+                valid_idx.append(i)
             except Exception as e:
-                logger.error(f"Error scoring metric {metric.get('metric_id', 'unknown')}: {str(e)}")
-                results.append({
-                    'metric_id': metric.get('metric_id', ''),
-                    'is_anomaly': False,
-                    'cloud_score': 0.5,
-                    'anomaly_reasons': [],
-                    'feature_contributions': {},
-                    'error': str(e)
-                })
-        
+                results[i] = self._error_result(metric, e)
+
+        features = np.array(rows, dtype=np.float64).reshape(-1, len(self.FEATURE_NAMES))
+        finite = np.isfinite(features).all(axis=1)
+        if not finite.all():
+            for k in np.flatnonzero(~finite):
+                i = valid_idx[k]
+                results[i] = self._error_result(
+                    metrics_list[i], ValueError(f"Non-finite feature value in {rows[k]}")
+                )
+            valid_idx = [i for i, ok in zip(valid_idx, finite.tolist()) if ok]
+            features = features[finite]
+
+        if valid_idx:
+            score = self._score_rows if self.cache is None else self._score_rows_cached
+            for i, result in zip(valid_idx, score([metrics_list[i] for i in valid_idx], features)):
+                results[i] = result
+
         return results
 
+    def _score_rows(self, metrics, features):
+        """_predict_batch, falling back to row-by-row scoring if the batch fails."""
+        try:
+            return self._predict_batch(metrics, features)
+        except Exception as e:
+            # Keep per-row isolation if the batch itself fails
+            logger.error(f"Vectorized scoring failed, scoring rows individually: {str(e)}")
+            results = []
+            for k, metric in enumerate(metrics):
+                try:
+                    results.extend(self._predict_batch([metric], features[k:k + 1]))
+                except Exception as row_error:
+                    results.append(self._error_result(metric, row_error))
+            return results
+
+    def _score_rows_cached(self, metrics, features):
+        """
+        Score through the prediction cache: each distinct quantized vector is
+        looked up once, only uncached ones reach the model, and every row gets
+        its own copy of the result for its key.
+        """
+        started = time.perf_counter()
+        keys, first, inverse = self.cache.keys(features, *self._range_bounds())
+        payloads = [self.cache.get(key) for key in keys]
+        todo = [u for u, payload in enumerate(payloads) if payload is None]
+        # Repeats of a key within the batch are served like cache hits
+        self.cache.record_hits(len(metrics) - len(keys), skipped_call=not todo)
+        bookkeeping = time.perf_counter() - started
+
+        if todo:
+            rows = [first[u] for u in todo]
+            scoring_started = time.perf_counter()
+            scored = self._score_rows([metrics[r] for r in rows], features[rows])
+            self.cache.observe_scoring(len(rows), time.perf_counter() - scoring_started)
+            for u, result in zip(todo, scored):
+                payloads[u] = result
+                if 'error' not in result:
+                    self.cache.put(keys[u], result)
+
+        started = time.perf_counter()
+        results = [self.cache.result_for(metric, payloads[u]) for metric, u in zip(metrics, inverse)]
+        self.cache.charge(bookkeeping + time.perf_counter() - started)
+        return results
+
+    def _feature_row(self, metric):
+        """Extract [heart_rate, steps, calories, distance] as floats."""
+        return [
+            float(metric.get('heart_rate', 0)),
+            float(metric.get('steps', 0)),
+            float(metric.get('calories', 0)),
+            float(metric.get('distance', 0)),
+        ]
+
+    def _predict_batch(self, metrics, features):
+        """
+        Score an N×4 feature matrix with a single scaler.transform and a
+        single model call, then attach per-row explanations.
+        """
+        # Normalize using fitted scaler
+        features_scaled = self.scaler.transform(features)
+
+        if self.is_supervised:
+            # Supervised model (Random Forest, Gradient Boosting, etc.)
+            # P(anomaly); the label follows from the probability threshold,
+            # which matches model.predict without a second pass over the trees.
+            scores = self.model.predict_proba(features_scaled)[:, 1].astype(float)
+            is_anomaly = scores >= self.threshold
+        else:
+            # Unsupervised model (Isolation Forest) — legacy support
+            raw_scores = self.model.score_samples(features_scaled)
+            scores = 1.0 / (1.0 + np.exp(-raw_scores))
+            is_anomaly = raw_scores < self.threshold
+
+        # Generate explanations for the whole batch at once
+        explanations = self._explain_batch(features, features_scaled, is_anomaly, scores)
+
+        results = []
+        for metric, flag, score, (reasons, contributions) in zip(
+                metrics, is_anomaly.tolist(), scores.tolist(), explanations):
+            results.append({
+                'metric_id': metric.get('metric_id', ''),
+                'is_anomaly': flag,
+                'cloud_score': score,
+                'model_type': self.model_type,
+                'anomaly_reasons': reasons,
+                'feature_contributions': contributions,
+            })
+
+        return results
+
+    def _error_result(self, metric, error):
+        logger.error(f"Error scoring metric {metric.get('metric_id', 'unknown')}: {str(error)}")
+        return {
+            'metric_id': metric.get('metric_id', ''),
+            'is_anomaly': False,
+            'cloud_score': 0.5,
+            'anomaly_reasons': [],
+            'feature_contributions': {},
+            'error': str(error)
+        }
+
     def _explain_anomaly(self, raw_values, features_scaled, is_anomaly, score):
+        """
+        Single-row form of _explain_batch.
+
+        Args:
+            raw_values: dict of original feature values (unscaled)
+            features_scaled: numpy array of scaled features [1, n_features]
+            is_anomaly: bool prediction result
+            score: float anomaly probability / score
+
+        Returns:
+            (reasons: list[str], contributions: dict[str, float])
+        """
+        features = np.array([[raw_values[name] for name in self.FEATURE_NAMES]], dtype=np.float64)
+        return self._explain_batch(
+            features, np.asarray(features_scaled), np.array([is_anomaly]), np.array([score])
+        )[0]
+
+    def _explain_batch(self, features, features_scaled, is_anomaly, scores):
         """
         Generate human-readable explanations for why an anomaly was (or was not) detected.
         
@@ -175,99 +303,794 @@ class AnomalyDetector:
         1. Range-based: compare raw feature values against known normal ranges.
         2. Importance-weighted: use model feature_importances_ to rank which
            features contributed most to the anomaly score.
+
+        Range checks, contributions and top contributors are computed as
+        array operations over the whole batch; reason strings are only
+        formatted for rows that are anomalous or out of range.
         
         Args:
-            raw_values: dict of original feature values (unscaled)
-            features_scaled: numpy array of scaled features [1, n_features]
-            is_anomaly: bool prediction result
-            score: float anomaly probability / score
+            features: numpy array of raw feature values [n, n_features]
+            features_scaled: numpy array of scaled features [n, n_features]
+            is_anomaly: bool array of prediction results [n]
+            scores: float array of anomaly probabilities / scores [n]
         
         Returns:
-            (reasons: list[str], contributions: dict[str, float])
+            list of (reasons: list[str], contributions: dict[str, float]) per row
         """
-        reasons = []
-        contributions = {}
+        lows, highs = self._range_bounds()
 
         # --- 1. Range-based explanations (always computed) ---
-        for i, name in enumerate(self.FEATURE_NAMES):
-            val = raw_values[name]
-            lo, hi, label = self.NORMAL_RANGES[name]
-            unit = self.FEATURE_UNITS[name]
+        above = features > highs
+        below = features < lows
+        needs_reasons = np.asarray(is_anomaly) | (above | below).any(axis=1)
+
+        # --- 2. Feature-importance-weighted contributions ---
+        shares = None
+        top_idx = None
+        if (self.feature_importances is not None
+                and hasattr(self.scaler, 'mean_') and hasattr(self.scaler, 'scale_')):
+            # Per-feature deviation from scaler mean (already (x - mean) / std)
+            weighted = np.abs(features_scaled) * self.feature_importances
+            totals = weighted.sum(axis=1)
+            totals = np.where(totals > 0, totals, 1.0)
+            shares = np.round(weighted / totals[:, None], 4).tolist()
+            top_idx = np.argmax(weighted, axis=1)
+
+        names = self.FEATURE_NAMES
+        if shares is not None:
+            explanations = [([], dict(zip(names, row))) for row in shares]
+        else:
+            explanations = [([], {}) for _ in range(len(features))]
 
-            if val > hi:
+        # Format reason strings only for anomalous or out-of-range rows
+        for i in np.flatnonzero(needs_reasons).tolist():
+            reasons, contributions = explanations[i]
+            values = features[i].tolist()
+            row_above = above[i].tolist()
+            row_below = below[i].tolist()
+            for j, name in enumerate(names):
+                if row_above[j] or row_below[j]:
+                    lo, hi, label = self.NORMAL_RANGES[name]
+                    unit = self.FEATURE_UNITS[name]
+                    direction = 'above' if row_above[j] else 'below'
+                    reasons.append(
+                        f"{label}: {values[j]:.0f} {unit} is {direction} normal range ({lo}–{hi} {unit})"
+                    )
+
+            # If anomaly detected but no range-based reasons fired,
+            # add top-contributing feature as explanation
+            if is_anomaly[i] and not reasons and top_idx is not None:
+                top_j = int(top_idx[i])
+                top_name = names[top_j]
+                unit = self.FEATURE_UNITS[top_name]
+                pct = contributions[top_name] * 100
                 reasons.append(
-                    f"{label}: {val:.0f} {unit} is above normal range ({lo}–{hi} {unit})"
+                    f"Unusual {top_name} value ({values[top_j]:.0f} {unit}) "
+                    f"contributed {pct:.0f}% to anomaly score"
                 )
-            elif val < lo:
+
+            # --- 3. High-level summary ---
+            if is_anomaly[i] and not reasons:
+                # Fallback: generic reason with the model score
                 reasons.append(
-                    f"{label}: {val:.0f} {unit} is below normal range ({lo}–{hi} {unit})"
+                    f"Model confidence: {scores[i]:.1%} probability of anomaly"
                 )
 
-        # --- 2. Feature-importance-weighted contributions ---
-        if self.feature_importances is not None:
-            # Compute per-feature deviation from scaler mean (in std units)
-            if hasattr(self.scaler, 'mean_') and hasattr(self.scaler, 'scale_'):
-                deviations = np.abs(features_scaled[0])  # already (x - mean) / std
-                weighted = deviations * self.feature_importances
-                total = weighted.sum() if weighted.sum() > 0 else 1.0
-                for i, name in enumerate(self.FEATURE_NAMES):
-                    contributions[name] = round(float(weighted[i] / total), 4)
-
-                # If anomaly detected but no range-based reasons fired,
-                # add top-contributing feature as explanation
-                if is_anomaly and not reasons:
-                    top_idx = int(np.argmax(weighted))
-                    top_name = self.FEATURE_NAMES[top_idx]
-                    top_val = raw_values[top_name]
-                    unit = self.FEATURE_UNITS[top_name]
-                    pct = contributions[top_name] * 100
-                    reasons.append(
-                        f"Unusual {top_name} value ({top_val:.0f} {unit}) "
-                        f"contributed {pct:.0f}% to anomaly score"
-                    )
+        return explanations
+
+    def _range_bounds(self):
+        """NORMAL_RANGES as (lows, highs) arrays in FEATURE_NAMES order."""
+        lows = np.array([self.NORMAL_RANGES[name][0] for name in self.FEATURE_NAMES], dtype=np.float64)
+        highs = np.array([self.NORMAL_RANGES[name][1] for name in self.FEATURE_NAMES], dtype=np.float64)
+        return lows, highs
+
+
+class PredictionCache:
+    """
+    Bounded LRU of recent predictions with a TTL, keyed on the quantized
+    feature vector (e.g. heart rate to 1 BPM, steps to 5). Readings that
+    repeat, such as resting vectors during sleep, reuse the stored score,
+    verdict and explanation instead of going through the model.
+
+    The key also carries which features are outside NORMAL_RANGES, so a hit
+    never changes which range reasons a reading gets; only the numbers in
+    the reason text are those of the reading that was actually scored.
+    """
+
+    def __init__(self, resolution, max_size, ttl_seconds=None, clock=time.monotonic):
+        self.steps = np.asarray(resolution, dtype=np.float64)
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'time_saved_ms': 0.0}
+        self._window = dict(self.stats)
+        self._entries = OrderedDict()
+        # Scoring cost model (seconds): call_cost + row_cost per row, fitted
+        # from the model calls made for misses (see observe_scoring)
+        self.call_cost = None
+        self.row_cost = None
+        self._cost_samples = [0, 0.0, 0.0, 0.0, 0.0]  # count, Σn, Σt, Σn², Σnt
+
+    def keys(self, features, lows, highs):
+        """
+        Distinct cache keys in an N×F feature matrix.
+
+        Returns (keys, first, inverse): the distinct keys as tuples, the
+        first row holding each key, and each row's position in `keys`.
+        """
+        quantized = np.round(features / self.steps).astype(np.int64)
+        out_of_range = (features > highs) | (features < lows)
+        flags = out_of_range.astype(np.int64) @ (1 << np.arange(features.shape[1], dtype=np.int64))
+        unique, first, inverse = np.unique(
+            np.column_stack([quantized, flags]), axis=0, return_index=True, return_inverse=True
+        )
+        return [tuple(row) for row in unique.tolist()], first.tolist(), inverse.reshape(-1).tolist()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, payload = entry
+            if expires_at is None or expires_at > self.clock():
+                self._entries.move_to_end(key)
+                self.record_hits(1)
+                return payload
+            del self._entries[key]
+            self._count('expirations')
+        self._count('misses')
+        return None
+
+    def put(self, key, result):
+        expires_at = self.clock() + self.ttl_seconds if self.ttl_seconds else None
+        payload = dict(result)
+        payload.pop('metric_id', None)
+        self._entries[key] = (expires_at, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._count('evictions')
+
+    @staticmethod
+    def result_for(metric, payload):
+        """A fresh result dict for `metric` from a cached payload."""
+        result = payload.copy()
+        result['metric_id'] = metric.get('metric_id', '')
+        result['anomaly_reasons'] = payload['anomaly_reasons'][:]
+        result['feature_contributions'] = payload['feature_contributions'].copy()
+        return result
+
+    def record_hits(self, rows, skipped_call=False):
+        """Count rows served without the model and the scoring time they saved."""
+        self._count('hits', rows)
+        if self.row_cost is not None:
+            saved = rows * self.row_cost + (self.call_cost if skipped_call else 0.0)
+            self._count('time_saved_ms', saved * 1000)
+
+    def charge(self, elapsed):
+        """Subtract time spent in cache bookkeeping, so time_saved_ms is net."""
+        self._count('time_saved_ms', -elapsed * 1000)
+
+    def observe_scoring(self, rows, elapsed):
+        """
+        Update the cost model with a model call that scored `rows` misses in
+        `elapsed` seconds: a least-squares line through every call so far,
+        or the mean cost per row while all calls had the same size.
+        """
+        samples = self._cost_samples
+        for index, value in enumerate((1, rows, elapsed, rows * rows, rows * elapsed)):
+            samples[index] += value
+        count, sum_n, sum_t, sum_nn, sum_nt = samples
+        spread = count * sum_nn - sum_n * sum_n
+        if spread > 0:
+            self.row_cost = max((count * sum_nt - sum_n * sum_t) / spread, 0.0)
+            self.call_cost = max((sum_t - self.row_cost * sum_n) / count, 0.0)
+        else:
+            self.row_cost = sum_t / sum_n
+            self.call_cost = 0.0
+
+    def metrics(self):
+        """Cumulative counters plus hit rate and current size."""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(
+            self.stats,
+            time_saved_ms=round(self.stats['time_saved_ms'], 3),
+            hit_rate=round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+            size=len(self._entries),
+        )
+
+    def emit_metrics(self, model_version=None):
+        """
+        Print counters accumulated since the last call in CloudWatch Embedded
+        Metric Format, so hit rate and time saved become CloudWatch metrics
+        without an extra API call.
+        """
+        window, self._window = self._window, dict.fromkeys(self.stats, 0)
+        lookups = window['hits'] + window['misses']
+        if not lookups:
+            return
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': 'HealthMonitor/Inference',
+                    'Dimensions': [['ModelVersion']],
+                    'Metrics': [
+                        {'Name': 'PredictionCacheHits', 'Unit': 'Count'},
+                        {'Name': 'PredictionCacheMisses', 'Unit': 'Count'},
+                        {'Name': 'PredictionCacheHitRate', 'Unit': 'Percent'},
+                        {'Name': 'PredictionCacheTimeSaved', 'Unit': 'Milliseconds'},
+                    ],
+                }],
+            },
+            'ModelVersion': str(model_version),
+            'PredictionCacheHits': window['hits'],
+            'PredictionCacheMisses': window['misses'],
+            'PredictionCacheHitRate': round(100.0 * window['hits'] / lookups, 2),
+            'PredictionCacheTimeSaved': round(window['time_saved_ms'], 3),
+        }))
+
+    def _count(self, name, amount=1):
+        self.stats[name] += amount
+        self._window[name] += amount
+
+
+def build_prediction_cache(feature_names):
+    """PredictionCache from the PREDICTION_CACHE_* settings, or None when disabled."""
+    if PREDICTION_CACHE_SIZE <= 0:
+        return None
+    resolution = dict(
+        (name.strip(), float(step))
+        for name, step in (part.split('=') for part in PREDICTION_CACHE_RESOLUTION.split(',') if part.strip())
+    )
+    return PredictionCache(
+        [resolution.get(name, 1.0) for name in feature_names],
+        max_size=PREDICTION_CACHE_SIZE,
+        ttl_seconds=PREDICTION_CACHE_TTL or None,
+    )
+
+
+class CompiledScaler:
+    """StandardScaler parameters applied with plain NumPy: (X - mean_) / scale_."""
+
+    def __init__(self, mean, scale):
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_sklearn(cls, scaler):
+        n_features = scaler.n_features_in_
+        mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n_features)
+        return cls(mean, scale)
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+class CompiledTreeEnsemble:
+    """
+    A fitted binary GradientBoostingClassifier flattened into contiguous
+    NumPy arrays and evaluated without sklearn.
+
+    All trees share one set of node arrays (feature index, threshold, left
+    child, right child, leaf value); ``roots`` holds each tree's first node.
+    Leaves point to themselves, so every row walks every tree for exactly
+    ``max_depth`` vectorized steps. Leaf values are pre-multiplied by the
+    learning rate and accumulated in tree order, which reproduces sklearn's
+    predict_proba bit for bit.
+    """
+
+    model_type = 'GradientBoostingClassifier'
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes,
+                 init_score, max_depth, feature_importances):
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.intp)
+        self.right = np.ascontiguousarray(right, dtype=np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.classes_ = np.asarray(classes)
+        self.init_score = float(init_score)
+        self.max_depth = int(max_depth)
+        self.feature_importances_ = np.asarray(feature_importances, dtype=np.float64)
+        # Bundles use numpy's exp: importing scipy would cost the cold start
+        # the bundle exists to save. from_sklearn swaps in scipy's expit.
+        self._expit = None
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted binary GradientBoostingClassifier (log-loss)."""
+        if type(model).__name__ != 'GradientBoostingClassifier':
+            raise ValueError(f"Cannot compile {type(model).__name__}")
+        if model.estimators_.shape[1] != 1 or model.loss not in ('log_loss', 'deviance'):
+            raise ValueError("Only binary log-loss GradientBoostingClassifier can be compiled")
+
+        n_features = model.n_features_in_
+        if model.init_ == 'zero':
+            init_score = 0.0
+        else:
+            # The default init estimator predicts the class prior, which is
+            # the same raw score for every row.
+            if type(model.init_).__name__ != 'DummyClassifier':
+                raise ValueError("Only the default (prior) init estimator can be compiled")
+            init_score = float(model._raw_predict_init(np.zeros((1, n_features)))[0, 0])
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_[:, 0]:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left < 0
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            values.append(model.learning_rate * tree.value[:, 0, 0])
+            roots.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        compiled = cls(
+            np.concatenate(features), np.concatenate(thresholds),
+            np.concatenate(lefts), np.concatenate(rights), np.concatenate(values),
+            np.array(roots), model.classes_, init_score, max_depth,
+            model.feature_importances_,
+        )
+        # What sklearn's log-loss uses; scipy is loaded already wherever sklearn is
+        from scipy.special import expit
+        compiled._expit = expit
+        return compiled
+
+    def to_arrays(self):
+        """Arrays for the model bundle (see write_model_bundle)."""
+        return {
+            'tree_feature': self.feature,
+            'tree_threshold': self.threshold,
+            'tree_left': self.left,
+            'tree_right': self.right,
+            'tree_value': self.value,
+            'tree_roots': self.roots,
+            'classes': self.classes_,
+            'feature_importances': self.feature_importances_,
+            'init_score': np.array(self.init_score),
+            'max_depth': np.array(self.max_depth),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            arrays['tree_feature'], arrays['tree_threshold'], arrays['tree_left'],
+            arrays['tree_right'], arrays['tree_value'], arrays['tree_roots'],
+            arrays['classes'], arrays['init_score'], arrays['max_depth'],
+            arrays['feature_importances'],
+        )
 
-        # --- 3. High-level summary ---
-        if is_anomaly and not reasons:
-            # Fallback: generic reason with the model score
-            reasons.append(
-                f"Model confidence: {score:.1%} probability of anomaly"
-            )
+    def decision_function(self, X):
+        # sklearn evaluates trees on float32 inputs compared against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        row_base = np.arange(n_rows, dtype=np.intp) * n_features
 
-        return reasons, contributions
+        # Node index per (tree, row), advanced one level per step for all trees at once
+        nodes = np.repeat(self.roots[:, None], n_rows, axis=1)
+        for _ in range(self.max_depth):
+            go_left = flat_X.take(row_base + self.feature.take(nodes)) <= self.threshold.take(nodes)
+            nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
 
+        raw = np.full(n_rows, self.init_score)
+        for leaf_values in self.value.take(nodes):
+            raw += leaf_values
+        return raw
 
-def load_model():
-    """Lazy-load model and scaler from S3 on first invocation."""
+    def predict_proba(self, X):
+        raw = self.decision_function(X)
+        if self._expit is not None:
+            positive = self._expit(raw)  # bit-identical to sklearn
+        else:
+            # Same expression with numpy's exp: agrees with expit to a few ulp
+            with np.errstate(over='ignore'):
+                positive = 1.0 / (1.0 + np.exp(-raw))
+        return np.column_stack([1.0 - positive, positive])
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) >= 0).astype(int)]
+
+
+class ScoreLookupTable:
+    """
+    Dense grid of raw (log-odds) model scores over a uniform grid of the
+    feature space, built once offline.
+
+    A row inside the grid is answered by indexing its cell directly and
+    interpolating the cell's 2^d corner scores. Cells whose corners disagree
+    by more than the build tolerance (probability spread), typically those
+    straddling a tree split near the decision boundary, are marked as not
+    confident; rows falling there, or outside the grid, are left to the
+    exact model.
+    """
+
+    def __init__(self, lo, step, values, confident, report=None):
+        self.lo = np.asarray(lo, dtype=np.float64)
+        self.step = np.asarray(step, dtype=np.float64)
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+        self.confident = np.ascontiguousarray(confident, dtype=bool)
+        self.report = dict(report or {})
+
+        shape = np.array(self.values.shape)
+        corners = np.array(list(itertools.product((0, 1), repeat=len(shape))))
+        self._upper = shape - 1
+        self._flat = self.values.reshape(-1)
+        self._strides = np.array(self.values.strides) // self.values.itemsize
+        self._corner_offsets = corners @ self._strides
+        self._corner_bits = corners.astype(bool)
+        self._confident_flat = self.confident.reshape(-1)
+        self._cell_strides = np.array(self.confident.strides) // self.confident.itemsize
+
+    @classmethod
+    def build(cls, model, scaler, axes, tolerance=0.02, chunk_size=262144):
+        """
+        Evaluate `model` (sklearn or compiled) on the grid spanned by `axes`,
+        one uniformly spaced array of raw feature values per feature.
+        """
+        axes = [np.asarray(a, dtype=np.float64) for a in axes]
+        shape = tuple(len(a) for a in axes)
+        grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+        raw = np.empty(len(grid), dtype=np.float64)
+        for start in range(0, len(grid), chunk_size):
+            chunk = grid[start:start + chunk_size]
+            raw[start:start + chunk_size] = np.asarray(model.decision_function(scaler.transform(chunk))).reshape(-1)
+        values = raw.reshape(shape).astype(np.float32)
+
+        # Probability spread across each cell's corners
+        prob = 1.0 / (1.0 + np.exp(-values.astype(np.float64)))
+        cells = tuple(n - 1 for n in shape)
+        hi = np.full(cells, -np.inf)
+        lo = np.full(cells, np.inf)
+        for corner in itertools.product((0, 1), repeat=len(shape)):
+            view = prob[tuple(slice(c, c + n) for c, n in zip(corner, cells))]
+            np.maximum(hi, view, out=hi)
+            np.minimum(lo, view, out=lo)
+
+        return cls(
+            lo=[a[0] for a in axes],
+            step=[a[1] - a[0] for a in axes],
+            values=values,
+            confident=(hi - lo) <= tolerance,
+            report={'tolerance': tolerance, 'grid_shape': list(shape)},
+        )
+
+    def in_scaled_space(self, mean, scale):
+        """The same table addressed by StandardScaler-transformed features."""
+        mean = np.asarray(mean, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        return ScoreLookupTable((self.lo - mean) / scale, self.step / scale,
+                                self.values, self.confident, self.report)
+
+    def to_arrays(self):
+        return {
+            'lut_lo': self.lo,
+            'lut_step': self.step,
+            'lut_values': self.values,
+            'lut_confident': self.confident,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, report=None):
+        return cls(arrays['lut_lo'], arrays['lut_step'], arrays['lut_values'],
+                   arrays['lut_confident'], report)
+
+    def lookup(self, X):
+        """
+        Answer the rows of X that fall in confident cells.
+
+        Returns (rows, raw_scores): indexes into X and their interpolated
+        raw scores. Every other row needs the exact model.
+        """
+        pos = (np.asarray(X, dtype=np.float64) - self.lo) / self.step
+        in_grid = ((pos >= 0) & (pos <= self._upper)).all(axis=1)
+        rows = np.flatnonzero(in_grid)
+        pos = pos[rows]
+        cell = np.minimum(pos.astype(np.intp), self._upper - 1)
+        confident = self._confident_flat[cell @ self._cell_strides]
+        rows, pos, cell = rows[confident], pos[confident], cell[confident]
+
+        frac = pos - cell
+        corner_values = self._flat[(cell @ self._strides)[:, None] + self._corner_offsets]
+        weights = np.where(self._corner_bits, frac[:, None, :], 1.0 - frac[:, None, :]).prod(axis=2)
+        return rows, (corner_values * weights).sum(axis=1)
+
+
+class LookupTableModel:
+    """
+    Model wrapper answering from a ScoreLookupTable and falling back to the
+    exact model for rows the table cannot answer within its tolerance.
+    Takes scaled features, like the models it wraps.
+    """
+
+    def __init__(self, lut, exact):
+        self.lut = lut
+        self.exact = exact
+        self.model_type = getattr(exact, 'model_type', type(exact).__name__)
+        self.classes_ = exact.classes_
+        self.feature_importances_ = exact.feature_importances_
+        self.stats = {'lut_rows': 0, 'exact_rows': 0}
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        proba = np.empty(len(X), dtype=np.float64)
+        rows, raw = self.lut.lookup(X)
+        proba[rows] = 1.0 / (1.0 + np.exp(-raw))
+
+        exact_rows = np.ones(len(X), dtype=bool)
+        exact_rows[rows] = False
+        if exact_rows.any():
+            proba[exact_rows] = self.exact.predict_proba(X[exact_rows])[:, 1]
+
+        self.stats['lut_rows'] += len(rows)
+        self.stats['exact_rows'] += len(X) - len(rows)
+        return np.column_stack([1.0 - proba, proba])
+
+    def predict(self, X):
+        return self.classes_[(self.predict_proba(X)[:, 1] > 0.5).astype(np.intp)]
+
+
+def write_model_bundle(path, model, scaler, model_version, threshold=0.5, lut=None):
+    """
+    Write a single versioned, pickle-free model bundle (.npz).
+
+    Contains the scaler mean/scale, the compiled tree arrays and a JSON
+    metadata record (feature names, decision threshold, NORMAL_RANGES,
+    format and model versions), plus an optional ScoreLookupTable and its
+    error report. Used on the training side; the inference Lambda reads it
+    with read_model_bundle.
+    """
+    compiled = CompiledTreeEnsemble.from_sklearn(model)
+    compiled_scaler = CompiledScaler.from_sklearn(scaler)
+    metadata = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'model_version': str(model_version),
+        'model_type': compiled.model_type,
+        'feature_names': AnomalyDetector.FEATURE_NAMES,
+        'feature_units': AnomalyDetector.FEATURE_UNITS,
+        'threshold': float(threshold),
+        'normal_ranges': {k: list(v) for k, v in AnomalyDetector.NORMAL_RANGES.items()},
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+    }
+    arrays = compiled.to_arrays()
+    if lut is not None:
+        metadata['lut'] = lut.report
+        arrays.update(lut.to_arrays())
+    np.savez(
+        path,
+        metadata=np.frombuffer(json.dumps(metadata).encode('utf-8'), dtype=np.uint8),
+        scaler_mean=compiled_scaler.mean_,
+        scaler_scale=compiled_scaler.scale_,
+        **arrays
+    )
+    return metadata
+
+
+def read_model_bundle(data, use_lut=None):
+    """
+    Build an AnomalyDetector from model bundle bytes, without unpickling.
+    With `use_lut` (default: MODEL_ENGINE == 'lut') the bundle's lookup
+    table answers first and the compiled trees cover the rest.
+    """
+    if use_lut is None:
+        use_lut = MODEL_ENGINE == 'lut'
+
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        metadata = json.loads(arrays['metadata'].tobytes().decode('utf-8'))
+        if metadata.get('format_version') != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model bundle format: {metadata.get('format_version')}")
+        model = CompiledTreeEnsemble.from_arrays(arrays)
+        scaler = CompiledScaler(arrays['scaler_mean'], arrays['scaler_scale'])
+        if use_lut:
+            if 'lut_values' in arrays:
+                lut = ScoreLookupTable.from_arrays(arrays, metadata.get('lut'))
+                model = LookupTableModel(lut.in_scaled_space(scaler.mean_, scaler.scale_), model)
+                logger.info(f"Score lookup table enabled: {lut.report}")
+            else:
+                logger.warning("MODEL_ENGINE=lut but the bundle has no lookup table, using compiled trees")
+
+    detector = AnomalyDetector(model, scaler)
+    detector.threshold = float(metadata['threshold'])
+    detector.model_version = metadata['model_version']
+    detector.FEATURE_NAMES = list(metadata['feature_names'])
+    detector.FEATURE_UNITS = dict(metadata['feature_units'])
+    detector.NORMAL_RANGES = {k: tuple(v) for k, v in metadata['normal_ranges'].items()}
+    detector.cache = build_prediction_cache(detector.FEATURE_NAMES)
+    return detector
+
+
+class UnknownModelVersion(LookupError):
+    """Raised when a requested model version has no bundle in S3."""
+
+
+class ModelRegistry:
+    """
+    Keeps the most recently used bundle detectors warm and follows a version
+    pointer in S3, so a new model can be rolled out without a redeploy.
+
+    The pointer is polled at most every `refresh_seconds`. A changed pointer
+    is loaded on a background thread while requests keep being scored by the
+    current detector; the swap happens only once the new bundle is ready.
+    Lambda freezes the sandbox between invocations, so a reload that is still
+    running when the response is returned simply finishes on a later one.
+    """
+
+    def __init__(self, bucket, bundle_key, manifest_key='', version_key_template=MODEL_VERSION_KEY_TEMPLATE,
+                 refresh_seconds=MODEL_REFRESH_SECONDS, cache_size=MODEL_CACHE_SIZE, client=None,
+                 clock=time.monotonic):
+        self.bucket = bucket
+        self.bundle_key = bundle_key
+        self.manifest_key = manifest_key
+        self.version_key_template = version_key_template
+        self.refresh_seconds = refresh_seconds
+        self.cache_size = max(1, cache_size)
+        self.client = client if client is not None else s3_client
+        self.clock = clock
+
+        self.current_version = None
+        self.stats = {'hits': 0, 'loads': 0, 'reloads': 0, 'reload_errors': 0, 'evictions': 0}
+        self._detectors = OrderedDict()
+        self._keys = {}
+        self._pointer = None
+        self._last_check = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get(self, version=None):
+        """Return the detector for `version`, or the current one when omitted."""
+        if version is None:
+            if self.current_version is None:
+                self.refresh()
+            else:
+                self._maybe_refresh_async()
+            version = self.current_version
+
+        with self._lock:
+            detector = self._detectors.get(version)
+            if detector is not None:
+                self._detectors.move_to_end(version)
+                self.stats['hits'] += 1
+                return detector
+
+        detector = self._load(self._keys.get(version) or self.version_key_template.format(version=version))
+        with self._lock:
+            self._remember(version, detector)
+        return detector
+
+    def refresh(self):
+        """Check the version pointer and load the version it names if it changed."""
+        self._last_check = self.clock()
+        pointer, version, key = self._read_pointer()
+        if pointer == self._pointer:
+            return False
+
+        detector = self._load(key)
+        version = version or detector.model_version
+        with self._lock:
+            self._keys[version] = key
+            previous = self.current_version
+            self.current_version = version
+            self._pointer = pointer
+            self._remember(version, detector)
+            if previous is not None:
+                self.stats['reloads'] += 1
+        logger.info(f"Model registry: serving version {version} (was {previous})")
+        return True
+
+    def wait_for_refresh(self, timeout=None):
+        """Block until an in-flight background reload has finished."""
+        thread = self._refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _maybe_refresh_async(self):
+        if self.refresh_seconds <= 0 or self.clock() - self._last_check < self.refresh_seconds:
+            return
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._last_check = self.clock()
+            self._refresh_thread = threading.Thread(target=self._refresh_in_background, daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.stats['reload_errors'] += 1
+            logger.error(f"Model registry refresh failed, keeping version {self.current_version}: {str(e)}")
+
+    def _read_pointer(self):
+        """Return (pointer, version, key); version is None when only the ETag is known."""
+        if self.manifest_key:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.manifest_key)
+            manifest = json.loads(response['Body'].read())
+            version = str(manifest['version'])
+            key = manifest.get('key') or self.version_key_template.format(version=version)
+            return f"{version}@{key}", version, key
+
+        response = self.client.head_object(Bucket=self.bucket, Key=self.bundle_key)
+        return response['ETag'], None, self.bundle_key
+
+    def _load(self, key):
+        logger.info(f"Loading model bundle from s3://{self.bucket}/{key}")
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise UnknownModelVersion(f"No model bundle at s3://{self.bucket}/{key}") from e
+            raise
+        detector = read_model_bundle(response['Body'].read())
+        self.stats['loads'] += 1
+        return detector
+
+    def _remember(self, version, detector):
+        # Caller holds the lock; the current version is never evicted
+        self._detectors[version] = detector
+        self._detectors.move_to_end(version)
+        while len(self._detectors) > self.cache_size:
+            oldest = next(v for v in self._detectors if v != self.current_version)
+            del self._detectors[oldest]
+            self.stats['evictions'] += 1
+
+
+def _load_sklearn_artifacts():
+    """Download (if needed) and unpickle the model and scaler from S3."""
+    import joblib
+
+    # Download from S3 if not in /tmp
+    if not os.path.exists(LOCAL_MODEL_PATH):
+        logger.info(f"Downloading model from s3://{MODEL_BUCKET}/{MODEL_KEY}")
+        s3_client.download_file(MODEL_BUCKET, MODEL_KEY, LOCAL_MODEL_PATH)
+
+    if not os.path.exists(LOCAL_SCALER_PATH):
+        logger.info(f"Downloading scaler from s3://{MODEL_BUCKET}/{SCALER_KEY}")
+        s3_client.download_file(MODEL_BUCKET, SCALER_KEY, LOCAL_SCALER_PATH)
+
+    # Load pickled artifacts
+    loaded_model = joblib.load(LOCAL_MODEL_PATH)
+    loaded_scaler = joblib.load(LOCAL_SCALER_PATH)
+
+    # Support both direct model pickle and dict bundle {model, scaler}
+    if isinstance(loaded_model, dict):
+        model = loaded_model.get('model', loaded_model.get('detector', None))
+        scaler = loaded_scaler if loaded_scaler is not None else loaded_model.get('scaler')
+    else:
+        model = loaded_model
+        scaler = loaded_scaler
+
+    return model, scaler
+
+
+def load_model(version=None):
+    """
+    Lazy-load model and scaler from S3 on first invocation.
+    A specific `version` can only be served by the bundle engine's registry.
+    """
     global _model, _scaler, _detector
-    
+
+    if MODEL_ENGINE in ('bundle', 'lut'):
+        return load_bundle_model(version)
+
+    if version is not None and (_detector is None or version != _detector.model_version):
+        raise UnknownModelVersion(f"Model version pinning requires MODEL_ENGINE=bundle or lut (got {MODEL_ENGINE})")
+
     if _detector is not None:
         return _detector
+    if MODEL_ENGINE == 'compiled':
+        return load_compiled_model()
     
     try:
-        # Download from S3 if not in /tmp
-        if not os.path.exists(LOCAL_MODEL_PATH):
-            logger.info(f"Downloading model from s3://{MODEL_BUCKET}/{MODEL_KEY}")
-            s3_client.download_file(MODEL_BUCKET, MODEL_KEY, LOCAL_MODEL_PATH)
-        
-        if not os.path.exists(LOCAL_SCALER_PATH):
-            logger.info(f"Downloading scaler from s3://{MODEL_BUCKET}/{SCALER_KEY}")
-            s3_client.download_file(MODEL_BUCKET, SCALER_KEY, LOCAL_SCALER_PATH)
-        
-        # Load pickled artifacts
-        loaded_model = joblib.load(LOCAL_MODEL_PATH)
-        loaded_scaler = joblib.load(LOCAL_SCALER_PATH)
-
-        # Support both direct model pickle and dict bundle {model, scaler}
-        if isinstance(loaded_model, dict):
-            _model = loaded_model.get('model', loaded_model.get('detector', None))
-            if loaded_scaler is None and 'scaler' in loaded_model:
-                _scaler = loaded_model['scaler']
-        else:
-            _model = loaded_model
-            _scaler = loaded_scaler
-
-        if _scaler is None:
-            _scaler = loaded_scaler
+        _model, _scaler = _load_sklearn_artifacts()
         
         model_type = type(_model).__name__
         logger.info(f"Model loaded successfully: {model_type}")
@@ -282,6 +1105,62 @@ def load_model():
         raise
 
 
+def load_compiled_model():
+    """
+    Load the model and compile it into NumPy tree arrays, so every request is
+    scored without going through sklearn's predict machinery.
+    Falls back to the sklearn estimator for models that cannot be compiled.
+    """
+    global _model, _scaler, _detector
+
+    if _detector is not None:
+        return _detector
+
+    try:
+        model, scaler = _load_sklearn_artifacts()
+        try:
+            _model = CompiledTreeEnsemble.from_sklearn(model)
+            _scaler = CompiledScaler.from_sklearn(scaler)
+            logger.info(f"Compiled {type(model).__name__}: {len(_model.roots)} trees, "
+                        f"{len(_model.feature)} nodes")
+        except ValueError as e:
+            logger.warning(f"Model not compilable, using sklearn estimator: {str(e)}")
+            _model, _scaler = model, scaler
+
+        _detector = AnomalyDetector(_model, _scaler)
+        return _detector
+
+    except Exception as e:
+        logger.error(f"Failed to load model: {str(e)}", exc_info=True)
+        raise
+
+
+def load_bundle_model(version=None):
+    """
+    Serve pre-compiled model bundles through the hot-reloading registry.
+    Each bundle is a single S3 GET: nothing is written to /tmp, nothing is
+    unpickled and sklearn is never imported, which keeps the init phase short
+    on every scale-out.
+    """
+    global _model, _scaler, _detector, _registry
+
+    if _registry is None:
+        _registry = ModelRegistry(MODEL_BUCKET, MODEL_BUNDLE_KEY, manifest_key=MODEL_MANIFEST_KEY)
+
+    try:
+        detector = _registry.get(version)
+    except UnknownModelVersion:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to load model bundle: {str(e)}", exc_info=True)
+        raise
+
+    if version is None:
+        _detector = detector
+        _model, _scaler = detector.model, detector.scaler
+    return detector
+
+
 def lambda_handler(event, context):
     """
     Main Lambda handler for anomaly detection scoring.
@@ -290,8 +1169,10 @@ def lambda_handler(event, context):
     Features: heart_rate, steps, calories, distance
     Preprocessing: StandardScaler normalization
     
-    Expected request body:
+    Expected request body ("model_version" is optional and pins a registry
+    version; the current version is used when it is omitted):
     {
+        "model_version": "20260301-120000",
         "metrics": [
             {
                 "metric_id": "...",
@@ -318,7 +1199,8 @@ def lambda_handler(event, context):
                 ...
             ],
             "timestamp": "2026-03-06T10:30:45Z",
-            "model_type": "GradientBoostingClassifier"
+            "model_type": "GradientBoostingClassifier",
+            "model_version": "20260301-120000"
         }
     }
     """
@@ -346,7 +1228,11 @@ def lambda_handler(event, context):
             return error_response(400, 'Missing "metrics" field in request body')
         
         # Load model (cached on warm starts)
-        detector = load_model()
+        requested_version = body.get('model_version')
+        try:
+            detector = load_model(str(requested_version) if requested_version is not None else None)
+        except UnknownModelVersion as e:
+            return error_response(404, str(e))
         
         # Score metrics
         results = detector.predict(metrics)
@@ -356,8 +1242,12 @@ def lambda_handler(event, context):
             'results': results,
             'timestamp': datetime.utcnow().isoformat() + 'Z',
             'model_type': detector.model_type,
-            'model_supervised': detector.is_supervised
+            'model_supervised': detector.is_supervised,
+            'model_version': detector.model_version
         }
+        if detector.cache is not None:
+            response_body['prediction_cache'] = detector.cache.metrics()
+            detector.cache.emit_metrics(detector.model_version)
         
         anomaly_count = sum(1 for r in results if r['is_anomaly'])
         logger.info(f"Scored {len(results)} metrics with {detector.model_type}, "
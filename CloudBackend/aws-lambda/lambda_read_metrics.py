@@ -1,10 +1,20 @@
+import base64
+import binascii
+import hashlib
+import hmac
 import json
 import boto3
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from decimal import Decimal
 import os
 
+try:
+    import numpy as np
+except ImportError:  # numpy layer not attached: /health-data/aggregate answers 501
+    np = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,6 +24,85 @@ dynamodb = boto3.resource('dynamodb')
 table_name = os.environ.get('TABLE_NAME', 'HealthMetrics')
 table = dynamodb.Table(table_name)
 expected_api_key = os.environ.get('API_KEY', '').strip()
+# Hourly/daily rollups maintained by the ingestion Lambda (see
+# lambda_function.update_rollups); /health-data/summary answers 501 without it
+rollup_table_name = os.environ.get('ROLLUP_TABLE', '').strip()
+rollup_table = dynamodb.Table(rollup_table_name) if rollup_table_name else None
+ROLLUP_GRANULARITIES = {'1h': 3600, '1d': 86400}
+# Per-user dataVersion bumped by ingestion on every write (see
+# lambda_function.update_user_state). With it, data reads carry an ETag and
+# If-None-Match is answered 304 from one GetItem, without reading metrics.
+# The same item holds the current state served by /health/current.
+user_state_table_name = os.environ.get('USER_STATE_TABLE', '').strip()
+user_state_table = dynamodb.Table(user_state_table_name) if user_state_table_name else None
+# Readings responses (metrics, history, sync, changes) are row objects by
+# default. Clients sending Accept: COLUMNAR_MEDIA_TYPE get one array per
+# field and timestamps as a base plus deltas instead; gzip is applied by API
+# Gateway (minimumCompressionSize) when Accept-Encoding allows it.
+COLUMNAR_MEDIA_TYPE = 'application/vnd.healthmonitor.columnar+json'
+CONDITIONAL_GET_PATHS = ('/health-data/sync', '/health-data/history', '/health-data/aggregate',
+                         '/health-data/summary', '/health/metrics')
+
+# Paginated reads return at most MAX_PAGE_SIZE items per page. The opaque
+# continuation cursor is HMAC-signed and bound to the query it came from.
+# The key is CURSOR_SIGNING_KEY, else derived from API_KEY; with neither
+# set, requests that send or would receive a cursor or syncToken fail with
+# 500 rather than accept forgeable ones. Everything else is still served.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def derive_cursor_signing_key(signing_key, api_key):
+    if signing_key:
+        return signing_key.encode('utf-8')
+    if api_key:
+        return hmac.new(api_key.encode('utf-8'), b'health-data-cursor', hashlib.sha256).digest()
+    return None
+
+
+cursor_signing_key = derive_cursor_signing_key(os.environ.get('CURSOR_SIGNING_KEY', '').strip(), expected_api_key)
+if cursor_signing_key is None:
+    logger.error("Neither CURSOR_SIGNING_KEY nor API_KEY is set; refusing paginated requests")
+
+# /health/metrics/bulk reads up to MAX_BULK_USERS users' partitions with at
+# most BULK_READ_CONCURRENCY queries in flight; per-user page sizes shrink
+# so one response holds at most MAX_BULK_READINGS readings.
+MAX_BULK_USERS = 100
+MAX_BULK_READINGS = 10000
+BULK_READ_CONCURRENCY = int(os.environ.get('BULK_READ_CONCURRENCY', '8'))
+
+# /health-data/changes reads the modifiedAt index (userId, modifiedAt) and
+# only serves readings modified at least SYNC_SETTLE_SECONDS ago: every
+# write (including the async verdict rewrite) stamps modifiedAt before
+# scoring and writing (within its 30 s timeout) and the index is eventually
+# consistent, so a younger write could still land behind a client's
+# watermark. Readings stored before modifiedAt existed are not indexed.
+SYNC_INDEX_NAME = os.environ.get('SYNC_INDEX_NAME', 'UserModifiedAtIndex')
+SYNC_SETTLE_SECONDS = int(os.environ.get('SYNC_SETTLE_SECONDS', '35'))
+
+# /health-data/aggregate bucket widths (seconds); buckets are aligned to the
+# epoch so the same reading always lands in the same bucket
+AGGREGATE_BUCKETS = {'1m': 60, '5m': 300, '15m': 900, '1h': 3600, '1d': 86400}
+MAX_AGGREGATE_BUCKETS = 10000
+MAX_DOWNSAMPLE_POINTS = 5000
+# Only what aggregation reads, for both nested and flat metric layouts
+AGGREGATE_PROJECTION = '#ts, metrics, heartRate, steps, calories, distance, anomalyDetected, isAnomaly'
+
+# Response fields of a metric and the stored attributes each one is read
+# from, in fallback order (nested 'metrics' map for older items). id and
+# timestamp are always returned; ?fields= picks any of the rest and only
+# their attributes are projected.
+METRIC_FIELDS = {
+    'heartRate': ('heartRate', 'metrics.heartRate'),
+    'steps': ('steps', 'metrics.steps'),
+    'calories': ('calories', 'metrics.calories'),
+    'distance': ('distance', 'metrics.distance'),
+    'isAnomaly': ('isAnomaly', 'anomalyDetected'),
+    'anomalyScore': ('anomalyScore', 'cloudAnomalyScore', 'edgeAnomalyScore'),
+    'activityState': ('activityState',),
+    'anomalyReasons': ('anomalyReasons',),
+    'anomalySource': ('anomalySource',),
+}
 
 def normalize_timestamp(ts):
     """Convert timestamp to seconds. DynamoDB stores both seconds and milliseconds."""
@@ -26,8 +115,9 @@ def normalize_timestamp(ts):
 # CORS headers
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Headers': 'Content-Type,X-API-Key',
-    'Access-Control-Allow-Methods': 'GET,OPTIONS'
+    'Access-Control-Allow-Headers': 'Content-Type,X-API-Key,If-None-Match',
+    'Access-Control-Allow-Methods': 'GET,OPTIONS',
+    'Access-Control-Expose-Headers': 'ETag'
 }
 
 
@@ -54,85 +144,222 @@ def lambda_handler(event, context):
         # Get path and query parameters
         path = event.get('path', '')
         query_params = event.get('queryStringParameters') or {}
-        
-        # Route to appropriate handler
-        if path.endswith('/health'):
-            return success_response({'status': 'ok'})
-        if path.endswith('/health-data/sync'):
-            return handle_get_history(normalize_sync_params(query_params))
-        if path.endswith('/health-data/history'):
-            return handle_get_history(query_params)
-        if path.endswith('/health/metrics'):
-            return handle_get_metrics(query_params)
-        return error_response(404, 'Not found')
+
+        columnar = accepts_columnar(headers)
+
+        # Conditional GET: an unchanged dataVersion means an unchanged response
+        etag = None
+        if path.endswith(CONDITIONAL_GET_PATHS) and query_params.get('userId'):
+            etag = data_etag(path, query_params, columnar)
+            if etag and etag in parse_if_none_match(headers):
+                return not_modified_response(etag)
+
+        response = route_request(path, query_params, columnar)
+        if etag and response['statusCode'] == 200:
+            response['headers'] = dict(response['headers'], **{'ETag': etag, 'Cache-Control': 'private, no-cache'})
+        return response
 
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}", exc_info=True)
         return error_response(500, f'Internal server error: {str(e)}')
 
 
-def handle_get_metrics(query_params):
+def route_request(path, query_params, columnar=False):
+    """
+    Route to appropriate handler
+    """
+    if path.endswith('/health'):
+        return success_response({'status': 'ok'})
+    if path.endswith('/health-data/sync'):
+        return handle_get_history(normalize_sync_params(query_params), columnar)
+    if path.endswith('/health-data/history'):
+        return handle_get_history(query_params, columnar)
+    if path.endswith('/health-data/changes'):
+        return handle_get_changes(query_params, columnar)
+    if path.endswith('/health-data/aggregate'):
+        return handle_get_aggregate(query_params)
+    if path.endswith('/health-data/summary'):
+        return handle_get_summary(query_params)
+    if path.endswith('/health/current'):
+        return handle_get_current(query_params)
+    if path.endswith('/health/metrics/bulk'):
+        return handle_get_bulk_metrics(query_params, columnar)
+    if path.endswith('/health/metrics'):
+        return handle_get_metrics(query_params, columnar)
+    return error_response(404, 'Not found')
+
+
+def handle_get_metrics(query_params, columnar=False):
     """
-    Get metrics for a specific user
-    Query params: userId (required), limit (optional, default 100)
+    Get metrics for a specific user, most recent first
+    Query params: userId (required), pageSize (optional, default 100, max 1000;
+    'limit' is accepted as an alias), cursor (optional, nextCursor of the previous page),
+    fields (optional, comma-separated subset of METRIC_FIELDS; id and timestamp
+    are always returned)
     """
     user_id = query_params.get('userId') if query_params else None
     if not user_id:
         return error_response(400, 'Missing required parameter: userId')
 
     try:
-        limit = int(query_params.get('limit', 100)) if query_params else 100
-        limit = min(limit, 1000)  # Cap at 1000
+        page_size = parse_page_size(query_params)
     except ValueError:
-        return error_response(400, 'Invalid limit parameter')
+        return error_response(400, 'Invalid pageSize parameter')
+
+    try:
+        fields = parse_fields(query_params)
+    except ValueError as e:
+        return error_response(400, str(e))
 
     try:
         # Query metrics for user
-        response = table.query(
-            KeyConditionExpression='userId = :userId',
-            ExpressionAttributeValues={
-                ':userId': user_id
-            },
-            Limit=limit,
-            ScanIndexForward=False  # Sort by timestamp descending (most recent first)
+        query_kwargs = {
+            'KeyConditionExpression': 'userId = :userId',
+            'ExpressionAttributeValues': {':userId': user_id},
+            'ScanIndexForward': False  # Sort by timestamp descending (most recent first)
+        }
+        items, next_cursor = query_page(
+            project_fields(query_kwargs, fields),
+            page_size,
+            scope=('metrics', user_id),
+            cursor=query_params.get('cursor')
         )
-
-        items = response.get('Items', [])
-        metrics = []
-
-        for item in items:
-            # Handle both nested and flat metric structures
-            metrics_data = item.get('metrics', {}) if isinstance(item.get('metrics'), dict) else {}
-            
-            ts_seconds = normalize_timestamp(item['timestamp'])
-            metric = {
-                'id': f"{item['userId']}:{int(item['timestamp'])}",
-                'timestamp': datetime.fromtimestamp(ts_seconds).isoformat(),
-                'heartRate': float(item.get('heartRate', metrics_data.get('heartRate', 0))),
-                'steps': int(item.get('steps', metrics_data.get('steps', 0))),
-                'calories': float(item.get('calories', metrics_data.get('calories', 0))),
-                'distance': float(item.get('distance', metrics_data.get('distance', 0))),
-                'isAnomaly': item.get('isAnomaly', item.get('anomalyDetected', False)),
-                'anomalyScore': float(item.get('anomalyScore', item.get('cloudAnomalyScore', item.get('edgeAnomalyScore', 0)))),
-                'activityState': item.get('activityState', None),
-                'anomalyReasons': item.get('anomalyReasons', []),
-                'anomalySource': item.get('anomalySource', None),
-            }
-            metrics.append(metric)
+        metrics = encode_metrics(items, fields, columnar)
 
         logger.info(f"Retrieved {len(metrics)} metrics for user {user_id}")
         return success_response({
             'success': True,
             'metrics': metrics,
-            'count': len(metrics),
-            'userId': user_id
-        })
+            'count': len(items),
+            'userId': user_id,
+            'pageSize': page_size,
+            'nextCursor': next_cursor
+        }, media_type=metrics_media_type(columnar))
 
+    except InvalidCursor as e:
+        return error_response(400, str(e))
     except Exception as e:
         logger.error(f"Error querying metrics: {str(e)}", exc_info=True)
         return error_response(500, f'Failed to retrieve metrics: {str(e)}')
 
 
+def handle_get_current(query_params):
+    """
+    Latest vitals from the user's current-state item (maintained by
+    lambda_function.update_user_state): one GetItem, no metrics Query.
+    Query params: userId (required)
+    """
+    user_id = query_params.get('userId') if query_params else None
+    if not user_id:
+        return error_response(400, 'Missing required parameter: userId')
+    if user_state_table is None:
+        return error_response(501, 'Current state is not available in this deployment')
+
+    try:
+        state = user_state_table.get_item(
+            Key={'userId': user_id},
+            ProjectionExpression='lastReading, lastAnomaly, activityState, activityStateSince'
+        ).get('Item', {})
+
+        latest = state.get('lastReading')
+        last_anomaly = state.get('lastAnomaly')
+        activity = None
+        if latest and state.get('activityState') is not None:
+            since = normalize_timestamp(state['activityStateSince'])
+            activity = {
+                'state': state['activityState'],
+                'since': datetime.fromtimestamp(since).isoformat(),
+                'durationSeconds': normalize_timestamp(latest['timestamp']) - since,
+            }
+
+        return success_response({
+            'success': True,
+            'userId': user_id,
+            'latest': item_to_metric(dict(latest, userId=user_id)) if latest else None,
+            'lastAnomaly': item_to_metric(dict(last_anomaly, userId=user_id)) if last_anomaly else None,
+            'activity': activity
+        })
+
+    except Exception as e:
+        logger.error(f"Error reading current state: {str(e)}", exc_info=True)
+        return error_response(500, f'Failed to retrieve current state: {str(e)}')
+
+
+def handle_get_bulk_metrics(query_params, columnar=False):
+    """
+    Metrics for several users in one call (caregiver dashboards), most
+    recent first per user. Each user's partition is queried concurrently;
+    a user whose query fails gets an error entry instead of failing the call.
+    Query params: userIds (required, comma-separated, at most 100),
+    startDate/endDate (optional, ISO), pageSize (optional, per user, default
+    100; capped so the response holds at most 10000 readings; pageSize=1
+    gives each user's latest reading), fields (optional, as for history)
+    Each user's nextCursor continues on /health-data/history with the same
+    userId and dates.
+    """
+    user_ids = list(dict.fromkeys(
+        user_id.strip() for user_id in (query_params.get('userIds') or '').split(',') if user_id.strip()
+    ))
+    if not user_ids:
+        return error_response(400, 'Missing required parameter: userIds')
+    if len(user_ids) > MAX_BULK_USERS:
+        return error_response(400, f'At most {MAX_BULK_USERS} userIds per request')
+
+    try:
+        page_size = min(parse_page_size(query_params), max(1, MAX_BULK_READINGS // len(user_ids)))
+    except ValueError:
+        return error_response(400, 'Invalid pageSize parameter')
+
+    try:
+        fields = parse_fields(query_params)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    try:
+        start_timestamp, end_timestamp = parse_date_range(query_params)
+    except ValueError as e:
+        return error_response(400, f'Invalid date format: {str(e)}. Use ISO format (e.g., 2024-01-15T00:00:00Z)')
+
+    def read_user(user_id):
+        try:
+            query_kwargs = range_query(user_id, start_timestamp, end_timestamp)
+            query_kwargs['ScanIndexForward'] = False  # Sort by timestamp descending
+            items, next_cursor = query_page(
+                project_fields(query_kwargs, fields),
+                page_size,
+                scope=('history', user_id, start_timestamp, end_timestamp)
+            )
+            return {
+                'userId': user_id,
+                'metrics': encode_metrics(items, fields, columnar),
+                'count': len(items),
+                'nextCursor': next_cursor
+            }
+        except Exception as e:
+            logger.error(f"Error querying metrics for user {user_id}: {str(e)}", exc_info=True)
+            return {'userId': user_id, 'error': f'Failed to retrieve metrics: {str(e)}'}
+
+    workers = min(BULK_READ_CONCURRENCY, len(user_ids))
+    if workers <= 1:
+        users = [read_user(user_id) for user_id in user_ids]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            users = list(pool.map(read_user, user_ids))
+
+    errors = sum(1 for user in users if 'error' in user)
+    logger.info(f"Bulk read of {len(user_ids)} users: "
+                f"{sum(user.get('count', 0) for user in users)} metrics, {errors} failed")
+    return success_response({
+        'success': True,
+        'users': users,
+        'userCount': len(users),
+        'errorCount': errors,
+        'startDate': query_params.get('startDate'),
+        'endDate': query_params.get('endDate'),
+        'pageSize': page_size
+    }, media_type=metrics_media_type(columnar))
+
+
 def normalize_sync_params(query_params):
     if not query_params:
         return {}
@@ -143,10 +370,13 @@ def normalize_sync_params(query_params):
     return normalized
 
 
-def handle_get_history(query_params):
+def handle_get_history(query_params, columnar=False):
     """
     Get metrics history for a user within a date range
-    Query params: userId (required), startDate (optional), endDate (optional), limit (optional, default 100)
+    Query params: userId (required), startDate (optional), endDate (optional),
+    pageSize (optional, default 100, max 1000; 'limit' is accepted as an alias),
+    cursor (optional, nextCursor of the previous page), fields (optional,
+    comma-separated subset of METRIC_FIELDS; id and timestamp are always returned)
     Dates should be ISO format (e.g., 2024-01-15T00:00:00Z)
     """
     user_id = query_params.get('userId') if query_params else None
@@ -154,91 +384,746 @@ def handle_get_history(query_params):
         return error_response(400, 'Missing required parameter: userId')
 
     try:
-        limit = int(query_params.get('limit', 100)) if query_params else 100
-        limit = min(limit, 1000)  # Cap at 1000
+        page_size = parse_page_size(query_params)
     except ValueError:
-        return error_response(400, 'Invalid limit parameter')
-
-    # Parse date range
-    start_timestamp = None
-    end_timestamp = None
+        return error_response(400, 'Invalid pageSize parameter')
 
     try:
-        if query_params and query_params.get('startDate'):
-            start_date = datetime.fromisoformat(query_params.get('startDate').replace('Z', '+00:00'))
-            start_timestamp = int(start_date.timestamp() * 1000)
+        fields = parse_fields(query_params)
+    except ValueError as e:
+        return error_response(400, str(e))
 
-        if query_params and query_params.get('endDate'):
-            end_date = datetime.fromisoformat(query_params.get('endDate').replace('Z', '+00:00'))
-            end_timestamp = int(end_date.timestamp() * 1000)
+    try:
+        start_timestamp, end_timestamp = parse_date_range(query_params)
     except ValueError as e:
         return error_response(400, f'Invalid date format: {str(e)}. Use ISO format (e.g., 2024-01-15T00:00:00Z)')
 
     try:
-        # Build query
-        key_condition = 'userId = :userId'
-        expression_values = {':userId': user_id}
-
-        if start_timestamp and end_timestamp:
-            key_condition += ' AND #ts BETWEEN :start AND :end'
-            expression_values[':start'] = start_timestamp
-            expression_values[':end'] = end_timestamp
-        elif start_timestamp:
-            key_condition += ' AND #ts >= :start'
-            expression_values[':start'] = start_timestamp
-        elif end_timestamp:
-            key_condition += ' AND #ts <= :end'
-            expression_values[':end'] = end_timestamp
-
-        query_kwargs = {
-            'KeyConditionExpression': key_condition,
-            'ExpressionAttributeValues': expression_values,
-            'Limit': limit,
-            'ScanIndexForward': False  # Sort by timestamp descending
-        }
-        if start_timestamp or end_timestamp:
-            query_kwargs['ExpressionAttributeNames'] = {'#ts': 'timestamp'}
+        query_kwargs = range_query(user_id, start_timestamp, end_timestamp)
+        query_kwargs['ScanIndexForward'] = False  # Sort by timestamp descending
 
-        response = table.query(**query_kwargs)
-
-        items = response.get('Items', [])
-        metrics = []
-
-        for item in items:
-            # Handle both nested and flat metric structures
-            metrics_data = item.get('metrics', {}) if isinstance(item.get('metrics'), dict) else {}
-            
-            ts_seconds = normalize_timestamp(item['timestamp'])
-            metric = {
-                'id': f"{item['userId']}:{int(item['timestamp'])}",
-                'timestamp': datetime.fromtimestamp(ts_seconds).isoformat(),
-                'heartRate': float(item.get('heartRate', metrics_data.get('heartRate', 0))),
-                'steps': int(item.get('steps', metrics_data.get('steps', 0))),
-                'calories': float(item.get('calories', metrics_data.get('calories', 0))),
-                'distance': float(item.get('distance', metrics_data.get('distance', 0))),
-                'isAnomaly': item.get('isAnomaly', item.get('anomalyDetected', False)),
-                'anomalyScore': float(item.get('anomalyScore', item.get('cloudAnomalyScore', item.get('edgeAnomalyScore', 0)))),
-                'activityState': item.get('activityState', None),
-                'anomalyReasons': item.get('anomalyReasons', []),
-                'anomalySource': item.get('anomalySource', None),
-            }
-            metrics.append(metric)
+        items, next_cursor = query_page(
+            project_fields(query_kwargs, fields),
+            page_size,
+            scope=('history', user_id, start_timestamp, end_timestamp),
+            cursor=query_params.get('cursor')
+        )
+        metrics = encode_metrics(items, fields, columnar)
 
         logger.info(f"Retrieved {len(metrics)} history metrics for user {user_id}")
         return success_response({
             'success': True,
             'metrics': metrics,
-            'count': len(metrics),
+            'count': len(items),
             'userId': user_id,
             'startDate': query_params.get('startDate') if query_params else None,
-            'endDate': query_params.get('endDate') if query_params else None
-        })
+            'endDate': query_params.get('endDate') if query_params else None,
+            'pageSize': page_size,
+            'nextCursor': next_cursor
+        }, media_type=metrics_media_type(columnar))
 
+    except InvalidCursor as e:
+        return error_response(400, str(e))
     except Exception as e:
         logger.error(f"Error querying history: {str(e)}", exc_info=True)
         return error_response(500, f'Failed to retrieve history: {str(e)}')
 
 
+def handle_get_changes(query_params, columnar=False):
+    """
+    Delta sync: readings stored or rewritten since the client's last sync,
+    in the order the server wrote them, so late uploads of old readings and
+    async anomaly verdicts are not missed the way a timestamp window misses
+    them.
+    Query params: userId (required), syncToken (optional, from the previous
+    response), since (optional, ISO modifiedAt to start from when there is
+    no token; default the beginning), pageSize (optional, default 100, max
+    1000), fields (optional, as for history)
+    Always returns a syncToken to store and send next time; hasMore means
+    the next page can be fetched right away.
+    """
+    user_id = query_params.get('userId') if query_params else None
+    if not user_id:
+        return error_response(400, 'Missing required parameter: userId')
+
+    try:
+        page_size = parse_page_size(query_params)
+    except ValueError:
+        return error_response(400, 'Invalid pageSize parameter')
+
+    try:
+        fields = parse_fields(query_params)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    try:
+        if query_params.get('syncToken'):
+            position = decode_sync_token(query_params['syncToken'], user_id)
+        else:
+            since, _ = parse_date_range({'startDate': query_params.get('since')})
+            position = {'modifiedAt': since or 0}
+    except InvalidCursor as e:
+        return error_response(400, str(e))
+    except ValueError as e:
+        return error_response(400, f'Invalid date format: {str(e)}. Use ISO format (e.g., 2024-01-15T00:00:00Z)')
+
+    try:
+        settled = int(datetime.now().timestamp() * 1000) - SYNC_SETTLE_SECONDS * 1000
+        items, last_key = [], None
+        if position['modifiedAt'] <= settled:
+            query_kwargs = {
+                'IndexName': SYNC_INDEX_NAME,
+                'KeyConditionExpression': 'userId = :userId AND modifiedAt BETWEEN :from AND :settled',
+                'ExpressionAttributeValues': {':userId': user_id, ':from': position['modifiedAt'], ':settled': settled},
+                'ScanIndexForward': True,
+            }
+            if 'timestamp' in position:
+                query_kwargs['ExclusiveStartKey'] = dict(position, userId=user_id)
+            query_kwargs = project_fields(query_kwargs, fields)
+            if fields is not None:
+                query_kwargs['ProjectionExpression'] += ', modifiedAt'
+            items, last_key = read_page(query_kwargs, page_size)
+
+        if last_key:
+            position = {'modifiedAt': int(last_key['modifiedAt']), 'timestamp': int(last_key['timestamp'])}
+        elif items:
+            position = {'modifiedAt': int(items[-1]['modifiedAt']), 'timestamp': int(items[-1]['timestamp'])}
+
+        metrics = encode_metrics(items, fields, columnar)
+
+        logger.info(f"Delta sync returned {len(metrics)} metrics for user {user_id}")
+        return success_response({
+            'success': True,
+            'metrics': metrics,
+            'count': len(items),
+            'userId': user_id,
+            'pageSize': page_size,
+            'syncToken': encode_sync_token(position, user_id),
+            'hasMore': last_key is not None
+        }, media_type=metrics_media_type(columnar))
+
+    except Exception as e:
+        logger.error(f"Error reading changes: {str(e)}", exc_info=True)
+        return error_response(500, f'Failed to retrieve changes: {str(e)}')
+
+
+def handle_get_aggregate(query_params):
+    """
+    Per-bucket statistics for a user's readings, for charting long ranges
+    in one call.
+    Query params: userId (required), startDate (required), endDate (optional,
+    default now), bucket (1m, 5m, 15m, 1h or 1d; default 1h), downsample
+    (optional, also return an LTTB-downsampled heart rate series of at most
+    this many points)
+    """
+    user_id = query_params.get('userId') if query_params else None
+    if not user_id:
+        return error_response(400, 'Missing required parameter: userId')
+    if np is None:
+        return error_response(501, 'Aggregation is not available in this deployment')
+
+    bucket = query_params.get('bucket', '1h')
+    if bucket not in AGGREGATE_BUCKETS:
+        return error_response(400, f"Invalid bucket. Use one of: {', '.join(AGGREGATE_BUCKETS)}")
+    width = AGGREGATE_BUCKETS[bucket]
+
+    try:
+        start_timestamp, end_timestamp = parse_date_range(query_params)
+    except ValueError as e:
+        return error_response(400, f'Invalid date format: {str(e)}. Use ISO format (e.g., 2024-01-15T00:00:00Z)')
+    if start_timestamp is None:
+        return error_response(400, 'Missing required parameter: startDate')
+    if end_timestamp is None:
+        end_timestamp = int(datetime.now().timestamp() * 1000)
+    if (end_timestamp - start_timestamp) / 1000 / width > MAX_AGGREGATE_BUCKETS:
+        return error_response(400, f'Range spans more than {MAX_AGGREGATE_BUCKETS} buckets; use a larger bucket')
+
+    try:
+        downsample = int(query_params.get('downsample', 0))
+    except ValueError:
+        return error_response(400, 'Invalid downsample parameter')
+    downsample = min(max(downsample, 0), MAX_DOWNSAMPLE_POINTS)
+
+    try:
+        query_kwargs = range_query(user_id, start_timestamp, end_timestamp)
+        query_kwargs['ProjectionExpression'] = AGGREGATE_PROJECTION
+        query_kwargs['ExpressionAttributeNames'] = {'#ts': 'timestamp'}
+        columns = read_metric_columns(query_kwargs)
+
+        response = {
+            'success': True,
+            'userId': user_id,
+            'bucket': bucket,
+            'startDate': query_params.get('startDate'),
+            'endDate': query_params.get('endDate'),
+            'readings': int(len(columns['timestamp'])),
+            'buckets': aggregate_buckets(columns, width),
+        }
+        response['count'] = len(response['buckets'])
+        if downsample:
+            valid = columns['heartRate'] > 0
+            x, y = lttb(columns['timestamp'][valid], columns['heartRate'][valid], downsample)
+            response['series'] = [
+                {'timestamp': datetime.fromtimestamp(int(ts)).isoformat(), 'heartRate': round(float(hr), 2)}
+                for ts, hr in zip(x, y)
+            ]
+
+        logger.info(f"Aggregated {response['readings']} readings into {response['count']} "
+                    f"{bucket} buckets for user {user_id}")
+        return success_response(response)
+
+    except Exception as e:
+        logger.error(f"Error aggregating metrics: {str(e)}", exc_info=True)
+        return error_response(500, f'Failed to aggregate metrics: {str(e)}')
+
+
+def handle_get_summary(query_params):
+    """
+    Dashboard summary served from the precomputed rollups: one item per
+    bucket, so the cost follows the number of buckets, not readings.
+    Query params: userId (required), startDate (required), endDate (optional,
+    default now), granularity (1h or 1d, default 1d)
+    """
+    user_id = query_params.get('userId') if query_params else None
+    if not user_id:
+        return error_response(400, 'Missing required parameter: userId')
+    if rollup_table is None:
+        return error_response(501, 'Summaries are not available in this deployment')
+
+    granularity = query_params.get('granularity', '1d')
+    if granularity not in ROLLUP_GRANULARITIES:
+        return error_response(400, f"Invalid granularity. Use one of: {', '.join(ROLLUP_GRANULARITIES)}")
+    width = ROLLUP_GRANULARITIES[granularity]
+
+    try:
+        start_timestamp, end_timestamp = parse_date_range(query_params)
+    except ValueError as e:
+        return error_response(400, f'Invalid date format: {str(e)}. Use ISO format (e.g., 2024-01-15T00:00:00Z)')
+    if start_timestamp is None:
+        return error_response(400, 'Missing required parameter: startDate')
+    if end_timestamp is None:
+        end_timestamp = int(datetime.now().timestamp() * 1000)
+
+    try:
+        query_kwargs = {
+            'KeyConditionExpression': 'rollupKey = :key AND bucketStart BETWEEN :start AND :end',
+            'ExpressionAttributeValues': {
+                ':key': f'{user_id}#{granularity}',
+                # Include the bucket that contains startDate
+                ':start': start_timestamp // 1000 // width * width,
+                ':end': end_timestamp // 1000,
+            },
+        }
+        rollups = []
+        while True:
+            response = rollup_table.query(**query_kwargs)
+            rollups.extend(response.get('Items', []))
+            if not response.get('LastEvaluatedKey'):
+                break
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        buckets = [_summary_bucket(rollup) for rollup in rollups]
+        totals = _summary_bucket({
+            name: sum((rollup.get(name, 0) for rollup in rollups), Decimal(0))
+            for name in ('readingCount', 'heartRateCount', 'heartRateSum', 'heartRateSumSq',
+                         'stepsSum', 'caloriesSum', 'distanceSum', 'anomalyCount')
+        })
+        heart_rates = [rollup for rollup in rollups if 'heartRateMin' in rollup]
+        if totals['heartRate']:
+            totals['heartRate']['min'] = float(min(rollup['heartRateMin'] for rollup in heart_rates))
+            totals['heartRate']['max'] = float(max(rollup['heartRateMax'] for rollup in heart_rates))
+        del totals['start']
+
+        logger.info(f"Served {len(buckets)} {granularity} rollups for user {user_id}")
+        return success_response({
+            'success': True,
+            'userId': user_id,
+            'granularity': granularity,
+            'startDate': query_params.get('startDate'),
+            'endDate': query_params.get('endDate'),
+            'count': len(buckets),
+            'buckets': buckets,
+            'totals': totals,
+        })
+
+    except Exception as e:
+        logger.error(f"Error reading rollups: {str(e)}", exc_info=True)
+        return error_response(500, f'Failed to read summary: {str(e)}')
+
+
+def _summary_bucket(rollup):
+    """Rollup counters -> count, heart rate min/max/mean/stddev and totals."""
+    hr_count = int(rollup.get('heartRateCount', 0))
+    heart_rate = None
+    if hr_count:
+        mean = float(rollup['heartRateSum']) / hr_count
+        variance = max(float(rollup['heartRateSumSq']) / hr_count - mean * mean, 0.0)
+        heart_rate = {
+            'min': float(rollup['heartRateMin']) if 'heartRateMin' in rollup else None,
+            'max': float(rollup['heartRateMax']) if 'heartRateMax' in rollup else None,
+            'mean': round(mean, 2),
+            'stddev': round(variance ** 0.5, 2),
+        }
+    return {
+        'start': datetime.fromtimestamp(int(rollup.get('bucketStart', 0))).isoformat(),
+        'count': int(rollup.get('readingCount', 0)),
+        'heartRate': heart_rate,
+        'steps': int(rollup.get('stepsSum', 0)),
+        'calories': round(float(rollup.get('caloriesSum', 0)), 2),
+        'distance': round(float(rollup.get('distanceSum', 0)), 4),
+        'anomalies': int(rollup.get('anomalyCount', 0)),
+    }
+
+
+def read_metric_columns(query_kwargs):
+    """
+    Stream every page of a Query into NumPy columns (timestamps in seconds,
+    ascending). Each page is converted as it arrives, so only the compact
+    columns are kept, not the boto3 items.
+    """
+    query_kwargs = dict(query_kwargs, ScanIndexForward=True)
+    chunks = []
+    while True:
+        response = table.query(**query_kwargs)
+        items = response.get('Items', [])
+        if items:
+            chunks.append(np.array([_metric_row(item) for item in items], dtype=np.float64))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+    rows = np.concatenate(chunks) if chunks else np.empty((0, 6))
+    names = ('timestamp', 'heartRate', 'steps', 'calories', 'distance', 'anomaly')
+    return {name: rows[:, i] for i, name in enumerate(names)}
+
+
+def _metric_row(item):
+    metrics_data = item.get('metrics', {}) if isinstance(item.get('metrics'), dict) else {}
+    return (
+        normalize_timestamp(item['timestamp']),
+        float(item.get('heartRate', metrics_data.get('heartRate', 0)) or 0),
+        float(item.get('steps', metrics_data.get('steps', 0)) or 0),
+        float(item.get('calories', metrics_data.get('calories', 0)) or 0),
+        float(item.get('distance', metrics_data.get('distance', 0)) or 0),
+        1.0 if item.get('isAnomaly', item.get('anomalyDetected', False)) else 0.0,
+    )
+
+
+def aggregate_buckets(columns, width):
+    """
+    Vectorised per-bucket statistics: reading count, heart rate
+    min/max/mean/p95 (readings without a heart rate are left out), summed
+    steps/calories/distance and anomaly count. Empty buckets are omitted.
+    """
+    timestamps = columns['timestamp']
+    if not len(timestamps):
+        return []
+
+    bucket_ids = (timestamps // width).astype(np.int64)
+    buckets, starts, counts = np.unique(bucket_ids, return_index=True, return_counts=True)
+    sums = {name: np.add.reduceat(columns[name], starts) for name in ('steps', 'calories', 'distance', 'anomaly')}
+
+    # Heart rate statistics over the readings that have one, sorted by
+    # (bucket, value) so each bucket's percentile is an index lookup
+    valid = columns['heartRate'] > 0
+    hr_buckets = bucket_ids[valid]
+    order = np.lexsort((columns['heartRate'][valid], hr_buckets))
+    hr_buckets, hr = hr_buckets[order], columns['heartRate'][valid][order]
+    hr_ids, hr_starts, hr_counts = np.unique(hr_buckets, return_index=True, return_counts=True)
+    hr_stats = {}
+    if len(hr):
+        position = hr_starts + 0.95 * (hr_counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        hr_stats = {
+            'min': hr[hr_starts],
+            'max': hr[hr_starts + hr_counts - 1],
+            'mean': np.add.reduceat(hr, hr_starts) / hr_counts,
+            'p95': hr[lower] + (hr[upper] - hr[lower]) * (position - lower),
+        }
+    hr_index = {int(bucket): i for i, bucket in enumerate(hr_ids)}
+
+    result = []
+    for i, bucket in enumerate(buckets):
+        j = hr_index.get(int(bucket))
+        result.append({
+            'start': datetime.fromtimestamp(int(bucket) * width).isoformat(),
+            'count': int(counts[i]),
+            'heartRate': None if j is None else {
+                name: round(float(values[j]), 2) for name, values in hr_stats.items()
+            },
+            'steps': int(sums['steps'][i]),
+            'calories': round(float(sums['calories'][i]), 2),
+            'distance': round(float(sums['distance'][i]), 4),
+            'anomalies': int(sums['anomaly'][i]),
+        })
+    return result
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a sorted series to at
+    most threshold points, keeping the first and last point and the
+    visually significant peaks in between.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = [0]
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        a = selected[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        selected.append(lo + int(np.argmax(area)))
+    selected.append(n - 1)
+    return x[selected], y[selected]
+
+
+def parse_date_range(query_params):
+    """startDate/endDate (ISO 8601) as epoch milliseconds, None when absent."""
+    timestamps = []
+    for name in ('startDate', 'endDate'):
+        value = query_params.get(name) if query_params else None
+        if value:
+            timestamps.append(int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000))
+        else:
+            timestamps.append(None)
+    return tuple(timestamps)
+
+
+def range_query(user_id, start_timestamp=None, end_timestamp=None):
+    """Query kwargs for a user's readings, optionally within a timestamp range."""
+    key_condition = 'userId = :userId'
+    expression_values = {':userId': user_id}
+
+    if start_timestamp and end_timestamp:
+        key_condition += ' AND #ts BETWEEN :start AND :end'
+        expression_values[':start'] = start_timestamp
+        expression_values[':end'] = end_timestamp
+    elif start_timestamp:
+        key_condition += ' AND #ts >= :start'
+        expression_values[':start'] = start_timestamp
+    elif end_timestamp:
+        key_condition += ' AND #ts <= :end'
+        expression_values[':end'] = end_timestamp
+
+    query_kwargs = {
+        'KeyConditionExpression': key_condition,
+        'ExpressionAttributeValues': expression_values,
+    }
+    if start_timestamp or end_timestamp:
+        query_kwargs['ExpressionAttributeNames'] = {'#ts': 'timestamp'}
+    return query_kwargs
+
+
+def parse_fields(query_params):
+    """
+    The METRIC_FIELDS named by ?fields=, in response order; None (every
+    field, no projection) when the parameter is absent.
+    """
+    value = query_params.get('fields')
+    if not value:
+        return None
+    requested = {name.strip() for name in value.split(',')} - {'id', 'timestamp', ''}
+    unknown = requested - METRIC_FIELDS.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. "
+                         f"Use any of: {', '.join(METRIC_FIELDS)}")
+    return tuple(name for name in METRIC_FIELDS if name in requested)
+
+
+def project_fields(query_kwargs, fields):
+    """
+    Add a ProjectionExpression that returns only the key and the attributes
+    behind fields, so unrequested attributes (anomalyReasons lists in
+    particular) are neither transferred nor deserialized. DynamoDB still
+    charges read capacity on the full item size.
+    """
+    if fields is None:
+        return query_kwargs
+
+    names = dict(query_kwargs.get('ExpressionAttributeNames', {}), **{'#ts': 'timestamp'})
+    paths = ['userId', '#ts']
+    for field in fields:
+        for attribute in METRIC_FIELDS[field]:
+            parts = attribute.split('.')
+            names.update((f'#{part}', part) for part in parts)
+            paths.append('.'.join(f'#{part}' for part in parts))
+    return dict(query_kwargs, ProjectionExpression=', '.join(paths), ExpressionAttributeNames=names)
+
+
+def encode_metrics(items, fields=None, columnar=False):
+    """Stored items -> the metrics of a response, as rows or columns."""
+    if columnar:
+        return metric_columns(items, fields)
+    to_metric = metric_mapper(fields)
+    return [to_metric(item) for item in items]
+
+
+def metric_columns(items, fields=None):
+    """
+    Columnar layout of items: one array per field plus epoch-millisecond
+    timestamps as timestampBase and per-point deltas from the previous
+    point (timestamp[i] = timestampBase + sum(timestampDeltas[:i + 1])).
+    Regularly sampled series turn into runs of equal small integers.
+    """
+    timestamps = []
+    for item in items:
+        timestamp = int(item['timestamp'])
+        timestamps.append(timestamp if timestamp > 1000000000000 else timestamp * 1000)
+    rows = [item_to_metric(item) for item in items]
+
+    columns = {
+        'timestampBase': timestamps[0] if timestamps else None,
+        'timestampDeltas': [current - previous for previous, current in zip(timestamps[:1] + timestamps, timestamps)],
+    }
+    for name in (fields if fields is not None else METRIC_FIELDS):
+        columns[name] = [row[name] for row in rows]
+    return columns
+
+
+def metric_mapper(fields=None):
+    """
+    Return the item -> API metric function for a request: item_to_metric
+    itself, or a wrapper keeping id, timestamp and the requested fields.
+    """
+    if fields is None:
+        return item_to_metric
+    keep = ('id', 'timestamp') + tuple(fields)
+
+    def to_metric(item):
+        metric = item_to_metric(item)
+        return {name: metric[name] for name in keep}
+
+    return to_metric
+
+
+def item_to_metric(item):
+    """
+    Stored item -> API metric, for both flat and nested ('metrics' map)
+    layouts. Fallback attributes are only read when the preferred one is
+    missing, so projected items map just as well as full ones.
+    """
+    get = item.get
+    nested = get('metrics')
+    if not isinstance(nested, dict):
+        nested = {}
+    timestamp = int(item['timestamp'])
+
+    heart_rate = get('heartRate')
+    if heart_rate is None:
+        heart_rate = nested.get('heartRate', 0)
+    steps = get('steps')
+    if steps is None:
+        steps = nested.get('steps', 0)
+    calories = get('calories')
+    if calories is None:
+        calories = nested.get('calories', 0)
+    distance = get('distance')
+    if distance is None:
+        distance = nested.get('distance', 0)
+    is_anomaly = get('isAnomaly')
+    if is_anomaly is None:
+        is_anomaly = get('anomalyDetected', False)
+    score = get('anomalyScore')
+    if score is None:
+        score = get('cloudAnomalyScore')
+        if score is None:
+            score = get('edgeAnomalyScore', 0)
+
+    return {
+        'id': f"{item['userId']}:{timestamp}",
+        'timestamp': datetime.fromtimestamp(normalize_timestamp(timestamp)).isoformat(),
+        'heartRate': float(heart_rate),
+        'steps': int(steps),
+        'calories': float(calories),
+        'distance': float(distance),
+        'isAnomaly': is_anomaly,
+        'anomalyScore': float(score),
+        'activityState': get('activityState'),
+        'anomalyReasons': get('anomalyReasons', []),
+        'anomalySource': get('anomalySource'),
+    }
+
+
+class InvalidCursor(ValueError):
+    """A cursor that was tampered with or belongs to a different query."""
+
+
+def parse_page_size(query_params):
+    """pageSize (or limit) from the query string, capped at MAX_PAGE_SIZE."""
+    value = query_params.get('pageSize', query_params.get('limit', DEFAULT_PAGE_SIZE))
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+def query_page(query_kwargs, page_size, scope, cursor=None):
+    """
+    Read one page of up to page_size items, starting after cursor.
+    Follows LastEvaluatedKey until the page is full, so DynamoDB's 1 MB
+    response limit shortens a call but not a page. Every page starts with
+    ExclusiveStartKey, so its cost does not depend on how deep it is.
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    query_kwargs = dict(query_kwargs)
+    if cursor:
+        query_kwargs['ExclusiveStartKey'] = decode_cursor(cursor, scope)
+
+    items, last_key = read_page(query_kwargs, page_size)
+    return items, encode_cursor(last_key, scope) if last_key else None
+
+
+def read_page(query_kwargs, page_size):
+    """
+    Query until page_size items are read or the results end.
+    Returns (items, LastEvaluatedKey or None).
+    """
+    query_kwargs = dict(query_kwargs)
+    items = []
+    while True:
+        response = table.query(Limit=page_size - len(items), **query_kwargs)
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key or len(items) >= page_size:
+            return items, last_key
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+
+def encode_cursor(last_key, scope):
+    """Sign a LastEvaluatedKey together with the query it continues."""
+    payload = json.dumps(
+        {'u': last_key['userId'], 't': int(last_key['timestamp']), 's': _scope_digest(scope)},
+        separators=(',', ':')
+    ).encode('utf-8')
+    return f"{_b64encode(payload)}.{_b64encode(_cursor_signature(payload))}"
+
+
+def decode_cursor(cursor, scope):
+    """Verify a cursor from encode_cursor and return its ExclusiveStartKey."""
+    try:
+        payload_part, signature_part = cursor.split('.')
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, binascii.Error):
+        raise InvalidCursor('Invalid cursor')
+
+    if not hmac.compare_digest(signature, _cursor_signature(payload)):
+        raise InvalidCursor('Invalid cursor')
+    data = json.loads(payload)
+    if data['s'] != _scope_digest(scope):
+        raise InvalidCursor('Cursor does not belong to this query')
+    return {'userId': data['u'], 'timestamp': data['t']}
+
+
+def encode_sync_token(position, user_id):
+    """
+    Sign a delta-sync position: the modifiedAt (and timestamp, once a
+    reading was returned) of the last write the client has.
+    """
+    payload = json.dumps(
+        {'m': position['modifiedAt'], 't': position.get('timestamp'), 's': _scope_digest(('changes', user_id))},
+        separators=(',', ':')
+    ).encode('utf-8')
+    return f"{_b64encode(payload)}.{_b64encode(_cursor_signature(payload))}"
+
+
+def decode_sync_token(token, user_id):
+    """Verify a token from encode_sync_token and return its position."""
+    try:
+        payload_part, signature_part = token.split('.')
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, binascii.Error):
+        raise InvalidCursor('Invalid syncToken')
+
+    if not hmac.compare_digest(signature, _cursor_signature(payload)):
+        raise InvalidCursor('Invalid syncToken')
+    data = json.loads(payload)
+    if data['s'] != _scope_digest(('changes', user_id)):
+        raise InvalidCursor('syncToken does not belong to this user')
+    position = {'modifiedAt': data['m']}
+    if data['t'] is not None:
+        position['timestamp'] = data['t']
+    return position
+
+
+def _cursor_signature(payload):
+    if cursor_signing_key is None:
+        raise RuntimeError('Server misconfigured: no cursor signing key')
+    return hmac.new(cursor_signing_key, payload, hashlib.sha256).digest()[:16]
+
+
+def _scope_digest(scope):
+    return hashlib.sha256(json.dumps(scope).encode('utf-8')).hexdigest()[:16]
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def data_etag(path, query_params, columnar=False):
+    """
+    ETag for a data read: the user's dataVersion together with the route,
+    its parameters, the negotiated layout and the deployed code version.
+    None (no conditional GET) when user state is unavailable.
+    """
+    if user_state_table is None:
+        return None
+    try:
+        response = user_state_table.get_item(
+            Key={'userId': query_params['userId']},
+            ProjectionExpression='dataVersion',
+            ConsistentRead=True
+        )
+    except Exception as e:
+        logger.warning(f"Could not read data version: {str(e)}")
+        return None
+
+    version = int(response.get('Item', {}).get('dataVersion', 0))
+    request = json.dumps(
+        [version, path, sorted(query_params.items()), columnar, os.environ.get('AWS_LAMBDA_FUNCTION_VERSION', '')],
+        separators=(',', ':')
+    )
+    return '"' + hashlib.sha256(request.encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def accepts_columnar(headers):
+    """True when the Accept header asks for COLUMNAR_MEDIA_TYPE."""
+    value = next((v for k, v in (headers or {}).items() if k.lower() == 'accept'), None) or ''
+    return COLUMNAR_MEDIA_TYPE in value.lower()
+
+
+def metrics_media_type(columnar):
+    return COLUMNAR_MEDIA_TYPE if columnar else 'application/json'
+
+
+def parse_if_none_match(headers):
+    """Entity tags listed in If-None-Match (header names are case-insensitive)."""
+    value = next((v for k, v in (headers or {}).items() if k.lower() == 'if-none-match'), None) or ''
+    # Weak comparison: W/"x" matches "x"
+    return {tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip() for tag in value.split(',')}
+
+
+def not_modified_response(etag):
+    """
+    Return 304 Not Modified with CORS headers and no body
+    """
+    return {
+        'statusCode': 304,
+        'headers': dict(CORS_HEADERS, **{'ETag': etag, 'Cache-Control': 'private, no-cache'}),
+        'body': ''
+    }
+
+
 def validate_api_key(api_key):
     """
     Validate API key
@@ -251,14 +1136,18 @@ def validate_api_key(api_key):
     return len(api_key) > 0
 
 
-def success_response(data):
+def success_response(data, media_type=None):
     """
-    Return success response with CORS headers
+    Return success response with CORS headers; media_type marks a
+    negotiated representation (Content-Type, Vary: Accept)
     """
+    headers = CORS_HEADERS
+    if media_type:
+        headers = dict(CORS_HEADERS, **{'Content-Type': media_type, 'Vary': 'Accept'})
     return {
         'statusCode': 200,
-        'headers': CORS_HEADERS,
-        'body': json.dumps(data)
+        'headers': headers,
+        'body': json.dumps(data, separators=(',', ':'))
     }
 
 
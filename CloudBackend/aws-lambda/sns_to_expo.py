@@ -1,17 +1,53 @@
+import http.client
 import json
 import logging
 import os
-import urllib.request
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from boto3.dynamodb.conditions import Key
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-EXPO_PUSH_URL = "https://exp.host/--/api/v2/push/send"
+EXPO_PUSH_URL = os.environ.get("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
 PUSH_TOKEN_TABLE = os.environ.get("PUSH_TOKEN_TABLE", "HealthPushTokens")
 EXPO_ACCESS_TOKEN = os.environ.get("EXPO_ACCESS_TOKEN", "").strip()
 
+# Expo accepts at most 100 messages per push request. Chunks are sent up to
+# EXPO_CONCURRENCY at a time over kept-alive connections that outlive the
+# invocation; 429 and 5xx responses, and failures before the request was
+# sent, are retried with jittered backoff. A request that was sent but
+# whose response was lost (e.g. a read timeout) is not retried, since
+# Expo may already have delivered it.
+EXPO_CHUNK_SIZE = 100
+EXPO_CONCURRENCY = int(os.environ.get("EXPO_CONCURRENCY", "4"))
+EXPO_MAX_RETRIES = int(os.environ.get("EXPO_MAX_RETRIES", "3"))
+EXPO_RETRY_BASE_DELAY = 0.25
+EXPO_RETRY_MAX_DELAY = 5.0
+EXPO_TIMEOUT = 10
+_expo_pool = None
+
+# User -> push tokens lookups are cached per container for
+# PUSH_TOKEN_CACHE_TTL seconds (users without tokens for
+# PUSH_TOKEN_NEGATIVE_TTL, so a first registration is picked up quickly).
+# Misses are read with BatchGetItem from the per-user summary item that
+# lambda_function.handle_push_token_registration maintains; its tokenVersion
+# changes whenever a token is registered. The cache is best-effort: entries
+# are trusted until they expire, so a rotated or revoked token can keep
+# receiving pushes for up to PUSH_TOKEN_CACHE_TTL seconds.
+PUSH_TOKEN_CACHE_TTL = float(os.environ.get("PUSH_TOKEN_CACHE_TTL", "60"))
+PUSH_TOKEN_NEGATIVE_TTL = float(os.environ.get("PUSH_TOKEN_NEGATIVE_TTL", "30"))
+PUSH_TOKEN_SUMMARY_DEVICE = "#tokens"
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = 3
+BATCH_GET_RETRY_BASE_DELAY = 0.05
+BATCH_GET_RETRY_MAX_DELAY = 1.0
+_push_token_cache = None
+
 
 dynamodb = boto3.resource("dynamodb")
 push_table = dynamodb.Table(PUSH_TOKEN_TABLE)
@@ -20,6 +56,7 @@ push_table = dynamodb.Table(PUSH_TOKEN_TABLE)
 def lambda_handler(event, context):
     try:
         records = event.get("Records", [])
+        payloads = []
         for record in records:
             sns_message = record.get("Sns", {}).get("Message", "")
             payload = parse_message(sns_message)
@@ -30,14 +67,25 @@ def lambda_handler(event, context):
             if not user_id:
                 logger.warning("SNS message missing userId; skipping")
                 continue
+            payloads.append(payload)
 
-            tokens = get_push_tokens(user_id)
+        # One token lookup for every user in the batch
+        tokens_by_user = get_push_tokens_batch([payload["userId"] for payload in payloads])
+
+        messages = []
+        for payload in payloads:
+            tokens = tokens_by_user.get(payload["userId"])
             if not tokens:
-                logger.info(f"No push tokens for user {user_id}")
+                logger.info(f"No push tokens for user {payload['userId']}")
                 continue
 
-            send_expo_push(tokens, payload)
+            messages.extend(build_push_messages(tokens, payload))
+
+        # Every record's messages share the same chunks and connections
+        if messages:
+            send_push_messages(messages)
 
+        get_push_token_cache().emit_metrics()
         return {"statusCode": 200, "body": "ok"}
     except Exception as e:
         logger.error(f"SNS to Expo handler failed: {str(e)}", exc_info=True)
@@ -53,17 +101,163 @@ def parse_message(message):
 
 def get_push_tokens(user_id):
     try:
-        response = push_table.query(
-            KeyConditionExpression=Key("userId").eq(user_id)
-        )
-        items = response.get("Items", [])
-        return [item.get("expoPushToken") for item in items if item.get("expoPushToken")]
+        return query_push_tokens(user_id)
     except Exception as e:
         logger.error(f"Failed to query push tokens: {str(e)}")
         return []
 
 
+def query_push_tokens(user_id):
+    response = push_table.query(
+        KeyConditionExpression=Key("userId").eq(user_id)
+    )
+    items = response.get("Items", [])
+    return [item.get("expoPushToken") for item in items if item.get("expoPushToken")]
+
+
+def get_push_tokens_batch(user_ids):
+    """
+    Tokens for every user in user_ids, as {user_id: [token, ...]}.
+    Cached users cost nothing; the rest are fetched together with
+    BatchGetItem. Users registered before the summary item existed fall
+    back to a Query.
+    """
+    cache = get_push_token_cache()
+    tokens, missing = cache.lookup(user_ids)
+    if not missing:
+        return tokens
+
+    try:
+        summaries = fetch_token_summaries(missing)
+    except Exception as e:
+        logger.error(f"BatchGetItem for push tokens failed, querying per user: {str(e)}")
+        summaries = {}
+
+    for user_id in missing:
+        if user_id in summaries:
+            user_tokens, version = summaries[user_id]
+        else:
+            try:
+                user_tokens, version = query_push_tokens(user_id), None
+            except Exception as e:
+                # Not cached, so the next record for this user tries again
+                logger.error(f"Failed to query push tokens: {str(e)}")
+                tokens[user_id] = []
+                continue
+        cache.store(user_id, user_tokens, version)
+        tokens[user_id] = user_tokens
+    return tokens
+
+
+def fetch_token_summaries(user_ids):
+    """
+    BatchGetItem the '#tokens' summary items, BATCH_GET_MAX_KEYS keys per
+    call, retrying UnprocessedKeys. Returns {user_id: (tokens, tokenVersion)}
+    for users that have a summary.
+    """
+    summaries = {}
+    for start in range(0, len(user_ids), BATCH_GET_MAX_KEYS):
+        request = {
+            PUSH_TOKEN_TABLE: {
+                "Keys": [
+                    {"userId": user_id, "deviceId": PUSH_TOKEN_SUMMARY_DEVICE}
+                    for user_id in user_ids[start:start + BATCH_GET_MAX_KEYS]
+                ],
+                "ProjectionExpression": "userId, expoPushTokens, tokenVersion",
+            }
+        }
+        for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(_backoff(attempt, BATCH_GET_RETRY_BASE_DELAY, BATCH_GET_RETRY_MAX_DELAY))
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(PUSH_TOKEN_TABLE, []):
+                summaries[item["userId"]] = (list(item.get("expoPushTokens") or []), item.get("tokenVersion"))
+            request = response.get("UnprocessedKeys") or {}
+            if not request:
+                break
+        if request:
+            raise RuntimeError(f"{len(request[PUSH_TOKEN_TABLE]['Keys'])} push token keys unprocessed after retries")
+    return summaries
+
+
+def get_push_token_cache():
+    global _push_token_cache
+    if _push_token_cache is None:
+        _push_token_cache = PushTokenCache(PUSH_TOKEN_CACHE_TTL, PUSH_TOKEN_NEGATIVE_TTL)
+    return _push_token_cache
+
+
+class PushTokenCache:
+    """
+    Per-container user -> tokens cache. Entries expire after ttl_seconds
+    (negative_ttl_seconds for users without tokens); a refreshed entry
+    whose tokenVersion differs from the cached one counts as an
+    invalidation.
+    """
+
+    def __init__(self, ttl_seconds, negative_ttl_seconds, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.clock = clock
+        self.entries = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._window = dict.fromkeys(self.stats, 0)
+
+    def lookup(self, user_ids):
+        """Returns ({user_id: tokens} for fresh entries, [user_ids to fetch])."""
+        now = self.clock()
+        found, missing = {}, []
+        for user_id in dict.fromkeys(user_ids):
+            entry = self.entries.get(user_id)
+            if entry is not None and now < entry[2]:
+                found[user_id] = entry[0]
+            else:
+                missing.append(user_id)
+        self._count("hits", len(found))
+        self._count("misses", len(missing))
+        return found, missing
+
+    def store(self, user_id, tokens, version):
+        previous = self.entries.get(user_id)
+        if previous is not None and previous[1] != version:
+            self._count("invalidations", 1)
+        ttl = self.ttl_seconds if tokens else self.negative_ttl_seconds
+        self.entries[user_id] = (tokens, version, self.clock() + ttl)
+
+    def _count(self, name, value):
+        self.stats[name] += value
+        self._window[name] += value
+
+    def emit_metrics(self):
+        """Print lookups since the last call in CloudWatch Embedded Metric Format."""
+        window, self._window = self._window, dict.fromkeys(self.stats, 0)
+        lookups = window["hits"] + window["misses"]
+        if not lookups:
+            return
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": "HealthMonitor/Notifications",
+                    "Dimensions": [[]],
+                    "Metrics": [
+                        {"Name": "PushTokenCacheHits", "Unit": "Count"},
+                        {"Name": "PushTokenCacheMisses", "Unit": "Count"},
+                        {"Name": "PushTokenCacheInvalidations", "Unit": "Count"},
+                    ],
+                }],
+            },
+            "PushTokenCacheHits": window["hits"],
+            "PushTokenCacheMisses": window["misses"],
+            "PushTokenCacheInvalidations": window["invalidations"],
+        }))
+
+
 def send_expo_push(tokens, payload):
+    return send_push_messages(build_push_messages(tokens, payload))
+
+
+def build_push_messages(tokens, payload):
     messages = []
     # Build a descriptive push body from anomaly reasons if available
     anomaly_reasons = payload.get("anomalyReasons", [])
@@ -74,6 +268,13 @@ def send_expo_push(tokens, payload):
     else:
         body_text = "An anomaly was detected. Open the app for details."
 
+    # Coalesced alerts (lambda_function.notify_anomalies) summarise a window
+    anomaly_count = payload.get("anomalyCount", 1)
+    if anomaly_count > 1:
+        span = epoch_seconds(payload["lastTimestamp"]) - epoch_seconds(payload["firstTimestamp"])
+        minutes = max(1, round(span / 60))
+        body_text = f"{anomaly_count} anomalies in {minutes} min: {body_text}"
+
     for token in tokens:
         messages.append({
             "to": token,
@@ -83,8 +284,36 @@ def send_expo_push(tokens, payload):
             "data": payload
         })
 
-    body = json.dumps(messages).encode("utf-8")
+    return messages
+
 
+def epoch_seconds(timestamp):
+    """Readings carry epoch seconds or milliseconds; normalise to seconds."""
+    timestamp = float(timestamp)
+    if timestamp > 1e12:  # milliseconds
+        timestamp /= 1000
+    return timestamp
+
+
+def send_push_messages(messages):
+    """
+    Send push messages to Expo in chunks of EXPO_CHUNK_SIZE, up to
+    EXPO_CONCURRENCY chunks at a time. Returns the number of messages in
+    chunks that Expo accepted.
+    """
+    chunks = [messages[start:start + EXPO_CHUNK_SIZE] for start in range(0, len(messages), EXPO_CHUNK_SIZE)]
+    workers = min(EXPO_CONCURRENCY, len(chunks))
+    if workers <= 1:
+        accepted = [_send_chunk(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            accepted = list(executor.map(_send_chunk, chunks))
+    return sum(len(chunk) for chunk, ok in zip(chunks, accepted) if ok)
+
+
+def _send_chunk(chunk):
+    """POST one chunk, retrying 429/5xx and unsent requests. Returns True if accepted."""
+    body = json.dumps(chunk).encode("utf-8")
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json"
@@ -93,11 +322,141 @@ def send_expo_push(tokens, payload):
     if EXPO_ACCESS_TOKEN:
         headers["Authorization"] = f"Bearer {EXPO_ACCESS_TOKEN}"
 
-    request = urllib.request.Request(EXPO_PUSH_URL, data=body, headers=headers, method="POST")
+    retry_after = None
+    for attempt in range(EXPO_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(_retry_delay(attempt, retry_after))
+        try:
+            status, retry_after, response_body = get_expo_pool().post(body, headers)
+        except ExpoResponseLost as e:
+            logger.error(f"Expo push of {len(chunk)} messages sent but its response was lost, "
+                         f"not retrying: {str(e)}")
+            return False
+        except (OSError, http.client.HTTPException) as e:
+            logger.warning(f"Expo push attempt {attempt + 1} failed: {str(e)}")
+            retry_after = None
+            continue
 
-    try:
-        with urllib.request.urlopen(request, timeout=10) as response:
-            response_body = response.read().decode("utf-8")
-            logger.info(f"Expo response: {response.status} {response_body}")
-    except Exception as e:
-        logger.error(f"Failed to send Expo push: {str(e)}")
+        if status == 429 or status >= 500:
+            logger.warning(f"Expo push attempt {attempt + 1} returned {status}")
+            continue
+
+        logger.info(f"Expo response: {status} {response_body.decode('utf-8', 'replace')}")
+        return 200 <= status < 300
+
+    logger.error(f"Failed to send Expo push of {len(chunk)} messages after {EXPO_MAX_RETRIES + 1} attempts")
+    return False
+
+
+def _retry_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff; a Retry-After header sets the floor."""
+    delay = _backoff(attempt, EXPO_RETRY_BASE_DELAY, EXPO_RETRY_MAX_DELAY)
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), EXPO_RETRY_MAX_DELAY))
+        except ValueError:
+            pass
+    return delay
+
+
+def _backoff(attempt, base_delay, max_delay):
+    return random.uniform(0, min(base_delay * (2 ** attempt), max_delay))
+
+
+def get_expo_pool():
+    global _expo_pool
+    if _expo_pool is None:
+        _expo_pool = ExpoConnectionPool(EXPO_PUSH_URL, EXPO_CONCURRENCY, EXPO_TIMEOUT)
+    return _expo_pool
+
+
+class ExpoResponseLost(Exception):
+    """The request was sent to Expo but no complete response came back."""
+
+
+class ExpoConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to the Expo push endpoint, reused across
+    SNS records and warm invocations so only a new connection pays the TLS
+    handshake. Holds at most `size` idle connections.
+    """
+
+    # How a kept-alive connection the server has already closed fails:
+    # while the request is written, or as a disconnect before any status
+    # line. Either way the server never took the request.
+    STALE_SEND_ERRORS = (BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+    def __init__(self, url, size, timeout):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        )
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        self.size = size
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.stats = {"connections": 0, "requests": 0}
+
+    def post(self, body, headers):
+        """
+        Returns (status, Retry-After header, response body). Errors before
+        the request was sent are raised as is; a stale kept-alive connection
+        is replaced once. Errors after it was sent raise ExpoResponseLost.
+        """
+        connection, reused = self._acquire()
+        while True:
+            try:
+                connection.request("POST", self.path, body=body, headers=headers)
+            except self.STALE_SEND_ERRORS:
+                connection.close()
+                if not reused:
+                    raise
+                connection, reused = self._acquire(fresh=True)
+                continue
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                raise
+
+            try:
+                response = connection.getresponse()
+                response_body = response.read()
+                break
+            except http.client.RemoteDisconnected as e:
+                connection.close()
+                if not reused:
+                    raise ExpoResponseLost(str(e)) from e
+                connection, reused = self._acquire(fresh=True)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise ExpoResponseLost(str(e) or type(e).__name__) from e
+
+        with self.lock:
+            self.stats["requests"] += 1
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return response.status, response.getheader("Retry-After"), response_body
+
+    def _acquire(self, fresh=False):
+        with self.lock:
+            if self.idle and not fresh:
+                return self.idle.pop(), True
+            self.stats["connections"] += 1
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
@@ -0,0 +1,127 @@
+"""
+Batch ingestion load test: serial vs concurrent AWS calls.
+
+Runs handle_batch_ingestion in-process against in-memory fakes that add a
+fixed service latency to every call (BatchWriteItem, Lambda invoke, SNS
+publish), so the comparison shows how much of the batch time is spent
+waiting on round trips. Each batch size is run with BATCH_CONCURRENCY=1
+(calls issued one after another) and with --concurrency.
+
+Usage:
+  python tests/benchmark_batch_ingestion.py --concurrency 8 --repeats 5
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import lambda_function  # noqa: E402
+from benchmark_ingestion import make_reading  # noqa: E402
+from conftest import FakeDynamoDB, FakeTable  # noqa: E402
+
+
+class SlowDynamoDB(FakeDynamoDB):
+    """FakeDynamoDB with a fixed latency per BatchWriteItem call."""
+
+    def __init__(self, tables, latency_ms):
+        super().__init__(tables)
+        self.latency = latency_ms / 1000.0
+
+    def batch_write_item(self, RequestItems):
+        time.sleep(self.latency)
+        return super().batch_write_item(RequestItems)
+
+
+class SlowInferenceLambda:
+    """Threshold-scoring invoke() stand-in with a fixed latency per call."""
+
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000.0
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        time.sleep(self.latency)
+        metrics = json.loads(Payload)['metrics']
+        results = [
+            {'metric_id': m['metric_id'], 'is_anomaly': m['heart_rate'] > 120,
+             'cloud_score': 0.9 if m['heart_rate'] > 120 else 0.1}
+            for m in metrics
+        ]
+        body = json.dumps({'statusCode': 200, 'body': json.dumps({'results': results})})
+        return {'Payload': io.BytesIO(body.encode('utf-8'))}
+
+
+def run_batch_size(batch_size, concurrency, repeats, args, seed=5):
+    lambda_function.BATCH_CONCURRENCY = concurrency
+    rng = np.random.default_rng(seed)
+    timings = []
+
+    for repeat in range(repeats):
+        lambda_function.table = FakeTable(lambda_function.table_name)
+        lambda_function.dynamodb = SlowDynamoDB([lambda_function.table], args.dynamodb_ms)
+        readings = [make_reading(repeat * batch_size + i, rng) for i in range(batch_size)]
+
+        start = time.perf_counter()
+        result = lambda_function.handle_batch_ingestion(readings)
+        timings.append(time.perf_counter() - start)
+        assert result['successCount'] == batch_size
+
+    seconds = float(np.median(timings))
+    return {
+        'median_ms': round(seconds * 1000, 1),
+        'records_per_second': round(batch_size / seconds, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch Ingestion Load Test (serial vs concurrent)")
+    parser.add_argument("--batch-sizes", default="100,500,1000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--dynamodb-ms", type=float, default=8.0, help="Latency per BatchWriteItem call")
+    parser.add_argument("--invoke-ms", type=float, default=40.0, help="Latency per inference invocation")
+    parser.add_argument("--sns-ms", type=float, default=5.0, help="Latency per SNS publish")
+    parser.add_argument("--inference-batch-size", type=int, default=lambda_function.CLOUD_INFERENCE_BATCH_SIZE)
+    parser.add_argument("--output", help="Optional JSON output file")
+    args = parser.parse_args()
+
+    print("⏱️  BATCH INGESTION LOAD TEST")
+    print("=" * 70)
+
+    logging.disable(logging.WARNING)  # per-reading anomaly logs
+    sns_delay = args.sns_ms / 1000.0
+    lambda_function.cloud_inference_function = 'HealthAnomalyInference'
+    lambda_function.CLOUD_INFERENCE_BATCH_SIZE = args.inference_batch_size
+    lambda_function.lambda_client = SlowInferenceLambda(args.invoke_ms)
+    lambda_function.send_anomaly_notification = lambda message: time.sleep(sns_delay)
+
+    all_results = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'latency_ms': {'dynamodb': args.dynamodb_ms, 'invoke': args.invoke_ms, 'sns': args.sns_ms},
+    }
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        serial = run_batch_size(batch_size, 1, args.repeats, args)
+        concurrent = run_batch_size(batch_size, args.concurrency, args.repeats, args)
+        all_results[f'batch_{batch_size}'] = {'serial': serial, f'concurrency_{args.concurrency}': concurrent}
+        speedup = serial['median_ms'] / concurrent['median_ms']
+        print(f"  batch {batch_size:5d}  serial {serial['median_ms']:8.1f}ms "
+              f"({serial['records_per_second']:8.1f} rec/s)  "
+              f"concurrency={args.concurrency} {concurrent['median_ms']:8.1f}ms "
+              f"({concurrent['records_per_second']:8.1f} rec/s)  {speedup:4.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
+        print(f"\n📄 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Inference Lambda Benchmark
+
+Measures per-row cost of AnomalyDetector.predict on a synthetic
+GradientBoosting model, with and without the explanation engine.
+
+Usage:
+    python tests/benchmark_inference.py --batch-sizes 1 10 100 1000 --iterations 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.preprocessing import StandardScaler
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lambda_inference_sklearn import (  # noqa: E402
+    AnomalyDetector, PredictionCache, ScoreLookupTable, read_model_bundle, write_model_bundle
+)
+from test_lambda_inference_sklearn import make_metrics, make_training_data  # noqa: E402
+
+
+def build_detector():
+    X, y = make_training_data()
+    scaler = StandardScaler().fit(X)
+    model = GradientBoostingClassifier(
+        n_estimators=100, max_depth=4, learning_rate=0.1,
+        min_samples_leaf=5, max_features='sqrt', random_state=42
+    ).fit(scaler.transform(X), y)
+    return AnomalyDetector(model, scaler)
+
+
+def make_realistic_metrics(n, anomaly_rate=0.05, seed=11):
+    """Mostly in-range readings with a small share of anomalies, like production traffic."""
+    X, y = make_training_data(seed)
+    rng = np.random.default_rng(seed)
+    normal = X[y == 0]
+    anomalous = X[y == 1]
+    n_anomalous = int(n * anomaly_rate)
+    rows = np.vstack([
+        normal[rng.integers(0, len(normal), n - n_anomalous)],
+        anomalous[rng.integers(0, len(anomalous), n_anomalous)],
+    ])
+    return [
+        {'metric_id': f'user-1:{i}', 'heart_rate': hr, 'steps': st, 'calories': cal, 'distance': dist}
+        for i, (hr, st, cal, dist) in enumerate(rows.tolist())
+    ]
+
+
+def time_predict(detector, metrics, iterations):
+    """Median wall time of detector.predict in milliseconds."""
+    detector.predict(metrics)  # warm-up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        detector.predict(metrics)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def benchmark_explanations(detector, batch_sizes, iterations, make_batch):
+    """Per-row cost of predict() with and without explanations."""
+    results = []
+    explain = detector._explain_batch
+    no_explain = lambda features, *args: [([], {})] * len(features)  # noqa: E731
+
+    for batch_size in batch_sizes:
+        metrics = make_batch(batch_size)
+
+        detector._explain_batch = no_explain
+        without_ms = time_predict(detector, metrics, iterations)
+        detector._explain_batch = explain
+        with_ms = time_predict(detector, metrics, iterations)
+
+        row = {
+            'batch_size': batch_size,
+            'without_explanations_us_per_row': round(without_ms * 1000 / batch_size, 2),
+            'with_explanations_us_per_row': round(with_ms * 1000 / batch_size, 2),
+            'explanation_overhead_pct': round((with_ms - without_ms) / without_ms * 100, 1),
+        }
+        results.append(row)
+        print(f"  batch={batch_size:>5}  "
+              f"no-explain={row['without_explanations_us_per_row']:>9.2f}µs/row  "
+              f"explain={row['with_explanations_us_per_row']:>9.2f}µs/row  "
+              f"overhead={row['explanation_overhead_pct']:>6.1f}%")
+
+    return results
+
+
+def benchmark_engines(detector, batch_sizes, iterations, make_batch):
+    """predict() latency per inference engine: sklearn, compiled bundle and lookup table."""
+    axes = [np.linspace(30, 220, 64), np.linspace(0, 1000, 32), np.linspace(0, 200, 32), np.linspace(0, 2.5, 16)]
+    lut = ScoreLookupTable.build(detector.model, detector.scaler, axes)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model_bundle.npz')
+        write_model_bundle(path, detector.model, detector.scaler, model_version='benchmark', lut=lut)
+        with open(path, 'rb') as f:
+            data = f.read()
+    engines = {
+        'sklearn': detector,
+        'bundle': read_model_bundle(data, use_lut=False),
+        'lut': read_model_bundle(data, use_lut=True),
+    }
+
+    results = []
+    for batch_size in batch_sizes:
+        metrics = make_batch(batch_size)
+        row = {'batch_size': batch_size}
+        for name, engine in engines.items():
+            row[f'{name}_ms'] = round(time_predict(engine, metrics, iterations), 3)
+        results.append(row)
+        print(f"  batch={batch_size:>5}  " + "  ".join(
+            f"{name}={row[f'{name}_ms']:>8.3f}ms" for name in engines))
+    return results
+
+
+def make_resting_metrics(n, seed=None):
+    """Night-time traffic: resting heart rate, no movement."""
+    rng = np.random.default_rng(seed)
+    return [
+        {'metric_id': f'user-1:{i}', 'heart_rate': float(hr), 'steps': 0,
+         'calories': float(cal), 'distance': 0.0}
+        for i, (hr, cal) in enumerate(zip(rng.normal(56, 1.5, n), rng.integers(0, 2, n)))
+    ]
+
+
+def benchmark_prediction_cache(detector, batch_sizes, iterations):
+    """predict() on fresh resting batches with and without the prediction cache."""
+    results = []
+    for batch_size in batch_sizes:
+        batches = [make_resting_metrics(batch_size, seed) for seed in range(iterations)]
+
+        def run():
+            start = time.perf_counter()
+            for batch in batches:
+                detector.predict(batch)
+            return (time.perf_counter() - start) * 1000 / len(batches)
+
+        detector.cache = None
+        without_ms = min(run() for _ in range(3))
+        detector.cache = PredictionCache([1, 5, 1, 0.01], max_size=4096, ttl_seconds=300)
+        detector.predict(make_resting_metrics(200, seed=10**6))  # warm the cache
+        with_ms = min(run() for _ in range(3))
+        metrics = detector.cache.metrics()
+        detector.cache = None
+
+        row = {
+            'batch_size': batch_size,
+            'without_cache_ms': round(without_ms, 3),
+            'with_cache_ms': round(with_ms, 3),
+            'hit_rate': metrics['hit_rate'],
+        }
+        results.append(row)
+        print(f"  batch={batch_size:>5}  no-cache={without_ms:>8.3f}ms  "
+              f"cache={with_ms:>8.3f}ms  hit-rate={metrics['hit_rate']:.1%}")
+    return results
+
+
+COLD_START_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {lambda_dir!r})
+import lambda_inference_sklearn as lis
+if {engine!r} == 'bundle':
+    with open({bundle!r}, 'rb') as f:
+        detector = lis.read_model_bundle(f.read())
+else:
+    import joblib
+    detector = lis.AnomalyDetector(joblib.load({model!r}), joblib.load({scaler!r}))
+elapsed = (time.perf_counter() - start) * 1000
+# VmHWM rather than ru_maxrss: the latter keeps the forked parent's peak across exec
+with open('/proc/self/status') as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+print(elapsed, peak_kb / 1024)
+"""
+
+
+def benchmark_cold_start(detector, runs):
+    """Time a fresh interpreter importing the handler and loading each artifact format."""
+    import joblib
+
+    lambda_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {
+            'model': os.path.join(tmp, 'gradientboosting_model.pkl'),
+            'scaler': os.path.join(tmp, 'scaler.pkl'),
+            'bundle': os.path.join(tmp, 'model_bundle.npz'),
+        }
+        joblib.dump(detector.model, paths['model'])
+        joblib.dump(detector.scaler, paths['scaler'])
+        write_model_bundle(paths['bundle'], detector.model, detector.scaler, model_version='benchmark')
+
+        for engine in ('sklearn', 'bundle'):
+            code = COLD_START_SNIPPET.format(lambda_dir=lambda_dir, engine=engine, **paths)
+            timings, rss = [], []
+            for _ in range(runs):
+                out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+                elapsed, peak = map(float, out.stdout.split())
+                timings.append(elapsed)
+                rss.append(peak)
+            results[engine] = {
+                'median_ms': round(float(np.median(timings)), 1),
+                'peak_rss_mb': round(float(np.median(rss)), 1),
+                'artifact_bytes': (
+                    os.path.getsize(paths['bundle']) if engine == 'bundle'
+                    else os.path.getsize(paths['model']) + os.path.getsize(paths['scaler'])
+                ),
+            }
+            print(f"   {engine:8s} import+load {results[engine]['median_ms']:8.1f} ms   "
+                  f"peak RSS {results[engine]['peak_rss_mb']:6.1f} MB   "
+                  f"artifacts {results[engine]['artifact_bytes'] / 1024:7.1f} KB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference Lambda Benchmark")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--cold-start-runs", type=int, default=5,
+                        help="Fresh interpreters per artifact format (0 to skip)")
+    parser.add_argument("--output", help="Optional JSON output file")
+    args = parser.parse_args()
+
+    print("⏱️  INFERENCE LAMBDA BENCHMARK")
+    print("=" * 70)
+    detector = build_detector()
+
+    all_results = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    print("\n📊 Explanation engine cost (realistic traffic, 5% anomalies):")
+    all_results['explanations_realistic'] = benchmark_explanations(
+        detector, args.batch_sizes, args.iterations, make_realistic_metrics
+    )
+
+    print("\n📊 Explanation engine cost (uniform stress traffic, mostly out of range):")
+    all_results['explanations_stress'] = benchmark_explanations(
+        detector, args.batch_sizes, args.iterations, make_metrics
+    )
+
+    print("\n📊 Inference engines (realistic traffic):")
+    all_results['engines'] = benchmark_engines(
+        detector, args.batch_sizes, args.iterations, make_realistic_metrics
+    )
+
+    print("\n📊 Prediction cache (resting night traffic, fresh batches):")
+    all_results['prediction_cache'] = benchmark_prediction_cache(
+        detector, args.batch_sizes, args.iterations
+    )
+
+    if args.cold_start_runs:
+        print("\n📊 Cold start (fresh interpreter, import + artifact load):")
+        all_results['cold_start'] = benchmark_cold_start(detector, args.cold_start_runs)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
+        print(f"\n📄 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
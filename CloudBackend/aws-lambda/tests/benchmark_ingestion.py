@@ -0,0 +1,139 @@
+"""
+Ingestion latency benchmark: inline vs remote cloud inference.
+
+Runs the ingestion handler in-process against in-memory DynamoDB fakes.
+In remote mode, lambda_client.invoke is replaced by a stand-in that does what
+the real hop does on both sides: JSON-encodes the payload, runs the inference
+Lambda's handler, JSON-encodes its response and decodes it again. The network
+and invoke-service overhead of a warm RequestResponse call is not measurable
+locally, so it is modelled as a fixed delay (--invoke-overhead-ms; 0 gives
+the CPU-only comparison). Inline mode scores with the same detector in the
+ingestion process.
+
+Usage:
+  python tests/benchmark_ingestion.py --requests 300 --batch-size 50
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import lambda_function  # noqa: E402
+import lambda_inference_sklearn  # noqa: E402
+from benchmark_inference import build_detector  # noqa: E402
+from conftest import FakeDynamoDB, FakeTable  # noqa: E402
+
+
+class InProcessInferenceLambda:
+    """lambda_client stand-in that runs the inference handler behind a JSON round trip."""
+
+    def __init__(self, overhead_ms):
+        self.overhead = overhead_ms / 1000.0
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.overhead:
+            time.sleep(self.overhead)
+        response = lambda_inference_sklearn.lambda_handler(json.loads(Payload), None)
+        return {'Payload': io.BytesIO(json.dumps(response).encode('utf-8'))}
+
+
+def make_reading(i, rng):
+    anomalous = rng.random() < 0.05
+    return {
+        'userId': f'user-{i % 20}',
+        'timestamp': 1700000000000 + i * 1000,
+        'deviceId': 'watch-1',
+        'metrics': {
+            'heartRate': float(rng.normal(165, 10) if anomalous else rng.normal(72, 8)),
+            'steps': float(max(rng.normal(80, 40), 0)),
+            'calories': float(max(rng.normal(20, 6), 0)),
+            'distance': float(max(rng.normal(0.1, 0.05), 0)),
+        },
+    }
+
+
+def percentiles(timings):
+    return {
+        'p50_ms': round(float(np.percentile(timings, 50)), 3),
+        'p99_ms': round(float(np.percentile(timings, 99)), 3),
+        'mean_ms': round(float(np.mean(timings)), 3),
+    }
+
+
+def run_mode(mode, requests, batch_size, overhead_ms, seed=3):
+    lambda_function.INFERENCE_MODE = mode
+    lambda_function.lambda_client = InProcessInferenceLambda(overhead_ms)
+    rng = np.random.default_rng(seed)
+    single, batch = [], []
+    counter = 0
+
+    for _ in range(requests):
+        lambda_function.table = FakeTable(lambda_function.table_name)
+        lambda_function.dynamodb = FakeDynamoDB([lambda_function.table])
+
+        reading = make_reading(counter, rng)
+        counter += 1
+        start = time.perf_counter()
+        lambda_function.handle_single_ingestion(reading)
+        single.append((time.perf_counter() - start) * 1000)
+
+        readings = [make_reading(counter + k, rng) for k in range(batch_size)]
+        counter += batch_size
+        start = time.perf_counter()
+        lambda_function.handle_batch_ingestion(readings)
+        batch.append((time.perf_counter() - start) * 1000)
+
+    return {'single': percentiles(single), f'batch_{batch_size}': percentiles(batch)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion Latency Benchmark (inline vs remote inference)")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--invoke-overhead-ms", type=float, default=15.0,
+                        help="Modelled network/invoke overhead per remote call (warm)")
+    parser.add_argument("--output", help="Optional JSON output file")
+    args = parser.parse_args()
+
+    print("⏱️  INGESTION LATENCY BENCHMARK")
+    print("=" * 70)
+
+    detector = build_detector()
+    lambda_inference_sklearn._detector = detector
+    lambda_inference_sklearn.MODEL_ENGINE = 'sklearn'
+    lambda_function.cloud_inference_function = 'HealthAnomalyInference'
+    lambda_function._inline_inference = lambda_inference_sklearn
+    lambda_function.send_anomaly_notification = lambda message: None
+
+    all_results = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'invoke_overhead_ms': args.invoke_overhead_ms,
+    }
+    for mode in ('remote', 'inline'):
+        run_mode(mode, 20, args.batch_size, 0)  # warm-up
+        all_results[mode] = run_mode(mode, args.requests, args.batch_size, args.invoke_overhead_ms)
+
+    print(f"\n📊 {args.requests} requests per mode, remote overhead modelled as "
+          f"{args.invoke_overhead_ms:.0f} ms per invoke:")
+    for kind in all_results['remote']:
+        for mode in ('remote', 'inline'):
+            stats = all_results[mode][kind]
+            print(f"  {kind:10s} {mode:7s} p50={stats['p50_ms']:>8.3f}ms  "
+                  f"p99={stats['p99_ms']:>8.3f}ms  mean={stats['mean_ms']:>8.3f}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
+        print(f"\n📄 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
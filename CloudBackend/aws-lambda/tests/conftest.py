@@ -0,0 +1,545 @@
+"""
+Shared fixtures for the Lambda handler tests.
+
+The handlers create boto3 clients at import time, so a region is set before
+import and the module-level table/client objects are swapped for small
+in-memory fakes per test.
+"""
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class FakeTable:
+    """Minimal in-memory stand-in for a boto3 DynamoDB Table."""
+
+    def __init__(self, name='HealthMetrics'):
+        self.name = name
+        self.items = {}
+        self.calls = []
+
+    def put_item(self, Item, ReturnValues=None):
+        self.calls.append('put_item')
+        key = (Item['userId'], Item['timestamp'])
+        previous = self.items.get(key)
+        self.items[key] = dict(Item)
+        return {'Attributes': previous} if ReturnValues == 'ALL_OLD' and previous else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        self.calls.append('update_item')
+        item = self.items.setdefault((Key['userId'], Key['timestamp']), dict(Key))
+        assignments = UpdateExpression[len('SET '):].split(', ')
+        for assignment in assignments:
+            name, placeholder = [part.strip() for part in assignment.split('=')]
+            item[name] = ExpressionAttributeValues[placeholder]
+
+
+class FakeDynamoDB:
+    """Stand-in for the boto3 DynamoDB service resource."""
+
+    def __init__(self, tables, unprocessed_rounds=0):
+        self.tables = {table.name: table for table in tables}
+        self.unprocessed_rounds = unprocessed_rounds
+        self.batch_calls = 0
+        self.batch_get_calls = 0
+        self.unprocessed_get_rounds = 0
+        self.lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        # Chunks are written from a thread pool
+        with self.lock:
+            return self._batch_write_item(RequestItems)
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        self.batch_get_calls += 1
+        responses, unprocessed = {}, {}
+        for name, request in RequestItems.items():
+            assert len(request['Keys']) <= 100
+            keys = request['Keys']
+            if self.unprocessed_get_rounds > 0 and len(keys) > 1:
+                self.unprocessed_get_rounds -= 1
+                unprocessed[name] = dict(request, Keys=keys[len(keys) // 2:])
+                keys = keys[:len(keys) // 2]
+            names = request.get('ExpressionAttributeNames', {})
+            attributes = [names.get(a.strip(), a.strip()) for a in request['ProjectionExpression'].split(',')]
+            found = [self.tables[name].items.get(tuple(k.values())) for k in keys]
+            responses[name] = [{a: item[a] for a in attributes if a in item} for item in found if item]
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    def _batch_write_item(self, RequestItems):
+        self.batch_calls += 1
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            assert len(requests) <= 25
+            keys = [(r['PutRequest']['Item']['userId'], r['PutRequest']['Item']['timestamp']) for r in requests]
+            assert len(keys) == len(set(keys)), 'duplicate keys in batch'
+            if self.unprocessed_rounds > 0 and len(requests) > 1:
+                # Leave the second half unprocessed to exercise retries
+                half = len(requests) // 2
+                unprocessed[name] = requests[half:]
+                requests = requests[:half]
+            for request in requests:
+                self.tables[name].put_item(request['PutRequest']['Item'])
+        if unprocessed:
+            self.unprocessed_rounds -= 1
+        return {'UnprocessedItems': unprocessed}
+
+
+class FakePushTokenTable:
+    """HealthPushTokens stand-in: query by userId and conditional put_item."""
+
+    def __init__(self, name='HealthPushTokens'):
+        self.name = name
+        self.items = {}
+        self.queries = 0
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        from botocore.exceptions import ClientError
+
+        existing = self.items.get((Item['userId'], Item['deviceId']))
+        if ConditionExpression == 'attribute_not_exists(userId)':
+            failed = existing is not None
+        elif ConditionExpression == 'tokenVersion = :version':
+            failed = existing is None or existing.get('tokenVersion') != ExpressionAttributeValues[':version']
+        else:
+            failed = False
+        if failed:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': ''}}, 'PutItem')
+        self.items[(Item['userId'], Item['deviceId'])] = dict(Item)
+
+    def query(self, KeyConditionExpression, ConsistentRead=False):
+        self.queries += 1
+        user_id = KeyConditionExpression.get_expression()['values'][1]
+        return {'Items': [dict(item) for (user, _), item in sorted(self.items.items()) if user == user_id]}
+
+
+class FakeMetricsTable:
+    """
+    HealthMetrics stand-in for the read API: Query by userId with an
+    optional timestamp range, Limit, ExclusiveStartKey, ScanIndexForward and
+    ProjectionExpression (attribute and map paths). With IndexName the
+    modifiedAt index is queried (:from/:settled bound modifiedAt).
+    max_items_per_call emulates DynamoDB's 1 MB response limit.
+    """
+
+    def __init__(self, items=(), max_items_per_call=None):
+        self.items = {(item['userId'], item['timestamp']): item for item in items}
+        self.max_items_per_call = max_items_per_call
+        self.queries = []
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, Limit=None, ScanIndexForward=True,
+              ExclusiveStartKey=None, **kwargs):
+        self.queries.append(dict(kwargs, KeyConditionExpression=KeyConditionExpression,
+                                 ExpressionAttributeValues=ExpressionAttributeValues, Limit=Limit,
+                                 ExclusiveStartKey=ExclusiveStartKey))
+        values = ExpressionAttributeValues
+        if 'IndexName' in kwargs:
+            range_key, start, end = 'modifiedAt', values[':from'], values[':settled']
+            sort_key = lambda item: (item['modifiedAt'], item['timestamp'])  # noqa: E731
+        else:
+            range_key, start, end = 'timestamp', values.get(':start', float('-inf')), values.get(':end', float('inf'))
+            sort_key = lambda item: item['timestamp']  # noqa: E731
+        matches = sorted(
+            (item for (user, _), item in self.items.items()
+             if user == values[':userId'] and start <= item.get(range_key, start - 1) <= end),
+            key=sort_key, reverse=not ScanIndexForward
+        )
+        if ExclusiveStartKey:
+            after = sort_key(ExclusiveStartKey)
+            matches = [item for item in matches
+                       if (sort_key(item) > after if ScanIndexForward else sort_key(item) < after)]
+
+        cap = min(n for n in (Limit, self.max_items_per_call, len(matches)) if n is not None)
+        page = [dict(item) for item in matches[:cap]]
+        last = page[-1] if page else None
+        if 'ProjectionExpression' in kwargs:
+            page = [self._project(item, kwargs['ProjectionExpression'], kwargs.get('ExpressionAttributeNames', {}))
+                    for item in page]
+        response = {'Items': page, 'Count': len(page)}
+        # Like DynamoDB, a call stopped by Limit returns LastEvaluatedKey even if nothing follows
+        if page and (len(matches) > cap or cap == Limit):
+            response['LastEvaluatedKey'] = {'userId': last['userId'], 'timestamp': last['timestamp']}
+            if 'IndexName' in kwargs:
+                response['LastEvaluatedKey']['modifiedAt'] = last['modifiedAt']
+        return response
+
+    @staticmethod
+    def _project(item, expression, names):
+        projected = {}
+        for path in expression.split(','):
+            parts = [names.get(part, part) for part in path.strip().split('.')]
+            source, target = item, projected
+            for part in parts[:-1]:
+                source = source.get(part) if isinstance(source, dict) else None
+                target = target.setdefault(part, {})
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+        return {name: value for name, value in projected.items() if value != {}}
+
+
+class FakeRollupTable:
+    """
+    Rollup table stand-in: update_item with ADD counters or a conditional
+    min/max SET (the expressions lambda_function.update_rollups issues) and
+    Query by rollupKey and bucketStart range.
+    """
+
+    def __init__(self, name='HealthMetricRollups'):
+        self.name = name
+        self.items = {}
+        self.updates = 0
+        self.lock = threading.Lock()
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ConditionExpression=None,
+                    ReturnValues=None):
+        from botocore.exceptions import ClientError
+
+        with self.lock:
+            self.updates += 1
+            item = self.items.setdefault((Key['rollupKey'], Key['bucketStart']), dict(Key))
+            action, assignments = UpdateExpression.split(' ', 1)
+            if ConditionExpression:
+                name, op = ConditionExpression.split(' OR ')[1].split()[:2]
+                value = ExpressionAttributeValues[':value']
+                if name in item and not (item[name] > value if op == '>' else item[name] < value):
+                    raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': ''}},
+                                      'UpdateItem')
+            for assignment in assignments.split(', '):
+                if action == 'ADD':
+                    name, placeholder = assignment.split()
+                    item[name] = item.get(name, 0) + ExpressionAttributeValues[placeholder]
+                else:
+                    name, placeholder = [part.strip() for part in assignment.split('=')]
+                    item[name] = ExpressionAttributeValues[placeholder]
+            return {'Attributes': dict(item)} if ReturnValues == 'ALL_NEW' else {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, ExclusiveStartKey=None):
+        values = ExpressionAttributeValues
+        items = [dict(item) for (key, start), item in sorted(self.items.items())
+                 if key == values[':key'] and values[':start'] <= start <= values[':end']]
+        return {'Items': items}
+
+
+class FakeUserStateTable:
+    """
+    User state stand-in for lambda_function.update_user_state: SET and ADD
+    clauses in either order, conditions of attribute_not_exists, <= and =
+    terms joined by OR inside AND, and get_item.
+    """
+
+    def __init__(self, name='HealthUserState'):
+        self.name = name
+        self.items = {}
+        self.gets = 0
+        self.updates = 0
+        self.lock = threading.Lock()
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ConditionExpression=None):
+        from botocore.exceptions import ClientError
+
+        values = ExpressionAttributeValues
+        with self.lock:
+            self.updates += 1
+            item = self.items.get(Key['userId'], dict(Key))
+            if ConditionExpression and not self._holds(item, ConditionExpression, values):
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': ''}}, 'UpdateItem')
+            for action, clause in re.findall(r'(SET|ADD) (.*?)(?= SET | ADD |$)', UpdateExpression):
+                for assignment in clause.split(', '):
+                    if action == 'SET':
+                        name, placeholder = [part.strip() for part in assignment.split('=')]
+                        item[name] = values[placeholder]
+                    else:
+                        name, placeholder = assignment.split()
+                        item[name] = item.get(name, 0) + values[placeholder]
+            self.items[Key['userId']] = item
+
+    @staticmethod
+    def _holds(item, condition, values):
+        def term(text):
+            if text.startswith('attribute_not_exists('):
+                return text[len('attribute_not_exists('):-1] not in item
+            name, op, placeholder = text.split()
+            if name not in item:
+                return False
+            return item[name] <= values[placeholder] if op == '<=' else item[name] == values[placeholder]
+
+        return all(any(term(part) for part in clause.strip('()').split(' OR '))
+                   for clause in condition.split(' AND '))
+
+    def get_item(self, Key, ProjectionExpression=None, ConsistentRead=False):
+        self.gets += 1
+        item = self.items.get(Key['userId'])
+        return {'Item': dict(item)} if item else {}
+
+
+class FakeS3:
+    """In-memory stand-in for the boto3 S3 client: get_object and head_object."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.gets = []
+
+    def put(self, key, data):
+        self.objects[key] = data
+
+    def get_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+        self.gets.append(Key)
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        return {'ETag': '"%x"' % hash(self.objects[Key])}
+
+
+class SQLiteQueue:
+    """
+    SQS stand-in backed by an in-memory SQLite table: send_message_batch on
+    the producer side, receive_event/complete to drive a Lambda consumer
+    with SQS-shaped events and partial batch responses.
+    """
+
+    def __init__(self, fail_sends=False):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, body TEXT, in_flight INTEGER DEFAULT 0, '
+                        'receives INTEGER DEFAULT 0)')
+        self.fail_sends = fail_sends
+        self.send_calls = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        self.send_calls.append(len(Entries))
+        if self.fail_sends:
+            raise ConnectionError('queue unavailable')
+        with self.lock:
+            for entry in Entries:
+                self.db.execute('INSERT INTO messages (body) VALUES (?)', (entry['MessageBody'],))
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def depth(self):
+        return self.db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def receive_event(self, max_messages=10):
+        rows = self.db.execute('SELECT id, body FROM messages WHERE in_flight = 0 ORDER BY id LIMIT ?',
+                               (max_messages,)).fetchall()
+        self.db.executemany('UPDATE messages SET in_flight = 1, receives = receives + 1 WHERE id = ?',
+                            [(row[0],) for row in rows])
+        return {'Records': [{'messageId': str(row[0]), 'body': row[1]} for row in rows]}
+
+    def complete(self, event, response):
+        """Delete processed messages; make the reported failures visible again."""
+        failed = {f['itemIdentifier'] for f in response.get('batchItemFailures', [])}
+        for record in event['Records']:
+            if record['messageId'] in failed:
+                self.db.execute('UPDATE messages SET in_flight = 0 WHERE id = ?', (int(record['messageId']),))
+            else:
+                self.db.execute('DELETE FROM messages WHERE id = ?', (int(record['messageId']),))
+
+    def drain(self, handler, batch_size=10):
+        """Deliver batches to handler until the queue is empty; returns the responses."""
+        responses = []
+        while True:
+            event = self.receive_event(batch_size)
+            if not event['Records']:
+                return responses
+            response = handler(event, None)
+            self.complete(event, response)
+            responses.append(response)
+
+
+class FakeExpoServer:
+    """
+    Local Expo push endpoint speaking keep-alive HTTP/1.1. Answers with the
+    scripted statuses first, then 200 with one ticket per message; records
+    every request and how many connections were opened. A scripted 'drop'
+    closes the connection without taking the request (a stale keep-alive
+    socket); 'hang' takes it and closes after hang_seconds without answering.
+    """
+
+    def __init__(self, statuses=(), hang_seconds=1.0):
+        self.statuses = list(statuses)
+        self.hang_seconds = hang_seconds
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                with server.lock:
+                    status = server.statuses.pop(0) if server.statuses else 200
+                if status == 'drop':
+                    self.close_connection = True
+                    return
+                messages = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server.lock:
+                    server.requests.append((200 if status == 'hang' else status, messages))
+                if status == 'hang':
+                    # The client has timed out by now; nobody reads the answer
+                    time.sleep(server.hang_seconds)
+                    self.close_connection = True
+                    return
+                if status == 200:
+                    body = {'data': [{'status': 'ok', 'id': str(i)} for i in range(len(messages))]}
+                else:
+                    body = {'errors': [{'code': 'TOO_MANY_REQUESTS' if status == 429 else 'INTERNAL'}]}
+                encoded = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/--/api/v2/push/send'
+        threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def delivered(self):
+        return [message for status, messages in self.requests if status == 200 for message in messages]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def expo(monkeypatch):
+    """sns_to_expo pointed at a FakeExpoServer, with push tokens faked per user."""
+    import sns_to_expo
+
+    server = FakeExpoServer()
+    monkeypatch.setattr(sns_to_expo, '_expo_pool', sns_to_expo.ExpoConnectionPool(server.url, 4, 5))
+    monkeypatch.setattr(sns_to_expo, 'EXPO_CONCURRENCY', 4)
+    monkeypatch.setattr(sns_to_expo, 'EXPO_RETRY_BASE_DELAY', 0.001)
+    monkeypatch.setattr(sns_to_expo, 'get_push_tokens_batch', lambda user_ids: {
+        user_id: [f'ExponentPushToken[{user_id}-{i}]' for i in range(10)] for user_id in user_ids
+    })
+    yield SimpleNamespace(module=sns_to_expo, server=server)
+    sns_to_expo._expo_pool.close()
+    server.close()
+
+
+@pytest.fixture
+def push_tokens(monkeypatch):
+    """
+    One FakePushTokenTable shared by registration (lambda_function) and
+    lookup (sns_to_expo), with a fresh token cache on a controllable clock.
+    """
+    import lambda_function
+    import sns_to_expo
+
+    table = FakePushTokenTable()
+    resource = FakeDynamoDB([table])
+    clock = [0.0]
+    cache = sns_to_expo.PushTokenCache(300, 30, clock=lambda: clock[0])
+    monkeypatch.setattr(lambda_function, 'push_table', table)
+    monkeypatch.setattr(sns_to_expo, 'push_table', table)
+    monkeypatch.setattr(sns_to_expo, 'dynamodb', resource)
+    monkeypatch.setattr(sns_to_expo, '_push_token_cache', cache)
+    monkeypatch.setattr(sns_to_expo, 'BATCH_GET_RETRY_BASE_DELAY', 0.001)
+
+    def register(user_id, device_id, token):
+        lambda_function.handle_push_token_registration(
+            {'userId': user_id, 'deviceId': device_id, 'expoPushToken': token})
+
+    return SimpleNamespace(module=sns_to_expo, table=table, dynamodb=resource, cache=cache,
+                           clock=clock, register=register)
+
+
+def make_stored_metric(user_id, timestamp, heart_rate=72.0, **extra):
+    """A HealthMetrics item as boto3 returns it (numbers as Decimal)."""
+    from decimal import Decimal
+
+    item = {
+        'userId': user_id,
+        'timestamp': Decimal(timestamp),
+        'deviceId': 'watch-1',
+        'metrics': {'heartRate': Decimal(str(heart_rate)), 'steps': Decimal(10),
+                    'calories': Decimal('2.5'), 'distance': Decimal('0.01')},
+        'receivedAt': Decimal(timestamp + 500),
+        'modifiedAt': Decimal(timestamp + 500),
+        'anomalyDetected': False,
+    }
+    item.update(extra)
+    return item
+
+
+@pytest.fixture
+def read_api(monkeypatch):
+    """lambda_read_metrics with a FakeMetricsTable; get(path, **params) calls the handler."""
+    import json
+    import lambda_read_metrics
+
+    table = FakeMetricsTable()
+    monkeypatch.setattr(lambda_read_metrics, 'table', table)
+    monkeypatch.setattr(lambda_read_metrics, 'expected_api_key', 'test-key')
+    monkeypatch.setattr(lambda_read_metrics, 'cursor_signing_key', b'test-signing-key')
+    monkeypatch.setattr(lambda_read_metrics, 'SYNC_SETTLE_SECONDS', 35)
+    monkeypatch.setattr(lambda_read_metrics, 'user_state_table', None)
+
+    def get(path, headers=None, **params):
+        response = lambda_read_metrics.lambda_handler({
+            'httpMethod': 'GET',
+            'path': path,
+            'headers': dict({'X-API-Key': 'test-key'}, **(headers or {})),
+            'queryStringParameters': {k: str(v) for k, v in params.items()},
+        }, None)
+        response['json'] = json.loads(response['body']) if response['body'] else None
+        return response
+
+    return SimpleNamespace(module=lambda_read_metrics, table=table, get=get)
+
+
+@pytest.fixture
+def ingestion(monkeypatch):
+    """lambda_function with DynamoDB, SNS and cloud inference faked out."""
+    import lambda_function
+
+    table = FakeTable(lambda_function.table_name)
+    resource = FakeDynamoDB([table])
+    published = []
+
+    monkeypatch.setattr(lambda_function, 'table', table)
+    monkeypatch.setattr(lambda_function, 'dynamodb', resource)
+    monkeypatch.setattr(lambda_function, 'cloud_inference_function', '')
+    monkeypatch.setattr(lambda_function, 'INFERENCE_MODE', 'remote')
+    monkeypatch.setattr(lambda_function, '_inline_inference', None)
+    monkeypatch.setattr(lambda_function, '_inline_failed_at', None)
+    monkeypatch.setattr(lambda_function, 'ANOMALY_PIPELINE_MODE', 'sync')
+    monkeypatch.setattr(lambda_function, 'alert_state_table_name', '')
+    monkeypatch.setattr(lambda_function, '_alert_coalescer', None)
+    monkeypatch.setattr(lambda_function, 'rollup_table_name', '')
+    monkeypatch.setattr(lambda_function, 'user_state_table_name', '')
+    monkeypatch.setattr(lambda_function, 'BATCH_WRITE_BASE_DELAY', 0)
+    monkeypatch.setattr(lambda_function, 'send_anomaly_notification', published.append)
+
+    return SimpleNamespace(module=lambda_function, table=table, dynamodb=resource, published=published)
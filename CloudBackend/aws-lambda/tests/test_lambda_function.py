@@ -0,0 +1,603 @@
+"""Tests for the ingestion Lambda (lambda_function.py)."""
+import json
+import time
+
+
+def make_reading(i, user_id='user-1', heart_rate=72):
+    return {
+        'userId': user_id,
+        'timestamp': 1700000000000 + i * 1000,
+        'deviceId': 'watch-1',
+        'metrics': {'heartRate': heart_rate, 'steps': 10, 'calories': 2.5, 'distance': 0.01},
+    }
+
+
+def test_batch_ingestion_writes_in_chunks(ingestion):
+    readings = [make_reading(i) for i in range(60)]
+
+    result = ingestion.module.handle_batch_ingestion(readings)
+
+    assert result['successCount'] == 60
+    assert result['errorCount'] == 0
+    assert result['failures'] == []
+    assert len(ingestion.table.items) == 60
+    # 60 records -> 3 BatchWriteItem calls, no per-item put_item
+    assert ingestion.dynamodb.batch_calls == 3
+
+
+def test_batch_ingestion_retries_unprocessed_items(ingestion):
+    ingestion.dynamodb.unprocessed_rounds = 2
+    readings = [make_reading(i) for i in range(25)]
+
+    result = ingestion.module.handle_batch_ingestion(readings)
+
+    assert result['successCount'] == 25
+    assert len(ingestion.table.items) == 25
+    assert ingestion.dynamodb.batch_calls == 3
+
+
+def test_batch_ingestion_reports_per_item_failures(ingestion):
+    readings = [make_reading(0), {'userId': 'user-1', 'deviceId': 'watch-1'}, make_reading(2)]
+
+    result = ingestion.module.handle_batch_ingestion(readings)
+
+    assert result['successCount'] == 2
+    assert result['errorCount'] == 1
+    assert result['failures'][0]['index'] == 1
+    assert 'Missing required field' in result['failures'][0]['error']
+
+
+def test_malformed_metrics_fail_their_own_record_only(ingestion):
+    readings = [make_reading(0), make_reading(1), dict(make_reading(2), metrics='80'), make_reading(3)]
+    readings[1]['metrics']['heartRate'] = '80'
+
+    result = ingestion.module.handle_batch_ingestion(readings)
+
+    assert result['successCount'] == 2
+    assert [(f['index'], f['error']) for f in result['failures']] == [
+        (1, 'metrics.heartRate must be a number'), (2, 'metrics must be an object')]
+    assert len(ingestion.table.items) == 2
+
+    # Should scoring fail anyway, the threshold fallback cannot take the batch down
+    assert ingestion.module._fallback_check({'heartRate': '80'}) == {
+        'anomalyDetected': False, 'source': 'none', 'cloudScore': None, 'cloudDetected': None,
+        'anomalyReasons': [], 'cloudUnavailable': True}
+
+
+def test_batch_ingestion_persists_anomaly_attributes_in_one_write(ingestion):
+    readings = [make_reading(0), make_reading(1, heart_rate=175)]
+
+    result = ingestion.module.handle_batch_ingestion(readings)
+
+    assert result['anomaliesDetected'] == 1
+    item = ingestion.table.items[('user-1', readings[1]['timestamp'])]
+    assert item['anomalyDetected'] is True
+    assert item['anomalySource'] == 'threshold'
+    assert item['anomalyReasons']
+    assert 'update_item' not in ingestion.table.calls
+    assert len(ingestion.published) == 1
+
+
+def test_single_ingestion_stores_anomaly_with_one_write(ingestion):
+    reading = make_reading(0, heart_rate=180)
+
+    result = ingestion.module.handle_single_ingestion(reading)
+
+    assert result['anomalyDetected'] is True
+    assert ingestion.table.calls == ['put_item']
+    item = ingestion.table.items[('user-1', reading['timestamp'])]
+    assert item['anomalySource'] == 'threshold'
+    assert item['anomalyReasons']
+
+
+def test_single_ingestion_keeps_reading_when_inference_fails(ingestion, monkeypatch):
+    def timeout(*args, **kwargs):
+        raise TimeoutError('Read timeout on endpoint URL')
+
+    monkeypatch.setattr(ingestion.module, 'cloud_inference_function', 'HealthAnomalyInference')
+    monkeypatch.setattr(ingestion.module.lambda_client, 'invoke', timeout)
+    reading = make_reading(0, heart_rate=72)
+
+    result = ingestion.module.handle_single_ingestion(reading)
+
+    assert result['anomalySource'] == 'none'
+    item = ingestion.table.items[('user-1', reading['timestamp'])]
+    assert item['cloudInferenceStatus'] == 'unavailable'
+    assert ingestion.table.calls == ['put_item']
+
+
+def test_single_ingestion_keeps_reading_when_scoring_and_thresholds_fail(ingestion, monkeypatch):
+    def broken(*args, **kwargs):
+        raise TypeError('unexpected metric layout')
+
+    monkeypatch.setattr(ingestion.module, 'check_for_anomalies', broken)
+    monkeypatch.setattr(ingestion.module, '_threshold_check', broken)
+    reading = make_reading(0, heart_rate=72)
+
+    result = ingestion.module.handle_single_ingestion(reading)
+
+    assert result['anomalyDetected'] is False
+    item = ingestion.table.items[('user-1', reading['timestamp'])]
+    assert item['cloudInferenceStatus'] == 'unavailable'
+
+
+def test_single_reading_with_non_numeric_metrics_is_rejected(ingestion, monkeypatch):
+    monkeypatch.setattr(ingestion.module, 'expected_api_key', 'test-key')
+    reading = make_reading(0)
+    reading['metrics']['heartRate'] = '80'
+
+    response = ingestion.module.lambda_handler(
+        {'httpMethod': 'POST', 'headers': {'X-API-Key': 'test-key'}, 'body': json.dumps(reading)}, None)
+
+    assert response['statusCode'] == 400
+    assert 'metrics.heartRate' in json.loads(response['body'])['error']
+    assert ingestion.table.items == {}
+
+
+class FakeInferenceLambda:
+    """Answers invoke() like lambda_inference_sklearn: HR > 120 is anomalous."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        import io
+        import json
+
+        metrics = json.loads(Payload)['metrics']
+        self.payloads.append(metrics)
+        results = [
+            {
+                'metric_id': m['metric_id'],
+                'is_anomaly': m['heart_rate'] > 120,
+                'cloud_score': 0.9 if m['heart_rate'] > 120 else 0.1,
+                'anomaly_reasons': ['cloud reason'] if m['heart_rate'] > 120 else [],
+            }
+            # Reverse so the caller must map by metric_id, not position
+            for m in reversed(metrics)
+        ]
+        body = json.dumps({'statusCode': 200, 'body': json.dumps({'results': results})})
+        return {'Payload': io.BytesIO(body.encode('utf-8'))}
+
+
+def test_batch_ingestion_scores_with_chunked_cloud_invocations(ingestion, monkeypatch):
+    fake = FakeInferenceLambda()
+    monkeypatch.setattr(ingestion.module, 'cloud_inference_function', 'HealthAnomalyInference')
+    monkeypatch.setattr(ingestion.module, 'CLOUD_INFERENCE_BATCH_SIZE', 40)
+    monkeypatch.setattr(ingestion.module, 'lambda_client', fake)
+
+    readings = [make_reading(i, heart_rate=130 if i % 10 == 0 else 70) for i in range(100)]
+    # Edge-flagged readings skip cloud scoring entirely
+    readings[1]['edgeAnomalyScore'] = 0.9
+
+    result = ingestion.module.handle_batch_ingestion(readings)
+
+    # Chunks are invoked concurrently, so only their sizes are fixed
+    assert sorted(len(p) for p in fake.payloads) == [19, 40, 40]
+    assert result['anomaliesDetected'] == 11
+    item = ingestion.table.items[('user-1', readings[10]['timestamp'])]
+    assert item['anomalySource'] == 'cloud'
+    assert item['anomalyReasons'] == ['cloud reason']
+    assert ingestion.table.items[('user-1', readings[1]['timestamp'])]['anomalySource'] == 'edge'
+    assert ingestion.table.items[('user-1', readings[2]['timestamp'])]['cloudAnomalyDetected'] is False
+
+
+class FakeDetector:
+    """In-process stand-in for AnomalyDetector with the same HR > 120 rule."""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, metrics_list):
+        self.batches.append(metrics_list)
+        return [
+            {
+                'metric_id': m['metric_id'],
+                'is_anomaly': m['heart_rate'] > 120,
+                'cloud_score': 0.9 if m['heart_rate'] > 120 else 0.1,
+                'anomaly_reasons': ['inline reason'] if m['heart_rate'] > 120 else [],
+                'feature_contributions': {},
+            }
+            for m in metrics_list
+        ]
+
+
+def test_inline_mode_scores_without_invoking_lambda(ingestion, monkeypatch):
+    from types import SimpleNamespace
+
+    detector = FakeDetector()
+    remote = FakeInferenceLambda()
+    monkeypatch.setattr(ingestion.module, 'INFERENCE_MODE', 'inline')
+    monkeypatch.setattr(ingestion.module, 'cloud_inference_function', 'HealthAnomalyInference')
+    monkeypatch.setattr(ingestion.module, 'lambda_client', remote)
+    monkeypatch.setattr(ingestion.module, '_inline_inference', SimpleNamespace(load_model=lambda: detector))
+
+    readings = [make_reading(i, heart_rate=130 if i % 10 == 0 else 70) for i in range(30)]
+    result = ingestion.module.handle_batch_ingestion(readings)
+    single = ingestion.module.handle_single_ingestion(make_reading(99, heart_rate=140))
+
+    assert result['anomaliesDetected'] == 3
+    assert single['anomalySource'] == 'cloud'
+    assert [len(batch) for batch in detector.batches] == [30, 1]
+    assert remote.payloads == []
+    item = ingestion.table.items[('user-1', readings[0]['timestamp'])]
+    assert item['anomalyReasons'] == ['inline reason']
+
+
+def test_inline_mode_falls_back_to_remote_when_model_cannot_load(ingestion, monkeypatch):
+    from types import SimpleNamespace
+
+    loads = []
+
+    def broken_load():
+        loads.append(1)
+        raise RuntimeError('model bundle not found')
+
+    remote = FakeInferenceLambda()
+    monkeypatch.setattr(ingestion.module, 'INFERENCE_MODE', 'inline')
+    monkeypatch.setattr(ingestion.module, 'cloud_inference_function', 'HealthAnomalyInference')
+    monkeypatch.setattr(ingestion.module, 'lambda_client', remote)
+    monkeypatch.setattr(ingestion.module, '_inline_inference', SimpleNamespace(load_model=broken_load))
+
+    first = ingestion.module.handle_single_ingestion(make_reading(0, heart_rate=130))
+    ingestion.module.handle_single_ingestion(make_reading(1, heart_rate=70))
+
+    assert first['anomalySource'] == 'cloud'
+    assert len(remote.payloads) == 2
+    item = ingestion.table.items[('user-1', make_reading(1)['timestamp'])]
+    assert item['cloudAnomalyDetected'] is False
+    # The failed load is not retried on every reading
+    assert loads == [1]
+
+
+def enable_async(ingestion, monkeypatch, queue):
+    monkeypatch.setattr(ingestion.module, 'ANOMALY_PIPELINE_MODE', 'async')
+    monkeypatch.setattr(ingestion.module, 'anomaly_queue_url', 'https://sqs.local/anomaly-queue')
+    monkeypatch.setattr(ingestion.module, 'sqs_client', queue)
+
+
+def test_async_mode_acknowledges_before_scoring(ingestion, monkeypatch):
+    from conftest import SQLiteQueue
+
+    queue = SQLiteQueue()
+    enable_async(ingestion, monkeypatch, queue)
+    reading = make_reading(0, heart_rate=170)
+
+    result = ingestion.module.handle_single_ingestion(reading)
+
+    assert result['anomalyStatus'] == 'pending'
+    assert ingestion.published == []
+    key = ('user-1', reading['timestamp'])
+    assert ingestion.table.items[key]['anomalyStatus'] == 'pending'
+    received_at = ingestion.table.items[key]['receivedAt']
+    pending_modified_at = ingestion.table.items[key]['modifiedAt']
+
+    time.sleep(0.002)
+    queue.drain(ingestion.module.anomaly_queue_handler)
+
+    item = ingestion.table.items[key]
+    assert item['anomalyStatus'] == 'scored'
+    assert item['anomalySource'] == 'threshold'
+    assert item['receivedAt'] == received_at
+    # The verdict is a new write for delta sync
+    assert item['modifiedAt'] > pending_modified_at
+    assert len(ingestion.published) == 1
+    assert queue.depth() == 0
+
+
+def test_async_batch_is_queued_and_consumed_in_batches(ingestion, monkeypatch):
+    from conftest import SQLiteQueue
+
+    queue = SQLiteQueue()
+    enable_async(ingestion, monkeypatch, queue)
+    readings = [make_reading(i, heart_rate=170 if i % 5 == 0 else 70) for i in range(25)]
+
+    result = ingestion.module.handle_batch_ingestion(readings + [{'userId': 'broken'}])
+
+    assert result['successCount'] == 25
+    assert result['queuedCount'] == 25
+    assert result['errorCount'] == 1
+    assert sorted(queue.send_calls) == [5, 10, 10]
+    writes_before = ingestion.dynamodb.batch_calls
+
+    responses = queue.drain(ingestion.module.anomaly_queue_handler, batch_size=25)
+
+    assert responses == [{'batchItemFailures': []}]
+    # One consumer batch -> one BatchWriteItem call for all 25 verdicts
+    assert ingestion.dynamodb.batch_calls == writes_before + 1
+    # The five anomalies belong to one user and are coalesced into one alert
+    assert len(ingestion.published) == 1
+    assert ingestion.published[0]['anomalyCount'] == 5
+    assert all(item['anomalyStatus'] == 'scored' for item in ingestion.table.items.values())
+
+
+def test_async_consumer_redelivers_failed_writes(ingestion, monkeypatch):
+    from conftest import SQLiteQueue
+
+    queue = SQLiteQueue()
+    enable_async(ingestion, monkeypatch, queue)
+    ingestion.module.handle_batch_ingestion([make_reading(i) for i in range(4)])
+
+    monkeypatch.setattr(ingestion.module, 'BATCH_WRITE_MAX_RETRIES', 0)
+    ingestion.dynamodb.unprocessed_rounds = 1
+    event = queue.receive_event(10)
+    response = ingestion.module.anomaly_queue_handler(event, None)
+    queue.complete(event, response)
+
+    assert len(response['batchItemFailures']) == 2
+    assert queue.depth() == 2
+    queue.drain(ingestion.module.anomaly_queue_handler)
+    assert queue.depth() == 0
+
+
+def test_async_mode_scores_inline_when_queue_is_down(ingestion, monkeypatch):
+    from conftest import SQLiteQueue
+
+    enable_async(ingestion, monkeypatch, SQLiteQueue(fail_sends=True))
+    reading = make_reading(0, heart_rate=170)
+
+    result = ingestion.module.handle_single_ingestion(reading)
+
+    assert result['anomalyStatus'] == 'scored'
+    assert result['anomalyDetected'] is True
+    assert ingestion.table.items[('user-1', reading['timestamp'])]['anomalyStatus'] == 'scored'
+    assert len(ingestion.published) == 1
+
+
+def run_batch(ingestion, monkeypatch, readings, concurrency):
+    from conftest import FakeDynamoDB, FakeTable
+
+    table = FakeTable(ingestion.module.table_name)
+    resource = FakeDynamoDB([table], unprocessed_rounds=3)
+    published = []
+    monkeypatch.setattr(ingestion.module, 'table', table)
+    monkeypatch.setattr(ingestion.module, 'dynamodb', resource)
+    monkeypatch.setattr(ingestion.module, 'send_anomaly_notification', published.append)
+    monkeypatch.setattr(ingestion.module, 'BATCH_CONCURRENCY', concurrency)
+
+    result = ingestion.module.handle_batch_ingestion(readings)
+    items = {key: {k: v for k, v in item.items() if k not in ('receivedAt', 'modifiedAt')}
+             for key, item in table.items.items()}
+    return result, items, published
+
+
+def test_concurrent_batch_matches_serial_path(ingestion, monkeypatch):
+    monkeypatch.setattr(ingestion.module, 'cloud_inference_function', 'HealthAnomalyInference')
+    monkeypatch.setattr(ingestion.module, 'CLOUD_INFERENCE_BATCH_SIZE', 64)
+    monkeypatch.setattr(ingestion.module, 'lambda_client', FakeInferenceLambda())
+    monkeypatch.setattr(ingestion.module, 'ALERT_COALESCE_SECONDS', 0)
+    readings = [make_reading(i, user_id=f'user-{i % 7}', heart_rate=150 if i % 9 == 0 else 70)
+                for i in range(300)]
+    readings[5] = {'userId': 'user-5', 'deviceId': 'watch-1'}
+
+    serial, serial_items, serial_published = run_batch(ingestion, monkeypatch, readings, 1)
+    parallel, parallel_items, parallel_published = run_batch(ingestion, monkeypatch, readings, 8)
+
+    assert parallel == serial
+    assert parallel_items == serial_items
+    assert sorted(map(repr, parallel_published)) == sorted(map(repr, serial_published))
+    # Alerts for one user keep their batch order
+    for user in {m['userId'] for m in serial_published}:
+        timestamps = [m['timestamp'] for m in parallel_published if m['userId'] == user]
+        assert timestamps == sorted(timestamps)
+
+
+def test_alerts_are_coalesced_per_user_within_the_window(ingestion, monkeypatch):
+    clock = [1000.0]
+    coalescer = ingestion.module.AlertCoalescer(ingestion.module.InMemoryAlertStore(), 300,
+                                                clock=lambda: clock[0])
+    monkeypatch.setattr(ingestion.module, '_alert_coalescer', coalescer)
+
+    # A tachycardia episode: 3 batches of 10 anomalous readings for user-1
+    for batch in range(3):
+        readings = [make_reading(batch * 10 + i, heart_rate=175) for i in range(10)]
+        readings.append(make_reading(batch, user_id='user-2', heart_rate=70))
+        ingestion.module.handle_batch_ingestion(readings)
+        clock[0] += 60
+
+    assert len(ingestion.published) == 1
+    first = ingestion.published[0]
+    assert first['anomalyCount'] == 10
+    assert first['firstTimestamp'] == make_reading(0)['timestamp']
+    assert first['lastTimestamp'] == make_reading(9)['timestamp']
+    assert first['anomalyReasons'] == ['Heart rate 175 BPM is dangerously high (normal: 50–100 BPM)']
+    assert coalescer.stats == {'published': 1, 'suppressed': 29, 'flushed': 0}
+
+    # After the window, the next anomaly carries the suppressed ones with it
+    clock[0] += 300
+    ingestion.module.handle_single_ingestion(make_reading(40, heart_rate=180))
+
+    assert len(ingestion.published) == 2
+    summary = ingestion.published[1]
+    assert summary['anomalyCount'] == 21
+    assert summary['firstTimestamp'] == make_reading(10)['timestamp']
+    assert summary['lastTimestamp'] == make_reading(40)['timestamp']
+    # Most frequent reason first
+    assert summary['anomalyReasons'] == [
+        'Heart rate 175 BPM is dangerously high (normal: 50–100 BPM)',
+        'Heart rate 180 BPM is dangerously high (normal: 50–100 BPM)',
+    ]
+
+
+def test_pending_alerts_are_flushed_when_the_window_closes(ingestion, monkeypatch):
+    clock = [1000.0]
+    scheduled = []
+    coalescer = ingestion.module.AlertCoalescer(ingestion.module.InMemoryAlertStore(), 300,
+                                                clock=lambda: clock[0],
+                                                schedule_flush=lambda *args: scheduled.append(args))
+    monkeypatch.setattr(ingestion.module, '_alert_coalescer', coalescer)
+
+    for batch in range(3):
+        ingestion.module.handle_batch_ingestion([make_reading(batch * 10 + i, heart_rate=175) for i in range(10)])
+        clock[0] += 60
+
+    # One flush per window, due when it closes; none for the published alert
+    assert scheduled == [('user-1', 1000.0, 1300.0)]
+    assert len(ingestion.published) == 1
+
+    flush = {'Records': [{'messageId': 'm-1', 'body': json.dumps({'userId': 'user-1', 'windowStart': 1000.0})}]}
+    # Delivered early (DelaySeconds is capped): redelivered later, nothing sent
+    assert ingestion.module.alert_flush_handler(flush, None) == {'batchItemFailures': [{'itemIdentifier': 'm-1'}]}
+    assert len(ingestion.published) == 1
+
+    clock[0] = 1300.0
+    assert ingestion.module.alert_flush_handler(flush, None) == {'batchItemFailures': []}
+    assert len(ingestion.published) == 2
+    summary = ingestion.published[1]
+    assert summary['userId'] == 'user-1'
+    assert summary['anomalyCount'] == 20
+    assert summary['firstTimestamp'] == make_reading(10)['timestamp']
+    assert summary['lastTimestamp'] == make_reading(29)['timestamp']
+    assert summary['anomalyReasons'] == ['Heart rate 175 BPM is dangerously high (normal: 50–100 BPM)']
+
+    # A duplicate delivery finds nothing left, and the next anomaly opens a
+    # fresh window instead of repeating the flushed ones
+    ingestion.module.alert_flush_handler(flush, None)
+    ingestion.module.handle_single_ingestion(make_reading(40, heart_rate=180))
+    assert len(ingestion.published) == 3
+    assert ingestion.published[2]['anomalyCount'] == 1
+    assert coalescer.stats == {'published': 2, 'suppressed': 29, 'flushed': 1}
+
+
+def test_rollups_are_updated_once_per_bucket_and_served_by_summary(ingestion, monkeypatch, read_api):
+    from conftest import FakeRollupTable
+
+    rollups = FakeRollupTable()
+    ingestion.dynamodb.tables[rollups.name] = rollups
+    monkeypatch.setattr(ingestion.module, 'rollup_table_name', rollups.name)
+    monkeypatch.setattr(read_api.module, 'rollup_table', rollups)
+    hour = 1700006400000  # 2023-11-15T00:00:00Z
+    readings = [make_reading(i * 60, heart_rate=60 + i) for i in range(90)]  # 90 minutes
+    for reading in readings:
+        reading['timestamp'] = hour + (reading['timestamp'] - 1700000000000)
+    readings[10]['metrics']['heartRate'] = 180
+
+    ingestion.module.handle_batch_ingestion(readings[:60])
+    ingestion.module.handle_batch_ingestion(readings[60:])
+    ingestion.module.handle_single_ingestion(dict(make_reading(0, heart_rate=35), timestamp=hour + 95 * 60000))
+
+    hourly = rollups.items[('user-1#1h', hour // 1000)]
+    assert hourly['readingCount'] == 60
+    assert hourly['heartRateMin'] == 60
+    assert hourly['heartRateMax'] == 180
+    assert hourly['anomalyCount'] == 1
+    daily = rollups.items[('user-1#1d', hour // 1000)]
+    assert daily['readingCount'] == 91
+    assert daily['heartRateMin'] == 35
+    # Two hourly + one daily bucket per batch, not one write per reading
+    assert rollups.updates < 20
+
+    body = read_api.get('/health-data/summary', userId='user-1', granularity='1h',
+                        startDate='2023-11-15T00:30:00+00:00', endDate='2023-11-15T02:00:00+00:00')['json']
+    assert [bucket['count'] for bucket in body['buckets']] == [60, 31]
+    assert body['totals']['count'] == 91
+    assert body['totals']['heartRate']['min'] == 35
+    assert body['totals']['heartRate']['max'] == 180
+    assert body['totals']['anomalies'] == 2
+    expected_mean = (sum(60 + i for i in range(90)) - 70 + 180 + 35) / 91
+    assert abs(body['totals']['heartRate']['mean'] - expected_mean) < 0.01
+
+
+def test_rollups_count_a_reading_once_however_often_it_is_uploaded(ingestion, monkeypatch):
+    from conftest import FakeRollupTable
+
+    rollups = FakeRollupTable()
+    ingestion.dynamodb.tables[rollups.name] = rollups
+    monkeypatch.setattr(ingestion.module, 'rollup_table_name', rollups.name)
+    readings = [make_reading(i, heart_rate=60 + i) for i in range(30)]
+
+    ingestion.module.handle_batch_ingestion(readings)
+    # Still BatchWriteItem chunks, plus one BatchGetItem for the replaced rows
+    assert ingestion.dynamodb.batch_calls == 2
+    assert ingestion.dynamodb.batch_get_calls == 1
+    once = {key: dict(item) for key, item in rollups.items.items()}
+    updates = rollups.updates
+    ingestion.module.handle_batch_ingestion([dict(reading) for reading in readings])
+    ingestion.module.handle_single_ingestion(dict(readings[0]))
+
+    # Nothing new: the counters are untouched and not even written
+    assert rollups.items == once
+    assert rollups.updates == updates
+
+    # Async: the pending row was never rolled up, so its verdict write counts
+    # it once, and a redelivered queue message does not count it again
+    from conftest import SQLiteQueue
+
+    queue = SQLiteQueue()
+    enable_async(ingestion, monkeypatch, queue)
+    ingestion.module.handle_single_ingestion(make_reading(40))
+    queue.drain(ingestion.module.anomaly_queue_handler)
+    queue.db.execute("INSERT INTO messages (body) VALUES (?)",
+                     (json.dumps({'reading': make_reading(40), 'receivedAt': 0}),))
+    queue.drain(ingestion.module.anomaly_queue_handler)
+    assert rollups.items[('user-1#1h', 1699999200)]['readingCount'] == 31
+    monkeypatch.setattr(ingestion.module, 'ANOMALY_PIPELINE_MODE', 'sync')
+
+    # A corrected reading replaces its old contribution instead of adding to it
+    ingestion.module.handle_single_ingestion(dict(readings[1], metrics=dict(readings[1]['metrics'], heartRate=90)))
+    hourly = rollups.items[('user-1#1h', 1699999200)]
+    assert hourly['readingCount'] == 31
+    assert hourly['heartRateSum'] == sum(60 + i for i in range(30)) - 61 + 90 + 72
+
+
+def test_conditional_get_returns_304_until_ingestion_bumps_the_version(ingestion, monkeypatch, read_api):
+    from conftest import FakeUserStateTable
+
+    state = FakeUserStateTable()
+    ingestion.dynamodb.tables[state.name] = state
+    monkeypatch.setattr(ingestion.module, 'user_state_table_name', state.name)
+    monkeypatch.setattr(read_api.module, 'user_state_table', state)
+    ingestion.module.handle_batch_ingestion([make_reading(i) for i in range(30)])
+    assert state.items['user-1']['dataVersion'] == 30
+    # The version bump rides on the current-state update
+    assert state.updates == 1
+    for item in ingestion.table.items.values():
+        read_api.table.items[(item['userId'], item['timestamp'])] = item
+
+    first = read_api.get('/health-data/history', userId='user-1', pageSize=10)
+    etag = first['headers']['ETag']
+    queries = len(read_api.table.queries)
+    cached = read_api.get('/health-data/history', headers={'if-none-match': f'W/{etag}'}, userId='user-1', pageSize=10)
+    assert cached['statusCode'] == 304
+    assert cached['body'] == ''
+    assert len(read_api.table.queries) == queries
+    # Same version, different query: a different representation
+    other = read_api.get('/health-data/history', headers={'If-None-Match': etag}, userId='user-1', pageSize=5)
+    assert other['statusCode'] == 200
+    assert other['headers']['ETag'] != etag
+
+    ingestion.module.handle_single_ingestion(make_reading(100))
+    assert state.items['user-1']['dataVersion'] == 31
+    fresh = read_api.get('/health-data/history', headers={'If-None-Match': etag}, userId='user-1', pageSize=10)
+    assert fresh['statusCode'] == 200
+    assert fresh['headers']['ETag'] != etag
+
+
+def test_current_state_tracks_latest_reading_anomaly_and_activity(ingestion, monkeypatch, read_api):
+    from conftest import FakeUserStateTable
+
+    state = FakeUserStateTable()
+    ingestion.dynamodb.tables[state.name] = state
+    monkeypatch.setattr(ingestion.module, 'user_state_table_name', state.name)
+    monkeypatch.setattr(read_api.module, 'user_state_table', state)
+
+    def readings(indexes, activity):
+        return [dict(make_reading(i, heart_rate=180 if i == 5 else 72), activityState=activity) for i in indexes]
+
+    ingestion.module.handle_batch_ingestion(readings(range(10), 'resting'))
+    ingestion.module.handle_batch_ingestion(readings(range(10, 15), 'resting'))
+    assert state.items['user-1']['activityStateSince'] == 1700000000000
+    ingestion.module.handle_batch_ingestion(readings(range(15, 17), 'resting') + readings(range(17, 20), 'walking'))
+    # A late batch of older readings does not replace the newer state
+    ingestion.module.handle_single_ingestion(readings([3], 'running')[0])
+
+    body = read_api.get('/health/current', userId='user-1')['json']
+    assert body['latest']['id'] == f'user-1:{1700000000000 + 19 * 1000}'
+    assert body['latest']['heartRate'] == 72.0
+    assert body['activity'] == {'state': 'walking', 'since': body['activity']['since'], 'durationSeconds': 2}
+    assert body['lastAnomaly']['id'] == f'user-1:{1700000000000 + 5 * 1000}'
+    assert body['lastAnomaly']['anomalyReasons']
+    assert state.items['user-1']['dataVersion'] == 21
+
+    empty = read_api.get('/health/current', userId='nobody')['json']
+    assert empty['latest'] is None and empty['activity'] is None
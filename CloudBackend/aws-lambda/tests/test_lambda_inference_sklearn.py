@@ -0,0 +1,436 @@
+"""Tests for the cloud inference Lambda (lambda_inference_sklearn.py)."""
+import json
+
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.preprocessing import StandardScaler
+
+
+def make_training_data(seed=7):
+    rng = np.random.default_rng(seed)
+    normal = np.column_stack([
+        rng.normal(72, 10, 800), rng.normal(80, 50, 800).clip(0),
+        rng.normal(20, 8, 800).clip(0), rng.normal(0.1, 0.08, 800).clip(0),
+    ])
+    anomalous = np.column_stack([
+        rng.normal(165, 15, 200), rng.normal(20, 15, 200).clip(0),
+        rng.normal(15, 5, 200).clip(0), rng.normal(0.05, 0.03, 200).clip(0),
+    ])
+    X = np.vstack([normal, anomalous])
+    y = np.concatenate([np.zeros(len(normal)), np.ones(len(anomalous))])
+    return X, y
+
+
+@pytest.fixture(scope='module')
+def trained():
+    X, y = make_training_data()
+    scaler = StandardScaler().fit(X)
+    model = GradientBoostingClassifier(
+        n_estimators=100, max_depth=4, learning_rate=0.1,
+        min_samples_leaf=5, max_features='sqrt', random_state=42
+    ).fit(scaler.transform(X), y)
+    return model, scaler
+
+
+@pytest.fixture
+def detector(trained):
+    import lambda_inference_sklearn
+
+    model, scaler = trained
+    return lambda_inference_sklearn.AnomalyDetector(model, scaler)
+
+
+def make_metrics(n, seed=3):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'metric_id': f'user-1:{i}',
+            'heart_rate': float(rng.uniform(35, 190)),
+            'steps': float(rng.uniform(0, 900)),
+            'calories': float(rng.uniform(0, 200)),
+            'distance': float(rng.uniform(0, 3)),
+        }
+        for i in range(n)
+    ]
+
+
+def test_predict_matches_per_row_sklearn(detector, trained):
+    model, scaler = trained
+    metrics = make_metrics(200)
+
+    results = detector.predict(metrics)
+
+    for metric, result in zip(metrics, results):
+        row = scaler.transform([[metric['heart_rate'], metric['steps'], metric['calories'], metric['distance']]])
+        assert result['metric_id'] == metric['metric_id']
+        assert result['is_anomaly'] == bool(model.predict(row)[0] == 1)
+        assert result['cloud_score'] == pytest.approx(model.predict_proba(row)[0][1], abs=1e-12)
+        assert 'error' not in result
+
+
+def test_predict_isolates_invalid_rows(detector):
+    metrics = make_metrics(3)
+    metrics.insert(1, {'metric_id': 'bad', 'heart_rate': None, 'steps': 1, 'calories': 1, 'distance': 0})
+    metrics.append({'metric_id': 'nan', 'heart_rate': float('nan')})
+
+    results = detector.predict(metrics)
+
+    assert [r['metric_id'] for r in results] == ['user-1:0', 'bad', 'user-1:1', 'user-1:2', 'nan']
+    assert 'error' in results[1] and results[1]['cloud_score'] == 0.5
+    assert 'error' in results[4]
+    assert all('error' not in results[i] for i in (0, 2, 3))
+
+
+def reference_explanation(detector, raw_values, features_scaled, is_anomaly, score):
+    """Per-row explanation logic as it was before vectorization."""
+    reasons = []
+    contributions = {}
+    for name in detector.FEATURE_NAMES:
+        val = raw_values[name]
+        lo, hi, label = detector.NORMAL_RANGES[name]
+        unit = detector.FEATURE_UNITS[name]
+        if val > hi:
+            reasons.append(f"{label}: {val:.0f} {unit} is above normal range ({lo}–{hi} {unit})")
+        elif val < lo:
+            reasons.append(f"{label}: {val:.0f} {unit} is below normal range ({lo}–{hi} {unit})")
+
+    weighted = np.abs(features_scaled[0]) * detector.feature_importances
+    total = weighted.sum() if weighted.sum() > 0 else 1.0
+    for i, name in enumerate(detector.FEATURE_NAMES):
+        contributions[name] = round(float(weighted[i] / total), 4)
+    if is_anomaly and not reasons:
+        top_name = detector.FEATURE_NAMES[int(np.argmax(weighted))]
+        unit = detector.FEATURE_UNITS[top_name]
+        pct = contributions[top_name] * 100
+        reasons.append(
+            f"Unusual {top_name} value ({raw_values[top_name]:.0f} {unit}) "
+            f"contributed {pct:.0f}% to anomaly score"
+        )
+    if is_anomaly and not reasons:
+        reasons.append(f"Model confidence: {score:.1%} probability of anomaly")
+    return reasons, contributions
+
+
+def test_batch_explanations_match_per_row_reference(detector, trained):
+    _, scaler = trained
+    metrics = make_metrics(300)
+    # Boundary values and in-range anomalies
+    metrics += [
+        {'metric_id': 'edge-hi', 'heart_rate': 100, 'steps': 500, 'calories': 150, 'distance': 2.0},
+        {'metric_id': 'edge-lo', 'heart_rate': 50, 'steps': 0, 'calories': 0, 'distance': 0},
+        {'metric_id': 'mean', 'heart_rate': float(scaler.mean_[0]), 'steps': float(scaler.mean_[1]),
+         'calories': float(scaler.mean_[2]), 'distance': float(scaler.mean_[3])},
+    ]
+
+    results = detector.predict(metrics)
+
+    for metric, result in zip(metrics, results):
+        raw_values = {
+            'heartRate': float(metric['heart_rate']), 'steps': float(metric['steps']),
+            'calories': float(metric['calories']), 'distance': float(metric['distance']),
+        }
+        scaled = scaler.transform([[raw_values[name] for name in detector.FEATURE_NAMES]])
+        expected = reference_explanation(
+            detector, raw_values, scaled, result['is_anomaly'], result['cloud_score']
+        )
+        assert (result['anomaly_reasons'], result['feature_contributions']) == expected
+
+
+def test_forced_anomaly_without_range_reasons_names_top_contributor(detector, trained):
+    _, scaler = trained
+    features = np.array([[75.0, 100.0, 30.0, 0.3]])
+    reasons, contributions = detector._explain_batch(
+        features, scaler.transform(features), np.array([True]), np.array([0.8])
+    )[0]
+
+    assert len(reasons) == 1
+    assert reasons[0].startswith('Unusual ')
+    assert set(contributions) == set(detector.FEATURE_NAMES)
+
+
+def test_compiled_ensemble_reproduces_sklearn_exactly(trained):
+    from lambda_inference_sklearn import CompiledScaler, CompiledTreeEnsemble
+
+    model, scaler = trained
+    compiled = CompiledTreeEnsemble.from_sklearn(model)
+    compiled_scaler = CompiledScaler.from_sklearn(scaler)
+    X = np.random.default_rng(5).uniform([0, 0, 0, 0], [250, 2000, 500, 10], size=(5000, 4))
+
+    X_scaled = compiled_scaler.transform(X)
+    assert np.array_equal(X_scaled, scaler.transform(X))
+    assert np.array_equal(compiled.decision_function(X_scaled), model.decision_function(X_scaled))
+    assert np.array_equal(compiled.predict_proba(X_scaled), model.predict_proba(X_scaled))
+    assert np.array_equal(compiled.predict(X_scaled), model.predict(X_scaled))
+
+
+def test_compiled_ensemble_without_scipy_stays_within_a_few_ulp(trained):
+    from lambda_inference_sklearn import CompiledTreeEnsemble
+
+    model, scaler = trained
+    # A bundle round trip drops scipy's expit for numpy's exp
+    compiled = CompiledTreeEnsemble.from_arrays(CompiledTreeEnsemble.from_sklearn(model).to_arrays())
+    X_scaled = scaler.transform(np.random.default_rng(6).uniform([0, 0, 0, 0], [250, 2000, 500, 10], size=(5000, 4)))
+    assert compiled._expit is None
+
+    np.testing.assert_array_max_ulp(compiled.predict_proba(X_scaled)[:, 1], model.predict_proba(X_scaled)[:, 1], 4)
+
+
+def test_detector_results_identical_with_compiled_engine(detector, trained):
+    import lambda_inference_sklearn
+
+    model, scaler = trained
+    compiled = lambda_inference_sklearn.AnomalyDetector(
+        lambda_inference_sklearn.CompiledTreeEnsemble.from_sklearn(model),
+        lambda_inference_sklearn.CompiledScaler.from_sklearn(scaler),
+    )
+    metrics = make_metrics(300)
+
+    assert compiled.model_type == detector.model_type
+    assert compiled.predict(metrics) == detector.predict(metrics)
+
+
+def test_model_bundle_round_trip(detector, trained, tmp_path, monkeypatch):
+    import lambda_inference_sklearn
+    from conftest import FakeS3
+
+    model, scaler = trained
+    path = tmp_path / 'model_bundle.npz'
+    lambda_inference_sklearn.write_model_bundle(str(path), model, scaler, model_version='42')
+
+    s3 = FakeS3({lambda_inference_sklearn.MODEL_BUNDLE_KEY: path.read_bytes()})
+    monkeypatch.setattr(lambda_inference_sklearn, 's3_client', s3)
+    monkeypatch.setattr(lambda_inference_sklearn, '_detector', None)
+    monkeypatch.setattr(lambda_inference_sklearn, '_registry', None)
+    monkeypatch.setattr(lambda_inference_sklearn, 'MODEL_ENGINE', 'bundle')
+    monkeypatch.setattr(lambda_inference_sklearn, 'MODEL_MANIFEST_KEY', '')
+
+    bundled = lambda_inference_sklearn.load_model()
+    metrics = make_metrics(300)
+
+    assert len(s3.gets) == 1
+    assert bundled.model_version == '42'
+    # Bundles skip scipy, so scores agree with sklearn to a few ulp only
+    results, expected = bundled.predict(metrics), detector.predict(metrics)
+    np.testing.assert_array_max_ulp(
+        np.array([r.pop('cloud_score') for r in results]),
+        np.array([r.pop('cloud_score') for r in expected]), 4)
+    assert results == expected
+
+
+def test_model_bundle_rejects_unknown_format(trained, tmp_path, monkeypatch):
+    import lambda_inference_sklearn
+
+    model, scaler = trained
+    path = tmp_path / 'model_bundle.npz'
+    monkeypatch.setattr(lambda_inference_sklearn, 'BUNDLE_FORMAT_VERSION', 99)
+    lambda_inference_sklearn.write_model_bundle(str(path), model, scaler, model_version='1')
+    monkeypatch.setattr(lambda_inference_sklearn, 'BUNDLE_FORMAT_VERSION', 1)
+
+    with pytest.raises(ValueError):
+        lambda_inference_sklearn.read_model_bundle(path.read_bytes())
+
+
+def bundle_bytes(trained, tmp_path, version, threshold=0.5):
+    import lambda_inference_sklearn
+
+    model, scaler = trained
+    path = tmp_path / f'{version}.npz'
+    lambda_inference_sklearn.write_model_bundle(str(path), model, scaler, model_version=version,
+                                                threshold=threshold)
+    return path.read_bytes()
+
+
+@pytest.fixture
+def registry_s3(trained, tmp_path):
+    from conftest import FakeS3
+
+    s3 = FakeS3({
+        'versions/v1/model_bundle.npz': bundle_bytes(trained, tmp_path, 'v1'),
+        'versions/v2/model_bundle.npz': bundle_bytes(trained, tmp_path, 'v2', threshold=0.9),
+        'versions/v3/model_bundle.npz': bundle_bytes(trained, tmp_path, 'v3'),
+        'manifest.json': json.dumps({'version': 'v1'}).encode(),
+    })
+    return s3
+
+
+def make_registry(s3, clock, **kwargs):
+    from lambda_inference_sklearn import ModelRegistry
+
+    return ModelRegistry('bucket', 'model_bundle.npz', manifest_key='manifest.json',
+                         version_key_template='versions/{version}/model_bundle.npz',
+                         client=s3, clock=lambda: clock[0], **kwargs)
+
+
+def test_registry_hot_swaps_after_refresh_interval(registry_s3):
+    clock = [0.0]
+    registry = make_registry(registry_s3, clock, refresh_seconds=30)
+
+    assert registry.get().model_version == 'v1'
+    registry_s3.put('manifest.json', json.dumps({'version': 'v2'}).encode())
+
+    # Pointer is not re-read inside the refresh interval
+    clock[0] = 10
+    assert registry.get().model_version == 'v1'
+
+    # Once due, the reload runs in the background and the old model keeps serving
+    clock[0] = 31
+    assert registry.get().model_version == 'v1'
+    registry.wait_for_refresh(5)
+    assert registry.get().model_version == 'v2'
+    assert registry.get().threshold == 0.9
+    assert registry.stats['reloads'] == 1
+
+
+def test_registry_pins_versions_in_lru(registry_s3):
+    import lambda_inference_sklearn
+
+    clock = [0.0]
+    registry = make_registry(registry_s3, clock, refresh_seconds=0, cache_size=2)
+
+    assert registry.get().model_version == 'v1'
+    assert registry.get('v2').model_version == 'v2'
+    assert registry.get('v3').model_version == 'v3'
+
+    # The current version survives eviction; the least recently used pin does not
+    assert list(registry._detectors) == ['v1', 'v3']
+    gets = len(registry_s3.gets)
+    registry.get('v1')
+    registry.get('v3')
+    assert len(registry_s3.gets) == gets
+
+    with pytest.raises(lambda_inference_sklearn.UnknownModelVersion):
+        registry.get('v9')
+
+
+def test_handler_routes_requested_model_version(registry_s3, monkeypatch):
+    import lambda_inference_sklearn
+
+    clock = [0.0]
+    monkeypatch.setattr(lambda_inference_sklearn, 'MODEL_ENGINE', 'bundle')
+    monkeypatch.setattr(lambda_inference_sklearn, '_registry', make_registry(registry_s3, clock))
+    monkeypatch.setattr(lambda_inference_sklearn, '_detector', None)
+
+    def invoke(**body):
+        response = lambda_inference_sklearn.lambda_handler({'metrics': make_metrics(3), **body}, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    assert invoke()[1]['model_version'] == 'v1'
+    assert invoke(model_version='v2')[1]['model_version'] == 'v2'
+    assert invoke(model_version='missing')[0] == 404
+
+
+def test_prediction_cache_reuses_quantized_results(detector, trained):
+    from lambda_inference_sklearn import AnomalyDetector, PredictionCache
+
+    model, scaler = trained
+    cached = AnomalyDetector(model, scaler)
+    clock = [0.0]
+    cached.cache = PredictionCache([1, 5, 1, 0.01], max_size=100, ttl_seconds=60, clock=lambda: clock[0])
+
+    resting = [{'metric_id': f'r{i}', 'heart_rate': 58 + 0.2 * (i % 2), 'steps': i % 2,
+                'calories': 1, 'distance': 0} for i in range(50)]
+    first = cached.predict(resting)
+
+    # Only one quantized vector: one miss, the rest are hits
+    assert cached.cache.stats['misses'] == 1
+    assert cached.cache.stats['hits'] == 49
+    assert [r['metric_id'] for r in first] == [m['metric_id'] for m in resting]
+    expected = detector.predict(resting[:1])[0]
+    for result in first:
+        assert {k: v for k, v in result.items() if k != 'metric_id'} == \
+            {k: v for k, v in expected.items() if k != 'metric_id'}
+
+    # Results are independent copies
+    first[0]['anomaly_reasons'].append('mutated')
+    assert cached.predict(resting[:1])[0]['anomaly_reasons'] == expected['anomaly_reasons']
+
+    # Entries expire after the TTL
+    clock[0] = 61
+    cached.predict(resting[:1])
+    assert cached.cache.stats['expirations'] == 1
+    assert cached.cache.metrics()['hit_rate'] == round(50 / 52, 4)
+
+
+def test_prediction_cache_costs_come_from_real_miss_calls(trained, monkeypatch):
+    from lambda_inference_sklearn import AnomalyDetector, PredictionCache
+
+    model, scaler = trained
+    cached = AnomalyDetector(model, scaler)
+    cached.cache = PredictionCache([1, 5, 1, 0.01], max_size=100)
+    batch_sizes = []
+    predict_batch = cached._predict_batch
+    monkeypatch.setattr(cached, '_predict_batch', lambda metrics, features: (
+        batch_sizes.append(len(features)) or predict_batch(metrics, features)))
+
+    cached.predict([{'heart_rate': 60 + i, 'steps': 0, 'calories': 1, 'distance': 0} for i in range(4)])
+    cached.predict([{'heart_rate': 60 + i, 'steps': 0, 'calories': 1, 'distance': 0} for i in range(12)])
+
+    # The model only ever sees the misses: no extra calibration passes
+    assert batch_sizes == [4, 8]
+    assert cached.cache.row_cost >= 0 and cached.cache.call_cost >= 0
+    assert cached.cache.stats['time_saved_ms'] != 0
+
+
+def test_prediction_cache_keys_respect_normal_range_edges(trained):
+    from lambda_inference_sklearn import AnomalyDetector, PredictionCache
+
+    model, scaler = trained
+    cached = AnomalyDetector(model, scaler)
+    cached.cache = PredictionCache([1, 5, 1, 0.01], max_size=2)
+
+    # 99.6 and 100.4 quantize to the same BPM but fall either side of the range limit
+    results = cached.predict([
+        {'heart_rate': 99.6, 'steps': 0, 'calories': 1, 'distance': 0},
+        {'heart_rate': 100.4, 'steps': 0, 'calories': 1, 'distance': 0},
+        {'heart_rate': 140, 'steps': 0, 'calories': 1, 'distance': 0},
+    ])
+
+    assert cached.cache.stats['misses'] == 3
+    assert cached.cache.stats['evictions'] == 1
+    assert not any('Resting heart rate' in r for r in results[0]['anomaly_reasons'])
+    assert any('Resting heart rate' in r for r in results[1]['anomaly_reasons'])
+
+
+LUT_AXES = [np.linspace(30, 220, 64), np.linspace(0, 1000, 32), np.linspace(0, 200, 32), np.linspace(0, 2.5, 16)]
+
+
+@pytest.fixture(scope='module')
+def lut_bundle(trained, tmp_path_factory):
+    from lambda_inference_sklearn import ScoreLookupTable, write_model_bundle
+
+    model, scaler = trained
+    lut = ScoreLookupTable.build(model, scaler, LUT_AXES, tolerance=0.02)
+    path = tmp_path_factory.mktemp('lut') / 'model_bundle.npz'
+    write_model_bundle(str(path), model, scaler, model_version='lut-1', lut=lut)
+    return path.read_bytes()
+
+
+def test_lookup_table_engine_matches_exact_model(detector, lut_bundle):
+    from lambda_inference_sklearn import LookupTableModel, read_model_bundle
+
+    lut_detector = read_model_bundle(lut_bundle, use_lut=True)
+    assert isinstance(lut_detector.model, LookupTableModel)
+
+    metrics = make_metrics(2000)
+    expected = detector.predict(metrics)
+    actual = lut_detector.predict(metrics)
+
+    stats = lut_detector.model.stats
+    assert stats['lut_rows'] > 0 and stats['exact_rows'] > 0
+    for a, b in zip(actual, expected):
+        assert a['is_anomaly'] == b['is_anomaly']
+        assert abs(a['cloud_score'] - b['cloud_score']) <= 0.02
+
+
+def test_lookup_table_falls_back_outside_grid(detector, lut_bundle):
+    from lambda_inference_sklearn import read_model_bundle
+
+    lut_detector = read_model_bundle(lut_bundle, use_lut=True)
+    outside = [{'heart_rate': 240, 'steps': 5000, 'calories': 400, 'distance': 6.0}]
+
+    assert lut_detector.predict(outside)[0]['cloud_score'] == detector.predict(outside)[0]['cloud_score']
+    assert lut_detector.model.stats == {'lut_rows': 0, 'exact_rows': 1}
+
+    # Without the lut engine the same bundle serves the compiled trees
+    assert not hasattr(read_model_bundle(lut_bundle, use_lut=False).model, 'lut')
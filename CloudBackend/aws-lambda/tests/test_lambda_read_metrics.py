@@ -0,0 +1,302 @@
+"""Tests for the read API Lambda (lambda_read_metrics.py)."""
+import itertools
+import time
+
+from conftest import make_stored_metric
+
+COLUMNAR = 'application/vnd.healthmonitor.columnar+json'
+
+BASE_TS = 1700000000000
+
+
+def store(read_api, count, user_id='user-1', step_ms=60000):
+    for i in range(count):
+        item = make_stored_metric(user_id, BASE_TS + i * step_ms, heart_rate=60 + i % 40)
+        read_api.table.items[(user_id, item['timestamp'])] = item
+
+
+def test_history_pages_through_the_whole_range_with_cursors(read_api):
+    store(read_api, 250)
+    # Each DynamoDB call returns at most 40 items, like a 1 MB cut-off
+    read_api.table.max_items_per_call = 40
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {'userId': 'user-1', 'pageSize': 100}
+        if cursor:
+            params['cursor'] = cursor
+        body = read_api.get('/health-data/history', **params)['json']
+        pages += 1
+        seen.extend(metric['id'] for metric in body['metrics'])
+        cursor = body['nextCursor']
+        if not cursor:
+            break
+        assert body['count'] == 100
+
+    assert pages == 3
+    assert len(seen) == len(set(seen)) == 250
+    assert seen[0] == f'user-1:{BASE_TS + 249 * 60000}'
+    # Every page after the first seeks straight to its start key
+    assert all(q['ExclusiveStartKey'] for q in read_api.table.queries[3:])
+
+
+def test_history_cursor_is_bound_to_its_query_and_tamper_proof(read_api):
+    store(read_api, 30)
+    store(read_api, 30, user_id='user-2')
+    cursor = read_api.get('/health-data/history', userId='user-1', pageSize=10)['json']['nextCursor']
+
+    other_user = read_api.get('/health-data/history', userId='user-2', pageSize=10, cursor=cursor)
+    assert other_user['statusCode'] == 400
+    assert 'does not belong' in other_user['json']['error']
+
+    payload, signature = cursor.split('.')
+    tampered = read_api.get('/health-data/history', userId='user-1', pageSize=10,
+                            cursor=payload[:-2] + 'AA.' + signature)
+    assert tampered['statusCode'] == 400
+
+    next_page = read_api.get('/health-data/history', userId='user-1', pageSize=10, cursor=cursor)
+    assert next_page['statusCode'] == 200
+    assert next_page['json']['metrics'][0]['id'] == f'user-1:{BASE_TS + 19 * 60000}'
+
+
+def test_cursor_signing_key_is_never_guessable(read_api, monkeypatch):
+    derive = read_api.module.derive_cursor_signing_key
+    assert derive('explicit', 'api-key') == b'explicit'
+    # Derived from the API key, never the key itself or the table name
+    assert derive('', 'api-key') not in (b'api-key', b'HealthMetrics')
+    assert derive('', 'api-key') == derive('', 'api-key') != derive('', 'other-key')
+    assert derive('', '') is None
+
+    store(read_api, 5)
+    cursor = read_api.get('/health-data/history', userId='user-1', pageSize=3)['json']['nextCursor']
+    monkeypatch.setattr(read_api.module, 'cursor_signing_key', None)
+    # Without a key only requests that carry or receive a cursor are refused
+    assert read_api.get('/health-data/history', userId='user-1', pageSize=3)['statusCode'] == 500
+    assert read_api.get('/health-data/history', userId='user-1', pageSize=3, cursor=cursor)['statusCode'] == 500
+    assert read_api.get('/health-data/changes', userId='user-1')['statusCode'] == 500
+    whole = read_api.get('/health-data/history', userId='user-1')
+    assert whole['statusCode'] == 200
+    assert whole['json']['count'] == 5 and whole['json']['nextCursor'] is None
+    assert read_api.get('/health')['statusCode'] == 200
+    assert read_api.get('/health/current', userId='user-1')['statusCode'] != 500
+
+
+def test_metrics_accepts_limit_as_page_size_alias(read_api):
+    store(read_api, 5)
+
+    body = read_api.get('/health/metrics', userId='user-1', limit=3)['json']
+    assert body['count'] == 3
+    assert body['nextCursor']
+
+    last = read_api.get('/health/metrics', userId='user-1', limit=3, cursor=body['nextCursor'])['json']
+    assert last['count'] == 2
+    assert last['nextCursor'] is None
+    assert read_api.get('/health/metrics', userId='user-1', pageSize='many')['statusCode'] == 400
+
+
+def test_fields_projects_only_requested_attributes(read_api):
+    store(read_api, 3)
+    read_api.table.items[('user-1', BASE_TS + 5 * 60000)] = {
+        'userId': 'user-1', 'timestamp': BASE_TS + 5 * 60000, 'heartRate': 155, 'steps': 12,
+        'isAnomaly': True, 'cloudAnomalyScore': 0.9, 'anomalyReasons': ['Heart rate high'],
+    }
+
+    full = read_api.get('/health-data/history', userId='user-1', startDate='2023-11-14T00:00:00Z')['json']
+    assert 'ProjectionExpression' not in read_api.table.queries[-1]
+    assert full['metrics'][0] == {
+        'id': f'user-1:{BASE_TS + 5 * 60000}', 'timestamp': full['metrics'][0]['timestamp'],
+        'heartRate': 155.0, 'steps': 12, 'calories': 0.0, 'distance': 0.0, 'isAnomaly': True,
+        'anomalyScore': 0.9, 'activityState': None, 'anomalyReasons': ['Heart rate high'], 'anomalySource': None,
+    }
+    assert full['metrics'][1]['heartRate'] == 62.0 and full['metrics'][1]['steps'] == 10
+
+    lean = read_api.get('/health-data/history', userId='user-1', startDate='2023-11-14T00:00:00Z',
+                        fields='timestamp,heartRate')['json']
+    query = read_api.table.queries[-1]
+    assert 'anomalyReasons' not in query['ExpressionAttributeNames'].values()
+    assert query['ExpressionAttributeNames']['#ts'] == 'timestamp'
+    assert [set(metric) for metric in lean['metrics']] == [{'id', 'timestamp', 'heartRate'}] * 4
+    assert [m['heartRate'] for m in lean['metrics']] == [m['heartRate'] for m in full['metrics']]
+
+    latest = read_api.get('/health/metrics', userId='user-1', fields='isAnomaly, anomalyScore')['json']
+    assert latest['metrics'][0] == {'id': full['metrics'][0]['id'], 'timestamp': full['metrics'][0]['timestamp'],
+                                    'isAnomaly': True, 'anomalyScore': 0.9}
+
+    unknown = read_api.get('/health/metrics', userId='user-1', fields='heartRate,bloodPressure')
+    assert unknown['statusCode'] == 400
+    assert 'bloodPressure' in unknown['json']['error']
+
+
+def test_changes_returns_late_uploads_and_rewrites_once_by_modified_at(read_api):
+    now = int(time.time() * 1000)
+    for i in range(25):
+        item = make_stored_metric('user-1', BASE_TS + i * 60000, heart_rate=70, modifiedAt=now - 600000 + i)
+        read_api.table.items[('user-1', item['timestamp'])] = item
+
+    def sync(**params):
+        response = read_api.get('/health-data/changes', userId='user-1', pageSize=10, **params)
+        assert response['statusCode'] == 200
+        return response['json']
+
+    seen, body = [], sync()
+    seen.extend(metric['id'] for metric in body['metrics'])
+    while body['hasMore']:
+        body = sync(syncToken=body['syncToken'])
+        seen.extend(metric['id'] for metric in body['metrics'])
+    assert len(seen) == len(set(seen)) == 25
+    token = body['syncToken']
+    assert sync(syncToken=token)['count'] == 0
+
+    # A watch uploads an hour-old reading late, and another arrives right now
+    late = make_stored_metric('user-1', BASE_TS - 3600000, heart_rate=80, modifiedAt=now - 60000)
+    fresh = make_stored_metric('user-1', BASE_TS + 30 * 60000, heart_rate=90, modifiedAt=now)
+    for item in (late, fresh):
+        read_api.table.items[('user-1', item['timestamp'])] = item
+
+    body = sync(syncToken=token, fields='heartRate')
+    assert [(m['id'], m['heartRate']) for m in body['metrics']] == [(f'user-1:{BASE_TS - 3600000}', 80.0)]
+    assert not body['hasMore']
+    # The fresh reading is served once it has settled
+    read_api.module.SYNC_SETTLE_SECONDS = 0
+    body = sync(syncToken=body['syncToken'])
+    assert [m['heartRate'] for m in body['metrics']] == [90.0]
+
+    # An async verdict rewrites an already-synced reading, keeping its receivedAt
+    time.sleep(0.002)
+    rewritten = dict(read_api.table.items[('user-1', BASE_TS)], anomalyDetected=True,
+                     modifiedAt=int(time.time() * 1000))
+    read_api.table.items[('user-1', BASE_TS)] = rewritten
+    body = sync(syncToken=body['syncToken'], fields='isAnomaly')
+    assert [(m['id'], m['isAnomaly']) for m in body['metrics']] == [(f'user-1:{BASE_TS}', True)]
+
+    assert read_api.get('/health-data/changes', userId='user-2', syncToken=token)['statusCode'] == 400
+    assert sync(since='2100-01-01T00:00:00Z')['count'] == 0
+
+
+def test_columnar_layout_is_negotiated_and_matches_rows(read_api):
+    store(read_api, 300)
+    params = {'userId': 'user-1', 'pageSize': 300}
+    rows = read_api.get('/health-data/history', **params)
+    columnar = read_api.get('/health-data/history', headers={'Accept': COLUMNAR}, **params)
+
+    assert 'Vary' in columnar['headers']
+    assert columnar['headers']['Content-Type'] == COLUMNAR
+    assert rows['headers']['Content-Type'] == 'application/json'
+    metrics, columns = rows['json']['metrics'], columnar['json']['metrics']
+    assert columnar['json']['count'] == len(metrics) == 300
+
+    timestamps = list(itertools.accumulate(columns['timestampDeltas'], initial=columns['timestampBase']))[1:]
+    assert [f'user-1:{ts}' for ts in timestamps] == [metric['id'] for metric in metrics]
+    assert set(columns['timestampDeltas'][1:]) == {-60000}
+    for name in ('heartRate', 'steps', 'isAnomaly', 'anomalyReasons'):
+        assert columns[name] == [metric[name] for metric in metrics]
+    assert len(columnar['body']) * 2 < len(rows['body'])
+
+    lean = read_api.get('/health/metrics', headers={'accept': f'{COLUMNAR}, application/json'},
+                        userId='user-1', fields='heartRate')['json']['metrics']
+    assert set(lean) == {'timestampBase', 'timestampDeltas', 'heartRate'}
+    empty = read_api.get('/health/metrics', headers={'Accept': COLUMNAR}, userId='nobody')['json']
+    assert empty['metrics']['timestampBase'] is None and empty['count'] == 0
+
+
+def test_projection_without_metric_fields_returns_only_ids_and_timestamps(read_api):
+    store(read_api, 3)
+
+    rows = read_api.get('/health/metrics', userId='user-1', fields='id,timestamp')['json']['metrics']
+    assert [set(metric) for metric in rows] == [{'id', 'timestamp'}] * 3
+    columns = read_api.get('/health/metrics', headers={'Accept': COLUMNAR}, userId='user-1',
+                           fields='id,timestamp')['json']['metrics']
+    assert set(columns) == {'timestampBase', 'timestampDeltas'}
+    assert len(columns['timestampDeltas']) == 3
+    assert read_api.table.queries[-1]['ProjectionExpression'] == 'userId, #ts'
+
+
+def test_bulk_reads_users_concurrently_and_isolates_failures(read_api, monkeypatch):
+    for user_id in ('user-1', 'user-2', 'user-3'):
+        store(read_api, 20, user_id=user_id)
+    query = read_api.table.query
+
+    def flaky_query(**kwargs):
+        if kwargs['ExpressionAttributeValues'][':userId'] == 'user-2':
+            raise RuntimeError('ProvisionedThroughputExceededException')
+        return query(**kwargs)
+
+    monkeypatch.setattr(read_api.table, 'query', flaky_query)
+    body = read_api.get('/health/metrics/bulk', userIds='user-1,user-2,user-3,user-1,nobody', pageSize=5)['json']
+
+    assert [user['userId'] for user in body['users']] == ['user-1', 'user-2', 'user-3', 'nobody']
+    assert body['errorCount'] == 1
+    assert 'ProvisionedThroughputExceededException' in body['users'][1]['error']
+    assert [user.get('count') for user in body['users']] == [5, None, 5, 0]
+    assert body['users'][2]['metrics'][0]['id'] == f'user-3:{BASE_TS + 19 * 60000}'
+
+    # A user's cursor continues on history
+    rest = read_api.get('/health-data/history', userId='user-3', pageSize=100, cursor=body['users'][2]['nextCursor'])
+    assert rest['json']['count'] == 15
+
+    latest = read_api.get('/health/metrics/bulk', userIds='user-1,user-3', pageSize=1, fields='heartRate')['json']
+    assert [len(user['metrics']) for user in latest['users']] == [1, 1]
+    assert read_api.get('/health/metrics/bulk', userIds=','.join(f'u{i}' for i in range(101)))['statusCode'] == 400
+    assert read_api.get('/health/metrics/bulk')['statusCode'] == 400
+
+
+def test_aggregate_matches_per_bucket_reference(read_api):
+    import numpy as np
+    from datetime import datetime
+
+    rng = np.random.default_rng(7)
+    start = 1700006400000  # on an hour boundary
+    for i in range(600):
+        ts = start + i * 30000
+        heart_rate = 0 if i % 97 == 0 else round(float(rng.normal(80, 15)), 1)
+        item = make_stored_metric('user-1', ts, heart_rate=heart_rate, anomalyDetected=bool(i % 50 == 0))
+        read_api.table.items[('user-1', ts)] = item
+    read_api.table.max_items_per_call = 64
+
+    response = read_api.get('/health-data/aggregate', userId='user-1', bucket='1h',
+                            startDate=datetime.fromtimestamp(start / 1000).isoformat(),
+                            endDate=datetime.fromtimestamp((start + 600 * 30000) / 1000).isoformat())
+    body = response['json']
+
+    assert response['statusCode'] == 200
+    assert body['readings'] == 600
+    assert body['count'] == 5
+    items = sorted(read_api.table.items.values(), key=lambda item: item['timestamp'])
+    for index, bucket in enumerate(body['buckets']):
+        rows = items[index * 120:(index + 1) * 120]
+        hr = np.array([float(r['metrics']['heartRate']) for r in rows])
+        hr = hr[hr > 0]
+        assert bucket['count'] == 120
+        assert bucket['heartRate']['min'] == round(hr.min(), 2)
+        assert bucket['heartRate']['max'] == round(hr.max(), 2)
+        assert abs(bucket['heartRate']['mean'] - hr.mean()) < 0.01
+        assert abs(bucket['heartRate']['p95'] - np.percentile(hr, 95)) < 0.01
+        assert bucket['steps'] == 1200
+        assert bucket['anomalies'] == sum(bool(r['anomalyDetected']) for r in rows)
+    # Streamed through every DynamoDB page, projecting only aggregated attributes
+    assert len(read_api.table.queries) == 10
+    assert 'ProjectionExpression' in read_api.table.queries[0]
+
+
+def test_aggregate_downsamples_series_with_lttb(read_api):
+    for i in range(1000):
+        ts = BASE_TS + i * 60000
+        read_api.table.items[('user-1', ts)] = make_stored_metric('user-1', ts, heart_rate=190 if i == 437 else 70)
+
+    body = read_api.get('/health-data/aggregate', userId='user-1', bucket='1d', downsample=50,
+                        startDate='2023-11-14T00:00:00')['json']
+
+    series = body['series']
+    assert len(series) == 50
+    assert max(point['heartRate'] for point in series) == 190
+    assert series[0]['timestamp'] < series[-1]['timestamp']
+
+
+def test_aggregate_validates_parameters(read_api):
+    get = read_api.get
+    assert get('/health-data/aggregate', userId='user-1', startDate='2024-01-01', bucket='2h')['statusCode'] == 400
+    assert get('/health-data/aggregate', userId='user-1', bucket='1h')['statusCode'] == 400
+    too_many = get('/health-data/aggregate', userId='user-1', bucket='1m',
+                   startDate='2024-01-01T00:00:00Z', endDate='2024-03-01T00:00:00Z')
+    assert too_many['statusCode'] == 400
+    assert 'larger bucket' in too_many['json']['error']
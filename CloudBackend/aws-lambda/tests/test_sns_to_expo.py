@@ -0,0 +1,156 @@
+"""Tests for the SNS -> Expo push Lambda (sns_to_expo.py)."""
+import json
+
+
+def sns_event(user_ids):
+    return {
+        'Records': [
+            {'Sns': {'Message': json.dumps({'userId': user_id, 'anomalyReasons': ['Heart rate high']})}}
+            for user_id in user_ids
+        ]
+    }
+
+
+def test_batch_is_chunked_and_sent_over_reused_connections(expo):
+    # 25 users x 10 tokens -> 250 messages -> chunks of 100, 100, 50
+    result = expo.module.lambda_handler(sns_event([f'user-{i}' for i in range(25)]), None)
+
+    assert result['statusCode'] == 200
+    assert sorted(len(messages) for _, messages in expo.server.requests) == [50, 100, 100]
+    assert len(expo.server.delivered()) == 250
+    assert expo.server.connections <= 3
+
+    # A warm invocation reuses the pooled connections
+    connections = expo.server.connections
+    expo.module.lambda_handler(sns_event(['user-0']), None)
+
+    assert expo.server.connections == connections
+    assert len(expo.server.delivered()) == 260
+
+
+def test_rate_limited_and_server_errors_are_retried(expo):
+    expo.server.statuses = [429, 503]
+
+    sent = expo.module.send_expo_push(['ExponentPushToken[a]'], {'userId': 'user-1'})
+
+    assert sent == 1
+    assert [status for status, _ in expo.server.requests] == [429, 503, 200]
+    assert len(expo.server.delivered()) == 1
+
+
+def test_chunk_is_dropped_after_max_retries(expo, monkeypatch):
+    monkeypatch.setattr(expo.module, 'EXPO_MAX_RETRIES', 2)
+    expo.server.statuses = [500] * 5
+
+    sent = expo.module.send_expo_push(['ExponentPushToken[a]'], {'userId': 'user-1'})
+
+    assert sent == 0
+    assert len(expo.server.requests) == 3
+
+
+def test_stale_keep_alive_connection_is_replaced_once(expo):
+    expo.module.send_expo_push(['ExponentPushToken[a]'], {'userId': 'user-1'})
+    expo.server.statuses = ['drop']
+
+    sent = expo.module.send_expo_push(['ExponentPushToken[b]'], {'userId': 'user-1'})
+
+    assert sent == 1
+    assert [message['to'] for message in expo.server.delivered()] == ['ExponentPushToken[a]', 'ExponentPushToken[b]']
+    assert expo.server.connections == 2
+
+
+def test_lost_response_is_not_resent(expo, monkeypatch):
+    monkeypatch.setattr(expo.module, '_expo_pool', expo.module.ExpoConnectionPool(expo.server.url, 4, 0.2))
+    expo.server.hang_seconds = 0.5
+    expo.server.statuses = ['hang']
+
+    sent = expo.module.send_expo_push(['ExponentPushToken[a]'], {'userId': 'user-1'})
+
+    # Expo took the request once; resending it could notify the user twice
+    assert sent == 0
+    assert len(expo.server.requests) == 1
+
+
+def test_retry_delay_is_jittered_and_honours_retry_after(expo):
+    delays = {expo.module._retry_delay(3) for _ in range(20)}
+
+    assert len(delays) > 1
+    assert all(0 <= delay <= expo.module.EXPO_RETRY_BASE_DELAY * 8 for delay in delays)
+    assert expo.module._retry_delay(1, retry_after='2') >= 2
+
+
+def test_coalesced_alert_body_spans_seconds_or_millisecond_timestamps(expo):
+    summary = {'anomalyCount': 12, 'anomalyReasons': ['Heart rate high']}
+    for first, last in ((1700000000, 1700000600), (1700000000000, 1700000600000)):
+        [message] = expo.module.build_push_messages(['token'], dict(summary, firstTimestamp=first, lastTimestamp=last))
+        assert message['body'] == '12 anomalies in 10 min: Heart rate high'
+
+
+def test_token_lookups_are_batched_and_cached(push_tokens):
+    push_tokens.register('user-1', 'phone', 'ExponentPushToken[a]')
+    push_tokens.register('user-1', 'tablet', 'ExponentPushToken[b]')
+    push_tokens.register('user-2', 'phone', 'ExponentPushToken[c]')
+    push_tokens.dynamodb.unprocessed_get_rounds = 1
+    queries = push_tokens.table.queries
+
+    tokens = push_tokens.module.get_push_tokens_batch(['user-1', 'user-2', 'user-1', 'user-3'])
+
+    assert tokens == {
+        'user-1': ['ExponentPushToken[a]', 'ExponentPushToken[b]'],
+        'user-2': ['ExponentPushToken[c]'],
+        'user-3': [],
+    }
+    # One BatchGetItem (plus one retry of its unprocessed keys); only user-3,
+    # who has no summary item, falls back to a Query
+    assert push_tokens.dynamodb.batch_get_calls == 2
+    assert push_tokens.table.queries == queries + 1
+    assert push_tokens.cache.stats == {'hits': 0, 'misses': 3, 'invalidations': 0}
+
+    # An all-hit batch makes no DynamoDB calls at all
+    assert push_tokens.module.get_push_tokens_batch(['user-2', 'user-1']) == {
+        'user-2': ['ExponentPushToken[c]'],
+        'user-1': ['ExponentPushToken[a]', 'ExponentPushToken[b]'],
+    }
+    assert push_tokens.dynamodb.batch_get_calls == 2
+    assert push_tokens.table.queries == queries + 1
+    assert push_tokens.cache.stats == {'hits': 2, 'misses': 3, 'invalidations': 0}
+
+
+def test_registration_bumps_token_version_and_refresh_invalidates(push_tokens):
+    push_tokens.register('user-1', 'phone', 'ExponentPushToken[old]')
+    assert push_tokens.module.get_push_tokens_batch(['user-1']) == {'user-1': ['ExponentPushToken[old]']}
+
+    push_tokens.register('user-1', 'phone', 'ExponentPushToken[new]')
+    summary = push_tokens.table.items[('user-1', '#tokens')]
+    assert summary['tokenVersion'] == 2
+    assert summary['expoPushTokens'] == ['ExponentPushToken[new]']
+
+    # Served from the cache until the TTL runs out
+    assert push_tokens.module.get_push_tokens_batch(['user-1']) == {'user-1': ['ExponentPushToken[old]']}
+    push_tokens.clock[0] += 301
+    assert push_tokens.module.get_push_tokens_batch(['user-1']) == {'user-1': ['ExponentPushToken[new]']}
+    assert push_tokens.cache.stats['invalidations'] == 1
+
+
+def test_registration_rejects_the_summary_device_id(push_tokens, monkeypatch):
+    import lambda_function
+
+    monkeypatch.setattr(lambda_function, 'expected_api_key', 'test-key')
+    response = lambda_function.lambda_handler({
+        'httpMethod': 'POST',
+        'path': '/notifications/register',
+        'headers': {'X-API-Key': 'test-key'},
+        'body': json.dumps({'userId': 'user-1', 'deviceId': '#tokens', 'expoPushToken': 'ExponentPushToken[x]'}),
+    }, None)
+
+    assert response['statusCode'] == 400
+    assert push_tokens.table.items == {}
+
+
+def test_users_without_tokens_are_rechecked_sooner(push_tokens):
+    assert push_tokens.module.get_push_tokens_batch(['user-9']) == {'user-9': []}
+    push_tokens.register('user-9', 'phone', 'ExponentPushToken[first]')
+
+    push_tokens.clock[0] += 31
+
+    assert push_tokens.module.get_push_tokens_batch(['user-9']) == {'user-9': ['ExponentPushToken[first]']}
@@ -0,0 +1,138 @@
+"""
+Precompute a dense score lookup table for the GradientBoosting anomaly model
+and export it inside the Lambda model bundle (MODEL_ENGINE=lut).
+
+The model takes four bounded features, so its raw score is evaluated once
+over a uniform grid (heartRate × steps × calories × distance). At inference
+time a reading inside the grid is answered by indexing its cell and
+interpolating the cell corners; cells whose corners disagree by more than
+--tolerance, and readings outside the grid, fall back to the exact trees.
+
+The error bound is measured against the exact model on a sample of uniform
+random points inside the grid plus the training/validation readings (if
+--data is given), and recorded in the bundle metadata.
+
+Usage:
+  python src/models/build_score_lut.py \
+    --model models/saved_models/best_anomaly_gradientboosting.pkl \
+    --scaler models/saved_models/best_anomaly_scaler.pkl \
+    --data data/processed/health_metrics.csv \
+    --output models/lambda_export/model_bundle.npz
+
+Outputs:
+  models/lambda_export/model_bundle.npz (bundle with lookup table)
+  models/lambda_export/score_lut_report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+LAMBDA_SRC_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "CloudBackend", "aws-lambda")
+)
+
+# feature=low:high:points, in AnomalyDetector.FEATURE_NAMES order
+DEFAULT_GRID = "heartRate=30:220:64,steps=0:1000:32,calories=0:200:32,distance=0:2.5:16"
+
+
+def parse_grid(spec, feature_names):
+    """'name=low:high:points,...' -> list of uniformly spaced axes in feature order."""
+    bounds = {}
+    for part in spec.split(','):
+        name, values = part.split('=')
+        low, high, points = values.split(':')
+        bounds[name.strip()] = (float(low), float(high), int(points))
+    missing = [name for name in feature_names if name not in bounds]
+    if missing:
+        raise ValueError(f"Grid spec is missing features: {missing}")
+    return [np.linspace(*bounds[name]) for name in feature_names]
+
+
+def measure_lut_error(lut, model, scaler, samples):
+    """Compare the lookup table against the exact model on raw feature rows."""
+    scaled = scaler.transform(samples)
+    exact = model.predict_proba(scaled)[:, 1]
+
+    rows, raw = lut.in_scaled_space(scaler.mean_, scaler.scale_).lookup(scaled)
+    approx = 1.0 / (1.0 + np.exp(-raw))
+    error = np.abs(approx - exact[rows])
+    flips = (approx >= 0.5) != (exact[rows] >= 0.5)
+
+    return {
+        'samples': int(len(samples)),
+        'lut_coverage': round(len(rows) / max(len(samples), 1), 4),
+        'max_abs_error': round(float(error.max()), 6) if len(rows) else 0.0,
+        'p99_abs_error': round(float(np.percentile(error, 99)), 6) if len(rows) else 0.0,
+        'mean_abs_error': round(float(error.mean()), 6) if len(rows) else 0.0,
+        'decision_flip_rate': round(float(flips.mean()), 6) if len(rows) else 0.0,
+    }
+
+
+def sample_grid(axes, n, seed=42):
+    """Uniform random points inside the grid bounds."""
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(axis[0], axis[-1], n) for axis in axes])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the score lookup table bundle for Lambda")
+    parser.add_argument("--model", default="models/saved_models/best_anomaly_gradientboosting.pkl")
+    parser.add_argument("--scaler", default="models/saved_models/best_anomaly_scaler.pkl")
+    parser.add_argument("--data", help="Optional CSV with heartRate/steps/calories/distance columns "
+                                       "to include in the error measurement")
+    parser.add_argument("--grid", default=DEFAULT_GRID)
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="Max probability spread across a cell's corners for the table to answer it")
+    parser.add_argument("--samples", type=int, default=200000,
+                        help="Uniform random grid points used to measure the error bound")
+    parser.add_argument("--output", default="models/lambda_export/model_bundle.npz")
+    parser.add_argument("--report", default="models/lambda_export/score_lut_report.json")
+    parser.add_argument("--version", default=time.strftime("%Y%m%d%H%M%S", time.gmtime()),
+                        help="Model version recorded in the bundle (default: UTC timestamp)")
+    args = parser.parse_args()
+
+    # The bundle and lookup table formats are owned by the inference Lambda
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, LAMBDA_SRC_DIR)
+    from lambda_inference_sklearn import AnomalyDetector, ScoreLookupTable, write_model_bundle
+
+    model = joblib.load(args.model)
+    scaler = joblib.load(args.scaler)
+    axes = parse_grid(args.grid, AnomalyDetector.FEATURE_NAMES)
+
+    print(f"🧮 Evaluating model on {'×'.join(str(len(a)) for a in axes)} grid...")
+    start = time.time()
+    lut = ScoreLookupTable.build(model, scaler, axes, tolerance=args.tolerance)
+    print(f"   Built in {time.time() - start:.1f}s, "
+          f"{lut.values.nbytes / 1e6:.1f} MB scores, "
+          f"{lut.confident.mean():.1%} of cells confident")
+
+    print("📏 Measuring error against the exact model...")
+    report = {'grid_uniform': measure_lut_error(lut, model, scaler, sample_grid(axes, args.samples))}
+    if args.data:
+        import pandas as pd
+        readings = pd.read_csv(args.data)[AnomalyDetector.FEATURE_NAMES].dropna().to_numpy(dtype=np.float64)
+        report['data'] = measure_lut_error(lut, model, scaler, readings)
+    for name, stats in report.items():
+        print(f"   {name:12s} coverage={stats['lut_coverage']:.1%}  max|Δp|={stats['max_abs_error']:.4f}  "
+              f"p99|Δp|={stats['p99_abs_error']:.4f}  flips={stats['decision_flip_rate']:.4%}")
+
+    lut.report.update(report)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    metadata = write_model_bundle(args.output, model, scaler, args.version, lut=lut)
+    with open(args.report, 'w') as f:
+        json.dump(lut.report, f, indent=2)
+
+    size_mb = os.path.getsize(args.output) / 1e6
+    print(f"✓ Exported {metadata['model_type']} v{metadata['model_version']} with lookup table "
+          f"to {args.output} ({size_mb:.1f} MB)")
+    print(f"✓ Error report: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
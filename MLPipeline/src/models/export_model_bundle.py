@@ -0,0 +1,57 @@
+"""
+Export the trained GradientBoosting anomaly model as a single, pickle-free
+bundle for the inference Lambda (MODEL_ENGINE=bundle).
+
+The bundle is an uncompressed .npz holding the scaler mean/scale, the
+flattened tree arrays and a JSON metadata record (feature names, decision
+threshold, NORMAL_RANGES, format and model versions). The Lambda loads it
+with one S3 GET and never imports scikit-learn.
+
+Usage:
+  python src/models/export_model_bundle.py \
+    --model models/saved_models/best_anomaly_gradientboosting.pkl \
+    --scaler models/saved_models/best_anomaly_scaler.pkl \
+    --output models/lambda_export/model_bundle.npz
+
+Outputs:
+  models/lambda_export/model_bundle.npz
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+
+LAMBDA_SRC_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "CloudBackend", "aws-lambda")
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export GradientBoosting model bundle for Lambda")
+    parser.add_argument("--model", default="models/saved_models/best_anomaly_gradientboosting.pkl")
+    parser.add_argument("--scaler", default="models/saved_models/best_anomaly_scaler.pkl")
+    parser.add_argument("--output", default="models/lambda_export/model_bundle.npz")
+    parser.add_argument("--version", default=time.strftime("%Y%m%d%H%M%S", time.gmtime()),
+                        help="Model version recorded in the bundle (default: UTC timestamp)")
+    args = parser.parse_args()
+
+    # The bundle format is owned by the inference Lambda; reuse its writer
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, LAMBDA_SRC_DIR)
+    from lambda_inference_sklearn import write_model_bundle
+
+    model = joblib.load(args.model)
+    scaler = joblib.load(args.scaler)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    metadata = write_model_bundle(args.output, model, scaler, args.version)
+
+    size_kb = os.path.getsize(args.output) / 1024
+    print(f"✓ Exported {metadata['model_type']} v{metadata['model_version']} "
+          f"(format {metadata['format_version']}) to {args.output} ({size_kb:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
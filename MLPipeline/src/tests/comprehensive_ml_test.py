@@ -1087,6 +1087,92 @@ def test_better_activity_classifiers(verbose=True):
     return results
 
 
+# ──────────────────────────────────────────────
+# TEST 8: COMPILED TREE ENSEMBLE PARITY
+# (NumPy evaluator used by the inference Lambda)
+# ──────────────────────────────────────────────
+
+LAMBDA_SRC_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "CloudBackend", "aws-lambda")
+)
+
+
+def test_compiled_tree_ensemble(verbose=True):
+    """Check the Lambda's compiled GradientBoosting evaluator reproduces sklearn exactly."""
+    if verbose:
+        print("\n" + "=" * 70)
+        print("TEST 8: COMPILED TREE ENSEMBLE PARITY (Lambda NumPy engine)")
+        print("=" * 70)
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    if LAMBDA_SRC_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_SRC_DIR)
+    from lambda_inference_sklearn import CompiledScaler, CompiledTreeEnsemble
+
+    # Same data and model configuration as TEST 6
+    X_normal = generate_normal_samples(5000, seed=42)
+    X_anomaly = generate_anomalous_samples(1000, seed=123)
+    X_all = np.concatenate([X_normal, X_anomaly])
+    y_all = np.concatenate([np.zeros(len(X_normal)), np.ones(len(X_anomaly))])
+    X_train, X_test, y_train, _ = train_test_split(
+        X_all, y_all, test_size=0.3, random_state=42, stratify=y_all
+    )
+
+    scaler = StandardScaler().fit(X_train)
+    model = GradientBoostingClassifier(
+        n_estimators=100, max_depth=4, learning_rate=0.1,
+        min_samples_leaf=5, max_features='sqrt',
+        random_state=42
+    ).fit(scaler.transform(X_train), y_train)
+
+    compiled = CompiledTreeEnsemble.from_sklearn(model)
+    compiled_scaler = CompiledScaler.from_sklearn(scaler)
+
+    datasets = {
+        "test_split": X_test,
+        "all_samples": X_all,
+        "edge_cases": np.concatenate(list(generate_edge_cases().values())),
+    }
+
+    results = {"n_trees": int(len(compiled.roots)), "n_nodes": int(len(compiled.feature)), "datasets": {}}
+    all_exact = True
+    for name, X in datasets.items():
+        X_s = scaler.transform(X)
+        proba_sklearn = model.predict_proba(X_s)
+        proba_compiled = compiled.predict_proba(compiled_scaler.transform(X))
+        exact = bool(np.array_equal(proba_sklearn, proba_compiled))
+        all_exact &= exact
+        results["datasets"][name] = {
+            "n_samples": int(len(X)),
+            "exact_match": exact,
+            "max_abs_diff": float(np.max(np.abs(proba_sklearn - proba_compiled))),
+        }
+        if verbose:
+            print(f"  {'✅' if exact else '❌'} {name:12s}: {len(X):5d} samples, "
+                  f"max |Δp| = {results['datasets'][name]['max_abs_diff']:.2e}")
+
+    # Per-call latency, the cost that dominates small Lambda batches
+    X_s = scaler.transform(X_test)
+    for batch_size in (1, 100, 1000):
+        batch = X_s[:batch_size]
+        timings = {}
+        for engine, fn in (("sklearn", model.predict_proba), ("compiled", compiled.predict_proba)):
+            fn(batch)
+            start = time.perf_counter()
+            for _ in range(20):
+                fn(batch)
+            timings[engine] = (time.perf_counter() - start) / 20 * 1000
+        results[f"latency_ms_batch_{batch_size}"] = {k: round(v, 3) for k, v in timings.items()}
+        if verbose:
+            print(f"  ⏱️  batch={batch_size:<5d} sklearn={timings['sklearn']:.3f}ms  "
+                  f"compiled={timings['compiled']:.3f}ms")
+
+    results["exact_match"] = all_exact
+    if not all_exact:
+        raise AssertionError("Compiled tree ensemble diverges from sklearn predict_proba")
+    return results
+
+
 # ──────────────────────────────────────────────
 # MAIN
 # ──────────────────────────────────────────────
@@ -1136,6 +1222,12 @@ def main():
     except Exception as e:
         all_results["tests"]["supervised_anomaly_models"] = {"error": str(e), "traceback": traceback.format_exc()}
 
+    # Test 4b: Compiled tree ensemble parity (inference Lambda engine)
+    try:
+        all_results["tests"]["compiled_tree_ensemble"] = test_compiled_tree_ensemble(args.verbose)
+    except Exception as e:
+        all_results["tests"]["compiled_tree_ensemble"] = {"error": str(e), "traceback": traceback.format_exc()}
+
     # Test 5: Better activity classifiers
     try:
         all_results["tests"]["better_activity_classifiers"] = test_better_activity_classifiers(args.verbose)
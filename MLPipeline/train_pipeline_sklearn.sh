@@ -178,6 +178,15 @@ with open('models/lambda_export/metadata.json', 'w') as f:
 print(f"   Models saved to models/lambda_export/ (type: {model_type})")
 EOF
 
+if [ -f models/saved_models/best_anomaly_gradientboosting.pkl ]; then
+    if [ "${BUILD_SCORE_LUT:-0}" = "1" ]; then
+        # Bundle with a precomputed score grid (MODEL_ENGINE=lut)
+        python src/models/build_score_lut.py --data data/processed/health_metrics.csv
+    else
+        python src/models/export_model_bundle.py
+    fi
+fi
+
 echo "✓ Exported to models/lambda_export/"
 echo ""
 
@@ -192,6 +201,7 @@ echo "  📄 models/saved_models/best_anomaly_gradientboosting.pkl (best)"
 echo "  📊 models/saved_models/best_anomaly_scaler.pkl"
 echo "  📦 models/lambda_export/model.pkl"
 echo "  📋 models/lambda_export/metadata.json"
+echo "  🗜️  models/lambda_export/model_bundle.npz (pickle-free, MODEL_ENGINE=bundle)"
 echo ""
 echo "Model Info:"
 echo "  Best:     Gradient Boosting (supervised, F1~0.995)"